@@ -0,0 +1,178 @@
+import logging
+import subprocess
+import threading
+from concurrent.futures import Future, TimeoutError
+from contextlib import contextmanager
+
+# Echoed by the shell after every batch, the device ran the inputs written before it
+SENTINEL = 'adbshell-done-'
+
+
+class AdbShell():
+    def __init__(self, serial=None, adb='adb', timeout=5.0):
+        '''
+        One long lived 'adb shell' per device, input commands are written to its stdin
+
+            : param serial = None: device serial, the only connected device if empty
+
+            : param adb = 'adb': path of the adb executable
+
+            : param timeout = 5.0: seconds to wait for the device to run a batch
+        '''
+        self.serial = serial
+        self.adb = adb
+        self.timeout = timeout
+        self._process = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._sequence = 0
+        # sentinel number -> (process, Future) of the batches the device has not run yet
+        self._pending = {}
+
+    def command(self, *args):
+        cmd = [self.adb]
+        if self.serial:
+            cmd += ['-s', self.serial]
+        return cmd + list(args)
+
+    def _open(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(self.command('shell'), stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+            reader = threading.Thread(None, self._read, 'AdbShell-%s' % (self.serial or 'default'), (self._process,))
+            reader.daemon = True
+            reader.start()
+        return self._process
+
+    def _read(self, process):
+        '''
+        Resolve the batches whose sentinel the shell echoed, fail the others when the session ends
+        '''
+        marker = SENTINEL.encode('utf-8')
+        try:
+            for line in process.stdout:
+                line = line.strip()
+                if not line.startswith(marker):
+                    continue
+                try:
+                    number = int(line[len(marker):])
+                except ValueError:
+                    continue
+                with self._lock:
+                    item = self._pending.pop(number, None)
+                if item is not None:
+                    item[1].set_result(True)
+        except (OSError, ValueError):
+            pass
+        with self._lock:
+            ended = [number for number, item in self._pending.items() if item[0] is process]
+            futures = [self._pending.pop(number)[1] for number in ended]
+        for future in futures:
+            future.set_result(False)
+
+    def _write(self, commands):
+        '''
+        Write commands followed by a sentinel and wait until the shell echoes it
+
+            : return: True once the device ran the commands, False if the session failed or timed out
+        '''
+        with self._lock:
+            for attempt in range(2):
+                number = None
+                try:
+                    process = self._open()
+                    self._sequence += 1
+                    number = self._sequence
+                    future = Future()
+                    self._pending[number] = (process, future)
+                    data = ''.join(command + '\n' for command in commands) + 'echo %s%d\n' % (SENTINEL, number)
+                    process.stdin.write(data.encode('utf-8'))
+                    process.stdin.flush()
+                    break
+                except OSError:
+                    # The session died (device reconnected, adb server restarted), open a new one once
+                    self._pending.pop(number, None)
+                    self._process = None
+            else:
+                logging.warning('AdbShell: can not write to %s' % (self.serial or 'default device'))
+                return False
+        try:
+            return future.result(self.timeout)
+        except TimeoutError:
+            with self._lock:
+                self._pending.pop(number, None)
+            logging.warning('AdbShell: %s did not run the inputs within %.1fs' % (self.serial or 'default device', self.timeout))
+            return False
+
+    def send(self, command):
+        '''
+        Run a shell command on the device and return once it ran, queued while a batch is open
+        '''
+        pending = getattr(self._local, 'pending', None)
+        if pending is not None:
+            pending.append(command)
+            return True
+        return self._write([command])
+
+    @contextmanager
+    def batch(self):
+        '''
+        Commands sent inside the block are written in one go when it exits, it waits until the device ran them
+
+            with shell.batch():
+                shell.tap(100, 200)
+                shell.swipe(10, 10, 300, 10)
+        '''
+        outer = getattr(self._local, 'pending', None)
+        if outer is not None:
+            yield self
+            return
+        self._local.pending = []
+        try:
+            yield self
+        finally:
+            pending, self._local.pending = self._local.pending, None
+            if pending:
+                self._write(pending)
+
+    def tap(self, x, y):
+        return self.send('input tap %d %d' % (x, y))
+
+    def swipe(self, x1, y1, x2, y2, duration=None):
+        '''
+        : param duration = None: milliseconds of the swipe, the device default if empty
+        '''
+        command = 'input swipe %d %d %d %d' % (x1, y1, x2, y2)
+        if duration is not None:
+            command += ' %d' % (duration)
+        return self.send(command)
+
+    def close(self):
+        with self._lock:
+            process, self._process = self._process, None
+            futures = [item[1] for item in self._pending.values()]
+            self._pending.clear()
+        for future in futures:
+            future.set_result(False)
+        if process is not None and process.poll() is None:
+            try:
+                process.stdin.write(b'exit\n')
+                process.stdin.close()
+                process.wait(2)
+            except (OSError, subprocess.TimeoutExpired):
+                process.kill()
+
+
+_shells = {}
+_shellsLock = threading.Lock()
+
+
+def get_adb_shell(serial=None, adb='adb'):
+    '''
+    Shell session shared by every GameControl driving the same device
+    '''
+    key = (serial, adb)
+    with _shellsLock:
+        if key not in _shells:
+            _shells[key] = AdbShell(serial, adb)
+        return _shells[key]
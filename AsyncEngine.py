@@ -0,0 +1,271 @@
+'''
+One event loop driving the game loops of many accounts
+
+Every account is a coroutine, captures and detections run on a shared executor and inputs
+are awaited through the futures of the InputDispatcher. Stopping or pausing an account
+cancels or suspends its task, no thread is ever killed.
+'''
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+
+async def run_step(executor, function, *args, stop=None):
+    '''
+    Run a blocking function on executor. When the task is cancelled meanwhile, stop is called and the
+    CancelledError goes on only once the function has returned, nothing it uses is closed under it
+
+        : param stop = None: callable making the function return early, e.g. GameControl.stop
+    '''
+    future = asyncio.get_event_loop().run_in_executor(executor, function, *args)
+    try:
+        return await asyncio.shield(future)
+    except asyncio.CancelledError:
+        if stop is not None:
+            stop()
+        await asyncio.wait([future])
+        raise
+
+
+class AsyncGame():
+    def __init__(self, gui, engine, name, pacer=None):
+        '''
+        Awaitable operations of one account
+
+            : param gui: GameControl of the window
+
+            : param engine: AsyncEngine running the account
+
+            : param name: name of the account in the engine
+
+            : param pacer = None: Pacer of the account, needed by wait
+        '''
+        self.gui = gui
+        self.engine = engine
+        self.name = name
+        self.pacer = pacer
+
+    async def checkpoint(self):
+        '''
+        Return once the account is not paused, raises CancelledError when it is stopped
+        '''
+        await self.engine.resumed(self.name)
+
+    async def call(self, function, *args, **kwargs):
+        '''
+        Run a blocking function on the shared executor
+        '''
+        await self.checkpoint()
+        return await run_step(self.engine.executor, lambda: function(*args, **kwargs), stop=self.gui.stop)
+
+    async def frame(self, delay=0):
+        '''
+        New snapshot of the window, see GameControl.new_frame
+        '''
+        if delay:
+            await asyncio.sleep(delay)
+        return await self.call(self.gui.new_frame)
+
+    async def find(self, img_path, *args, **kwargs):
+        '''
+        GameControl.find_game_img on the executor
+        '''
+        return await self.call(self.gui.find_game_img, img_path, *args, **kwargs)
+
+    async def find_batch(self, requests, frame=None):
+        return await self.call(self.gui.find_batch, requests, frame)
+
+    async def click(self, pos, pos_end=None):
+        '''
+        Click and return once the click is played
+        '''
+        await self.checkpoint()
+        return await asyncio.wrap_future(self.gui.mouse_click_bg(pos, pos_end, wait=False))
+
+    async def drag(self, pos1, pos2, delay=0.04):
+        await self.checkpoint()
+        return await asyncio.wrap_future(self.gui.mouse_drag_bg(pos1, pos2, delay, wait=False))
+
+    async def sleep(self, seconds):
+        await self.checkpoint()
+        await asyncio.sleep(seconds)
+
+    async def wait(self, name, policy=None):
+        '''
+        Wait at a named point of the Pacer
+        '''
+        await self.checkpoint()
+        return await self.pacer.wait_async(name, policy, self.engine.executor)
+
+    async def wait_any(self, targets, timeout=100):
+        '''
+        Waiter.wait_any without holding the event loop, see GameControl.wait_any
+        '''
+        await self.checkpoint()
+        return await self.gui.waiter.wait_any_async(targets, timeout, self.engine.executor)
+
+
+class AsyncEngine():
+    def __init__(self, workers=4):
+        '''
+        Event loop on its own thread with an executor for the captures and detections
+
+            : param workers = 4: executor threads, cv2 releases the GIL so they run in parallel
+        '''
+        self.executor = ThreadPoolExecutor(workers, thread_name_prefix='vision')
+        self.loop = asyncio.new_event_loop()
+        self.loop.set_default_executor(self.executor)
+        self.accounts = {}
+        self._thread = None
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        self._thread = threading.Thread(None, self._run, name='AsyncEngine', daemon=True)
+        self._thread.start()
+        return self
+
+    def _run(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def _call(self, function, *args):
+        '''
+        Run function on the loop thread and return its result
+        '''
+        if threading.current_thread() is self._thread:
+            return function(*args)
+        return asyncio.run_coroutine_threadsafe(self._wrap(function, *args), self.loop).result()
+
+    async def _wrap(self, function, *args):
+        return function(*args)
+
+    def add(self, name, factory, start=True, stop=None):
+        '''
+        Add an account
+
+            : param name: name of the account
+
+            : param factory: callable returning the coroutine of the account, called again on restart
+
+            : param start = True: start it right away
+
+            : param stop = None: callable ending the blocking steps of the account early, called before it is cancelled
+        '''
+        self.accounts[name] = {'factory': factory, 'task': None, 'resumed': None, 'stop': stop}
+        if start:
+            self.start_account(name)
+
+    def _start(self, name):
+        account = self.accounts[name]
+        if account['task'] is not None and not account['task'].done():
+            return account['task']
+        account['resumed'] = asyncio.Event()
+        account['resumed'].set()
+        account['task'] = self.loop.create_task(self._guard(name, account['factory']()))
+        return account['task']
+
+    async def _guard(self, name, coroutine):
+        try:
+            return await coroutine
+        except asyncio.CancelledError:
+            logging.info('AsyncEngine: %s stopped' % (name))
+            raise
+        except Exception:
+            logging.exception('AsyncEngine: %s crashed' % (name))
+            raise
+
+    def start_account(self, name):
+        self.start()
+        return self._call(self._start, name)
+
+    def stop_account(self, name, timeout=10):
+        '''
+        Cancel the task of an account, the CancelledError reaches it at its next await
+        or once its running executor step has returned
+
+            : return: True if it ended within timeout
+        '''
+        account = self.accounts[name]
+        task = account['task']
+        if task is None or task.done():
+            return True
+        if account['stop'] is not None:
+            # The executor step running now returns early instead of at its timeout
+            account['stop']()
+        self.loop.call_soon_threadsafe(task.cancel)
+        future = asyncio.run_coroutine_threadsafe(asyncio.wait([task], timeout=timeout), self.loop)
+        future.result()
+        return task.done()
+
+    def restart_account(self, name, timeout=10):
+        self.stop_account(name, timeout)
+        return self.start_account(name)
+
+    def pause(self, name=None):
+        '''
+        Suspend an account, every account if name is empty, at its next checkpoint
+        '''
+        for key in ([name] if name is not None else list(self.accounts)):
+            resumed = self.accounts[key]['resumed']
+            if resumed is not None:
+                self.loop.call_soon_threadsafe(resumed.clear)
+
+    def resume(self, name=None):
+        for key in ([name] if name is not None else list(self.accounts)):
+            resumed = self.accounts[key]['resumed']
+            if resumed is not None:
+                self.loop.call_soon_threadsafe(resumed.set)
+
+    def is_paused(self, name):
+        resumed = self.accounts[name]['resumed']
+        return resumed is not None and not resumed.is_set()
+
+    async def resumed(self, name):
+        resumed = self.accounts[name]['resumed']
+        if resumed is not None and not resumed.is_set():
+            await resumed.wait()
+
+    def status(self):
+        '''
+        : return: dict name -> 'running', 'paused', 'done', 'cancelled', 'failed' or 'stopped'
+        '''
+        result = {}
+        for name, account in self.accounts.items():
+            task = account['task']
+            if task is None:
+                result[name] = 'stopped'
+            elif not task.done():
+                result[name] = 'paused' if self.is_paused(name) else 'running'
+            elif task.cancelled():
+                result[name] = 'cancelled'
+            elif task.exception() is not None:
+                result[name] = 'failed'
+            else:
+                result[name] = 'done'
+        return result
+
+    def join(self, interval=1.0):
+        '''
+        Block until every account is done, Ctrl+C stops them
+        '''
+        try:
+            while any(state in ('running', 'paused') for state in self.status().values()):
+                threading.Event().wait(interval)
+        except KeyboardInterrupt:
+            pass
+        self.stop()
+
+    def stop(self, timeout=10):
+        '''
+        Cancel every account and stop the loop
+        '''
+        if self._thread is None:
+            return
+        for name in list(self.accounts):
+            self.stop_account(name, timeout)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join(timeout)
+        self._thread = None
+        self.executor.shutdown(wait=False)
@@ -0,0 +1,130 @@
+import asyncio
+from AsyncEngine import AsyncGame
+from Processing import *
+
+#game modes with a script, every mode of Processing
+ASYNC_GAME_MODES=(1,2,3,4,5,6)
+
+#
+def _step(script,result):
+    #StopIteration can not cross an executor future
+    try:
+        return False,script.send(result)
+    except StopIteration as stop:
+        return True,stop.value
+
+#
+class AsyncProcessing(object):
+    def __init__(self,windowName,gameMode,total,engine,isCaptain=False,isMainDMG=True,capture=None,stage=None,hwnd=None,adbSerial=None,adbPath='adb'):
+        '''
+        Processing as a coroutine, run it with engine.add(account.name, account.run, stop=account.stop)
+
+        The game mode scripts of Processing are shared: their detections run on the executor of the engine,
+        their inputs and waits are awaited on the event loop
+        '''
+        if gameMode not in ASYNC_GAME_MODES:
+            raise ValueError("game mode %s has no coroutine, run it with Processing"%(str(gameMode)))
+        self.windowName=windowName
+        self.__gameMode=gameMode
+        self.__total=total
+        self.__engine=engine
+        self.__arguments=(windowName,gameMode,total,isCaptain,isMainDMG,capture,stage,hwnd,adbSerial,adbPath)
+        self.name=None
+        self.__create()
+
+    def __create(self):
+        #never started as a thread, only its scripts and GameControl are used,
+        #a new one on every run since the GameControl is closed when the run ends
+        self.worker=Processing(*self.__arguments,pauseHotkey=False)
+        self.__gui=self.worker.gui
+        self.__closed=False
+        if self.name is None:
+            self.name="account%d"%(self.worker.accountId)
+        self.__game=AsyncGame(self.__gui,self.__engine,self.name,self.worker.pacer)
+#
+    @property
+    def accountId(self):
+        return self.worker.accountId
+
+    @property
+    def hwnd(self):
+        return self.worker.hwnd
+
+    @property
+    def completed(self):
+        return self.worker.completed
+
+    @property
+    def stopped(self):
+        return self.worker.stopped
+
+    def stop(self):
+        self.worker.stop()
+#
+    async def play(self,script):
+        '''
+        Run a script of Processing, see Processing.play
+
+            : return: value returned by the script
+        '''
+        result=None
+        while True:
+            done,action=await self.__game.call(_step,script,result)
+            if done:
+                return action
+            result=await self.act(action)
+
+    async def act(self,action):
+        game=self.__game
+        kind=action[0]
+        if kind=="frame":
+            return await game.frame(delay=action[1])
+        if kind=="click":
+            return await game.click(action[1])
+        if kind=="drag":
+            return await game.drag(*action[1:])
+        if kind=="wait":
+            return await game.wait(action[1])
+        if kind=="sleep":
+            return await game.sleep(action[1])
+        raise ValueError("unknown action %s"%(str(kind)))
+#
+    async def run(self):
+        if self.__closed:
+            #restarted by the engine
+            self.__create()
+        worker=self.worker
+        count=0
+        try:
+            while self.__total-count>0 and self.__gui.run and not worker.finished:
+                printWithTime("\n\n==============Account %s: "%(str(self.accountId))+"Starting a new round==================")
+                await self.play(worker.script())
+                #a round cut short by stop() is not completed
+                if worker.finished or not self.__gui.run:
+                    break
+                count+=1
+                worker.completed=count
+                message="Account %s: Game mode %s, completed %s round, remaining %s round..."%(str(self.accountId),str(self.__gameMode),str(count),str(self.__total-count))
+                printWithTime(message)
+        finally:
+            worker.pacer.end_streak()
+            self.__closed=True
+            self.__gui.close()
+#
+
+def watchPause(engine,hotkey='f1'):
+    '''
+    Pause or continue every account of the engine with the hotkey
+    '''
+    def toggle():
+        printWithTime("Message: %s was pressed"%(hotkey.upper()))
+        if any(engine.is_paused(name) for name in engine.accounts):
+            engine.resume()
+            printWithTime("Continued")
+        else:
+            engine.pause()
+            printWithTime("Paused")
+    if keyboard is None:
+        printWithTime("Message: no keyboard module, %s does not pause"%(hotkey.upper()))
+        return
+    keyboard.add_hotkey(hotkey,toggle)
@@ -0,0 +1,593 @@
+import ctypes
+import logging
+import os
+import re
+import struct
+import subprocess
+import threading
+import time
+from collections import deque
+import cv2
+import numpy as np
+from Frame import Frame, FramePool
+from Recorder import RecordingReader, is_recording
+try:
+    import win32con
+    import win32gui
+    import win32ui
+except ImportError:
+    # Only the GDI backend needs pywin32, the others also run on Linux
+    win32con = win32gui = win32ui = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+VIDEO_EXTENSIONS = ('.mp4', '.avi', '.mkv')
+# screencap pixel formats, RGBA_8888 and RGBX_8888
+SCREENCAP_FORMATS = (1, 2)
+
+
+class BITMAPINFOHEADER(ctypes.Structure):
+    _fields_ = [('biSize', ctypes.c_uint32), ('biWidth', ctypes.c_int32), ('biHeight', ctypes.c_int32),
+                ('biPlanes', ctypes.c_uint16), ('biBitCount', ctypes.c_uint16), ('biCompression', ctypes.c_uint32),
+                ('biSizeImage', ctypes.c_uint32), ('biXPelsPerMeter', ctypes.c_int32),
+                ('biYPelsPerMeter', ctypes.c_int32), ('biClrUsed', ctypes.c_uint32), ('biClrImportant', ctypes.c_uint32)]
+
+
+def _create_dib(hdc, width, height):
+    '''
+    32 bits top-down DIB section, its pixels are readable in place without GetBitmapBits
+
+        : return: (bitmap handle, (h, w, 4) uint8 view of the pixels)
+    '''
+    gdi32 = ctypes.windll.gdi32
+    gdi32.CreateDIBSection.restype = ctypes.c_void_p
+    gdi32.CreateDIBSection.argtypes = [ctypes.c_void_p, ctypes.POINTER(BITMAPINFOHEADER), ctypes.c_uint,
+                                       ctypes.POINTER(ctypes.c_void_p), ctypes.c_void_p, ctypes.c_uint32]
+    header = BITMAPINFOHEADER(biSize=ctypes.sizeof(BITMAPINFOHEADER), biWidth=width, biHeight=-height,
+                              biPlanes=1, biBitCount=32, biCompression=0)
+    bits = ctypes.c_void_p()
+    handle = gdi32.CreateDIBSection(hdc, ctypes.byref(header), 0, ctypes.byref(bits), None, 0)
+    if not handle or not bits.value:
+        raise OSError('CreateDIBSection failed')
+    pixels = (ctypes.c_uint8 * (width * height * 4)).from_address(bits.value)
+    return handle, np.ctypeslib.as_array(pixels).reshape(height, width, 4)
+
+
+class CaptureBackend():
+    '''
+    Source of game window pictures, every image is (h, w, 4) BGRA in window coordinates
+    '''
+
+    def capture(self):
+        '''
+        : return: Frame of the whole window, None if the capture failed
+        '''
+        raise NotImplementedError
+
+    def capture_part(self, pos1, pos2):
+        '''
+        : param pos1: (x, y) upper left corner of the area
+
+        : param pos2: (x, y) lower right corner of the area
+
+        : return: (h, w, 4) BGRA array of the area, a copy the caller owns, None if the capture failed
+        '''
+        frame = self.capture()
+        if frame is None:
+            return None
+        # The pooled buffers of the frame are reused once it is dropped, never hand out a view
+        return frame.bgra[pos1[1]:pos2[1], pos1[0]:pos2[0]].copy()
+
+    def capture_after(self, timestamp, timeout=1.0):
+        '''
+        : param timestamp: time of the last input, the frame must be captured after it
+
+        : param timeout = 1.0: max seconds to wait for such a frame
+
+        : return: Frame, None if the capture failed
+        '''
+        return self.capture()
+
+    def save(self, file_name):
+        '''
+        Save a capture of the whole window to file_name, its folder is created if needed
+        '''
+        frame = self.capture()
+        if frame is not None:
+            folder = os.path.dirname(file_name)
+            if folder:
+                os.makedirs(folder, exist_ok=True)
+            cv2.imwrite(file_name, frame.bgr)
+
+    def close(self):
+        pass
+
+
+class GdiCapture(CaptureBackend):
+    def __init__(self, hwnd, client=0, max_parts=8, pool=None):
+        '''
+        BitBlt of the window device context, the GDI objects are created once and reused
+
+            : param hwnd: the window handle to capture
+
+            : param client = 0: 0: game client window, others: emulator window with a 35 pixels title bar
+
+            : param max_parts = 8: region sizes whose bitmap is kept for capture_part
+
+            : param pool = None: FramePool the frames are copied into, a new one if empty
+        '''
+        self.hwnd = hwnd
+        self.client = client
+        self.max_parts = max_parts
+        self.pool = pool if pool is not None else FramePool()
+        self._parts = {}
+        # The device contexts are shared by a CaptureThread and the part captures of the readers
+        self._lock = threading.RLock()
+        l1, t1, r1, b1 = win32gui.GetWindowRect(self.hwnd)
+        l2, t2, r2, b2 = win32gui.GetClientRect(self.hwnd)
+        self._client_h = b2 - t2
+        self._client_w = r2 - l2
+        self._border_l = ((r1 - l1) - (r2 - l2)) // 2
+        self._border_t = ((b1 - t1) - (b2 - t2)) - self._border_l
+
+    def init_mem(self):
+        # Release the previous objects first, recreating them after a failure used to leak handles
+        self.close()
+        self.hwindc = win32gui.GetWindowDC(self.hwnd)
+        self.srcdc = win32ui.CreateDCFromHandle(self.hwindc)
+        self.memdc = self.srcdc.CreateCompatibleDC()
+        self.bmp, self._pixels = _create_dib(self.memdc.GetSafeHdc(), self._client_w, self._client_h)
+        win32gui.SelectObject(self.memdc.GetSafeHdc(), self.bmp)
+        self._parts = {}
+
+    def _blit_full(self):
+        if (not hasattr(self, 'memdc')):
+            self.init_mem()
+        if self.client == 0:
+            self.memdc.BitBlt((0, 0), (self._client_w, self._client_h), self.srcdc,
+                              (self._border_l, self._border_t), win32con.SRCCOPY)
+        else:
+            self.memdc.BitBlt((0, -35), (self._client_w, self._client_h), self.srcdc,
+                              (self._border_l, self._border_t), win32con.SRCCOPY)
+
+    def capture(self):
+        with self._lock:
+            try:
+                self._blit_full()
+                ctypes.windll.gdi32.GdiFlush()
+                buffers = self.pool.acquire(self._client_h, self._client_w)
+                # One copy out of the DIB into a pooled buffer, no allocation per capture
+                np.copyto(buffers.bgra, self._pixels)
+                return Frame(buffers.bgra, buffers=buffers)
+            except Exception:
+                self.init_mem()
+                return None
+
+    def _part_mem(self, w, h):
+        # Memory DC and bitmap of a region size, kept for the next capture of the same size
+        mem = self._parts.get((w, h))
+        if mem is None:
+            if len(self._parts) >= self.max_parts:
+                self._release_part(self._parts.pop(next(iter(self._parts))))
+            memdc = self.srcdc.CreateCompatibleDC()
+            bmp = win32ui.CreateBitmap()
+            bmp.CreateCompatibleBitmap(self.srcdc, w, h)
+            memdc.SelectObject(bmp)
+            mem = self._parts[(w, h)] = (memdc, bmp)
+        return mem
+
+    def _release_part(self, mem):
+        memdc, bmp = mem
+        memdc.DeleteDC()
+        win32gui.DeleteObject(bmp.GetHandle())
+
+    def capture_part(self, pos1, pos2):
+        w = pos2[0]-pos1[0]
+        h = pos2[1]-pos1[1]
+        with self._lock:
+            try:
+                if (not hasattr(self, 'memdc')):
+                    self.init_mem()
+                memdc, bmp = self._part_mem(w, h)
+                if self.client == 0:
+                    memdc.BitBlt((0, 0), (w, h), self.srcdc,
+                                 (pos1[0]+self._border_l, pos1[1]+self._border_t), win32con.SRCCOPY)
+                else:
+                    memdc.BitBlt((0, -35), (w, h), self.srcdc,
+                                 (pos1[0]+self._border_l, pos1[1]+self._border_t), win32con.SRCCOPY)
+                signedIntsArray = bmp.GetBitmapBits(True)
+            except Exception:
+                self.init_mem()
+                return None
+        img = np.frombuffer(signedIntsArray, dtype='uint8')
+        img.shape = (h, w, 4)
+        return img
+
+    def close(self):
+        '''
+        Clean up memory
+        '''
+        with self._lock:
+            if not hasattr(self, 'memdc'):
+                return
+            try:
+                for mem in self._parts.values():
+                    self._release_part(mem)
+                self.srcdc.DeleteDC()
+                self.memdc.DeleteDC()
+                win32gui.ReleaseDC(self.hwnd, self.hwindc)
+                win32gui.DeleteObject(self.bmp)
+            except Exception:
+                logging.warning('GdiCapture: failed to release the capture objects')
+            self._parts = {}
+            self._pixels = None
+            del self.memdc
+
+
+class AdbCapture(CaptureBackend):
+    def __init__(self, serial=None, adb='adb', timeout=5, stream=True, pool=None):
+        '''
+        Raw screencap of an Android device or emulator through adb, no PNG encoding on either side
+
+            : param serial = None: device serial, the only connected device if empty
+
+            : param adb = 'adb': path of the adb executable
+
+            : param timeout = 5: seconds before a screencap is given up, a stalled stream session is killed and opened again
+
+            : param stream = True: keep one 'adb exec-out sh' session and request every screencap on it,
+            False runs 'adb exec-out screencap' for every capture
+
+            : param pool = None: FramePool the frames are converted into, a new one if empty
+        '''
+        self.serial = serial
+        self.adb = adb
+        self.timeout = timeout
+        self.stream = stream
+        self.pool = pool if pool is not None else FramePool()
+        self._lock = threading.Lock()
+        self._process = None
+        self._header_size = None
+        self._shape = None
+        self._raw = None
+
+    def command(self, *args):
+        cmd = [self.adb]
+        if self.serial:
+            cmd += ['-s', self.serial]
+        return cmd + list(args)
+
+    def _parse_header(self, header):
+        width, height, pixel_format = struct.unpack_from('<III', header)
+        if pixel_format not in SCREENCAP_FORMATS:
+            raise ValueError('AdbCapture: unsupported pixel format %d' % (pixel_format))
+        return height, width
+
+    def _probe(self):
+        # Android 9 added a color space field, the header size is the output size minus the pixels
+        data = subprocess.run(self.command('exec-out', 'screencap'), stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, timeout=self.timeout, check=True).stdout
+        height, width = self._parse_header(data)
+        header_size = len(data) - width * height * 4
+        if header_size not in (12, 16):
+            raise ValueError('AdbCapture: unexpected screencap size %d' % (len(data)))
+        self._header_size = header_size
+        self._set_shape(height, width)
+        np.copyto(self._raw, np.frombuffer(data, dtype=np.uint8, offset=header_size))
+
+    def _set_shape(self, height, width):
+        if self._shape != (height, width):
+            self._shape = (height, width)
+            self._raw = np.empty(height * width * 4, dtype=np.uint8)
+
+    def _session(self):
+        if self._process is None or self._process.poll() is not None:
+            self._process = subprocess.Popen(self.command('exec-out', 'sh'), stdin=subprocess.PIPE,
+                                             stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, bufsize=0)
+        return self._process
+
+    def _read_stream(self):
+        process = self._session()
+        # A stalled device would block the reads, and the lock, forever: the session is killed at the deadline,
+        # the reads then end on EOFError and the next capture opens a new session
+        watchdog = threading.Timer(self.timeout, self._expire, (process,))
+        watchdog.daemon = True
+        watchdog.start()
+        try:
+            process.stdin.write(b'screencap\n')
+            process.stdin.flush()
+            header = bytearray(self._header_size)
+            _read_exact(process.stdout, memoryview(header))
+            height, width = self._parse_header(header)
+            if (height, width) != self._shape:
+                # Rotated or resized, the pixels still have to be read before the next request
+                self._set_shape(height, width)
+            _read_exact(process.stdout, memoryview(self._raw))
+        finally:
+            watchdog.cancel()
+
+    def _expire(self, process):
+        if process.poll() is None:
+            logging.warning('AdbCapture: screencap on %s timed out after %.1fs, session restarted'
+                            % (self.serial or 'default device', self.timeout))
+            process.kill()
+
+    def _close_session(self):
+        process, self._process = self._process, None
+        if process is not None and process.poll() is None:
+            process.kill()
+
+    def capture(self):
+        with self._lock:
+            try:
+                if self._header_size is None or not self.stream:
+                    self._probe()
+                else:
+                    self._read_stream()
+            except (OSError, ValueError, EOFError, subprocess.SubprocessError, struct.error):
+                logging.warning('AdbCapture: screencap failed on %s' % (self.serial or 'default device'))
+                self._close_session()
+                self._header_size = None
+                return None
+            height, width = self._shape
+            buffers = self.pool.acquire(height, width)
+            cv2.cvtColor(self._raw.reshape(height, width, 4), cv2.COLOR_RGBA2BGRA, dst=buffers.bgra)
+        return Frame(buffers.bgra, buffers=buffers)
+
+    def close(self):
+        with self._lock:
+            self._close_session()
+
+
+def _read_exact(stream, view):
+    offset = 0
+    while offset < len(view):
+        count = stream.readinto(view[offset:])
+        if not count:
+            raise EOFError('stream closed')
+        offset += count
+
+
+def _to_bgra(img):
+    if img is None:
+        return None
+    if img.ndim == 2:
+        return cv2.cvtColor(img, cv2.COLOR_GRAY2BGRA)
+    if img.shape[2] == 3:
+        return cv2.cvtColor(img, cv2.COLOR_BGR2BGRA)
+    return img
+
+
+def _file_timestamp(path, index, interval):
+    # Recorded files are named after their capture time, '1650000000.123.png'
+    match = re.match(r'^(\d+(?:\.\d+)?)', os.path.basename(path))
+    if match:
+        return float(match.group(1))
+    return index * interval
+
+
+def _read_directory(folder, interval):
+    paths = sorted(os.path.join(folder, name) for name in os.listdir(folder)
+                   if name.lower().endswith(IMAGE_EXTENSIONS))
+    entries = sorted((_file_timestamp(path, index, interval), path) for index, path in enumerate(paths))
+    for timestamp, path in entries:
+        img = _to_bgra(cv2.imread(path, cv2.IMREAD_UNCHANGED))
+        if img is None:
+            logging.warning('ReplayCapture: can not read %s, skipped' % (path))
+            continue
+        yield timestamp, img
+
+
+def _read_video(path):
+    video = cv2.VideoCapture(path)
+    try:
+        while True:
+            ok, img = video.read()
+            if not ok:
+                break
+            yield video.get(cv2.CAP_PROP_POS_MSEC) / 1000.0, _to_bgra(img)
+    finally:
+        video.release()
+
+
+class ReplayCapture(CaptureBackend):
+    def __init__(self, source, speed=1.0, loop=False, interval=0.1):
+        '''
+        Serve recorded frames instead of the live window, for benchmarks and regression runs
+
+            : param source: Recorder folder, folder of screenshots named after their capture time, or a video file
+
+            : param speed = 1.0: replay speed, 1.0 keeps the recorded timing, 0 serves the next frame on every capture
+
+            : param loop = False: start over at the end instead of returning None
+
+            : param interval = 0.1: seconds between screenshots whose name is not a timestamp
+        '''
+        self.source = source
+        self.speed = speed
+        self.loop = loop
+        self.interval = interval
+        self.finished = False
+        self.index = -1
+        self.restart()
+
+    def _open(self):
+        if is_recording(self.source):
+            return ((timestamp, _to_bgra(img)) for timestamp, img in RecordingReader(self.source).frames())
+        if os.path.isdir(self.source):
+            return _read_directory(self.source, self.interval)
+        if self.source.lower().endswith(VIDEO_EXTENSIONS):
+            return _read_video(self.source)
+        raise ValueError('ReplayCapture: unknown source %s' % (self.source))
+
+    def restart(self):
+        '''
+        Go back to the first frame
+        '''
+        self._frames = self._open()
+        self._current = None
+        self._next = next(self._frames, None)
+        self._start = None
+        self.index = -1
+        self.finished = self._next is None
+
+    def _advance(self):
+        self._current = self._next
+        self._next = next(self._frames, None)
+        self.index += 1
+
+    def capture(self):
+        if self.finished:
+            if not self.loop:
+                return None
+            self.restart()
+            if self.finished:
+                return None
+        if self.speed == 0:
+            self._advance()
+            self.finished = self._next is None
+        else:
+            now = time.time()
+            if self._start is None:
+                self._start = (now, self._next[0])
+                self._advance()
+            target = self._start[1] + (now - self._start[0]) * self.speed
+            while self._next is not None and self._next[0] <= target:
+                self._advance()
+            # The last frame is served for one more interval, then the replay is over
+            self.finished = self._next is None and target > self._current[0] + self.interval
+        # The frame is timestamped now so the staleness budget works the same as live
+        return Frame(self._current[1])
+
+
+class CaptureThread(CaptureBackend):
+    def __init__(self, backend, fps=10, size=4):
+        '''
+        Capture a backend on a producer thread into a ring buffer, readers get the newest frame without waiting
+
+            : param backend: CaptureBackend to capture
+
+            : param fps = 10: captures per second
+
+            : param size = 4: frames kept in the ring buffer
+        '''
+        self.backend = backend
+        self.interval = 1.0 / fps
+        self.frames = deque(maxlen=size)
+        self.last_id = 0
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+        pool = getattr(backend, 'pool', None)
+        if pool is not None:
+            # Ring buffer frames and the snapshots of the readers all hold pooled buffers
+            pool.size = max(pool.size, size + 4)
+
+    def start(self):
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(None, self._run, name='CaptureThread', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._running = False
+        with self._condition:
+            self._condition.notify_all()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(2)
+        self._thread = None
+
+    def alive(self):
+        '''
+        : return: True while the producer thread runs, False once it is stopped or died
+        '''
+        thread = self._thread
+        return self._running and thread is not None and thread.is_alive()
+
+    def _run(self):
+        try:
+            while self._running:
+                start = time.time()
+                try:
+                    frame = self.backend.capture()
+                except Exception:
+                    logging.warning('CaptureThread: capture failed')
+                    frame = None
+                if frame is not None:
+                    with self._condition:
+                        self.last_id += 1
+                        frame.id = self.last_id
+                        self.frames.append(frame)
+                        self._condition.notify_all()
+                time.sleep(max(0, self.interval - (time.time() - start)))
+        except BaseException:
+            logging.exception('CaptureThread: died, captures are taken directly from now on')
+            # The readers waiting for a frame fall back at once
+            with self._condition:
+                self._running = False
+                self._condition.notify_all()
+
+    def latest(self):
+        '''
+        : return: newest Frame without waiting, None if nothing was captured yet
+        '''
+        with self._condition:
+            return self.frames[-1] if self.frames else None
+
+    def wait_newer(self, frame_id, timeout=1.0):
+        '''
+        : param frame_id: id of the last frame seen, 0 for any frame
+
+        : param timeout = 1.0: max seconds to wait
+
+        : return: newest Frame whose id is above frame_id, None on timeout
+        '''
+        end = time.time() + timeout
+        with self._condition:
+            while not self.frames or self.frames[-1].id <= frame_id:
+                remaining = end - time.time()
+                if remaining <= 0 or not self.alive():
+                    return None
+                self._condition.wait(min(remaining, self.interval * 10))
+            return self.frames[-1]
+
+    def capture(self):
+        if not self.alive():
+            return self.backend.capture()
+        frame = self.latest()
+        if frame is None:
+            frame = self.wait_newer(0, self.interval * 10)
+        return frame
+
+    def capture_after(self, timestamp, timeout=1.0):
+        end = time.time() + timeout
+        frame = self.latest()
+        while frame is None or frame.timestamp <= timestamp:
+            if not self.alive():
+                # Stopped or died meanwhile, no newer frame will come from the thread
+                return self.backend.capture()
+            remaining = end - time.time()
+            if remaining <= 0:
+                return None
+            newer = self.wait_newer(frame.id if frame is not None else 0, remaining)
+            if newer is not None:
+                frame = newer
+        return frame
+
+    def capture_part(self, pos1, pos2):
+        return self.backend.capture_part(pos1, pos2)
+
+    def save(self, file_name):
+        self.backend.save(file_name)
+
+    def close(self):
+        self.stop()
+        self.backend.close()
+
+    @property
+    def client(self):
+        return getattr(self.backend, 'client', 0)
+
+    @client.setter
+    def client(self, value):
+        self.backend.client = value
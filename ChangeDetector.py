@@ -0,0 +1,87 @@
+import cv2
+import numpy as np
+
+
+class ChangeDetector():
+    def __init__(self, scale=8, pixel_threshold=12, min_pixels=1):
+        '''
+        Cheap frame change detection on a downsampled grayscale thumbnail
+
+            : param scale = 8: the thumbnail is the frame divided by scale on both sides
+
+            : param pixel_threshold = 12: min gray level difference of a thumbnail pixel to count as changed
+
+            : param min_pixels = 1: min number of changed thumbnail pixels for the frame to be changed
+        '''
+        self.scale = scale
+        self.pixel_threshold = pixel_threshold
+        self.min_pixels = min_pixels
+        self.regions = {}
+        self.ignored = {}
+
+    def add_region(self, name, pos1, pos2):
+        '''
+        Watch a region on its own, see changed_regions
+
+            : param name: name of the region
+
+            : param pos1: (x, y) upper left corner in window coordinates
+
+            : param pos2: (x, y) lower right corner in window coordinates
+        '''
+        self.regions[name] = (pos1, pos2)
+
+    def ignore_region(self, name, pos1, pos2):
+        '''
+        Region known to animate, its changes never make the frame changed
+        '''
+        self.ignored[name] = (pos1, pos2)
+
+    def remove_region(self, name):
+        self.regions.pop(name, None)
+        self.ignored.pop(name, None)
+
+    def _slice(self, pos1, pos2):
+        s = self.scale
+        return slice(pos1[1] // s, max(pos1[1] // s + 1, pos2[1] // s)), slice(pos1[0] // s, max(pos1[0] // s + 1, pos2[0] // s))
+
+    def diff(self, previous, frame):
+        '''
+        : return: bool mask of the changed thumbnail pixels, None if the frames can not be compared
+        '''
+        a = previous.thumbnail(self.scale)
+        b = frame.thumbnail(self.scale)
+        if a.shape != b.shape:
+            return None
+        mask = cv2.absdiff(a, b) > self.pixel_threshold
+        for pos1, pos2 in self.ignored.values():
+            rows, cols = self._slice(pos1, pos2)
+            mask[rows, cols] = False
+        return mask
+
+    def changed(self, previous, frame):
+        '''
+        : return: True if frame differs from previous outside the ignored regions
+        '''
+        if previous is None or frame is None:
+            return True
+        mask = self.diff(previous, frame)
+        if mask is None:
+            return True
+        return int(np.count_nonzero(mask)) >= self.min_pixels
+
+    def changed_regions(self, previous, frame):
+        '''
+        : return: dict region name -> True if that region changed
+        '''
+        mask = None
+        if previous is not None and frame is not None:
+            mask = self.diff(previous, frame)
+        result = {}
+        for name, (pos1, pos2) in self.regions.items():
+            if mask is None:
+                result[name] = True
+            else:
+                rows, cols = self._slice(pos1, pos2)
+                result[name] = int(np.count_nonzero(mask[rows, cols])) >= self.min_pixels
+        return result
@@ -0,0 +1,174 @@
+import threading
+import cv2
+from TemplateRegistry import get_registry
+
+FLANN_INDEX_KDTREE = 1
+FLANN_INDEX_LSH = 6
+
+
+def create_detector(backend):
+    '''
+    : param backend: 'sift' or 'orb'
+    '''
+    if backend == 'orb':
+        return cv2.ORB_create(nfeatures=2500)
+    if hasattr(cv2, 'SIFT_create'):
+        return cv2.SIFT_create()
+    return cv2.xfeatures2d.SIFT_create()
+
+
+def create_matcher(backend):
+    '''
+    : param backend: 'sift' or 'orb'
+    '''
+    if backend == 'orb':
+        indexParams = dict(algorithm=FLANN_INDEX_LSH, table_number=6, key_size=12, multi_probe_level=1)
+    else:
+        indexParams = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
+    searchParams = dict(checks=50)
+    return cv2.FlannBasedMatcher(indexParams, searchParams)
+
+
+class FeatureMatcher():
+    def __init__(self, backend='sift', ratio=0.7, registry=None):
+        '''
+        Keypoint matching with cached template descriptors
+
+            : param backend = 'sift': 'sift', or 'orb' for a cheaper binary descriptor
+
+            : param ratio = 0.7: Lowe ratio test, a match is good if it is closer than ratio times the second one
+
+            : param registry = None: template registry holding the cached descriptors, the shared one if empty
+        '''
+        self.backend = backend
+        self.ratio = ratio
+        self.templates = registry if registry is not None else get_registry()
+        # Detectors and FLANN matchers are not thread safe, each thread keeps its own
+        self._local = threading.local()
+        self._lock = threading.Lock()
+
+    def detector(self, backend=None):
+        backend = backend or self.backend
+        detectors = getattr(self._local, 'detectors', None)
+        if detectors is None:
+            detectors = self._local.detectors = {}
+        if backend not in detectors:
+            detectors[backend] = create_detector(backend)
+        return detectors[backend]
+
+    def template_features(self, path, gray=0, backend=None):
+        '''
+        Keypoints and descriptors of a template, computed once and kept next to the decoded template
+
+            : param path: path of the template
+
+            : param gray = 0: 0: color template, others: grayscale template
+
+            : param backend = None: descriptor backend, self.backend if empty
+
+            : return: (keypoints, descriptors, (w, h)), descriptors is None if the template has no feature
+        '''
+        backend = backend or self.backend
+        item = self.templates.template(path)
+        key = (backend, gray != 0)
+        features = item.features.get(key)
+        if features is None:
+            img = item.image(gray)
+            if img is None:
+                return [], None, (0, 0)
+            kp, des = self.detector(backend).detectAndCompute(img, None)
+            features = (kp, des, (img.shape[1], img.shape[0]))
+            with self._lock:
+                item.features[key] = features
+        return features
+
+    def _frame_matcher(self, frame, gray, backend, des):
+        # The FLANN index is built over the frame descriptors, once per frame and thread,
+        # the cached template descriptors are then used as queries like match_img_knn did
+        if frame is None:
+            matcher = create_matcher(backend)
+        else:
+            key = ('flann', backend, gray != 0, threading.get_ident())
+            matcher = frame.results.get(key)
+            if matcher is not None:
+                return matcher
+            matcher = frame.results[key] = create_matcher(backend)
+        matcher.add([des])
+        matcher.train()
+        return matcher
+
+    def frame_features(self, img_src, frame=None, gray=0, backend=None):
+        '''
+        Keypoints and descriptors of the searched image, memoized on the frame when there is one
+        '''
+        backend = backend or self.backend
+        if frame is None:
+            return self.detector(backend).detectAndCompute(img_src, None)
+        key = ('features', backend, gray != 0)
+        if key not in frame.results:
+            frame.results[key] = self.detector(backend).detectAndCompute(img_src, None)
+        return frame.results[key]
+
+    def match(self, path, img_src, gray=0, min_good=1, frame=None, backend=None):
+        '''
+        Find a template by keypoints
+
+            : param path: path of the template
+
+            : param img_src: image to search in
+
+            : param gray = 0: 0: color pictures, others: black and white pictures
+
+            : param min_good = 1: minimum number of good matches to accept
+
+            : param frame = None: Frame img_src comes from, to share its keypoints between lookups
+
+            : param backend = None: descriptor backend, self.backend if empty
+
+            : return: (x, y) of the best matched keypoint in img_src, (0, 0) if not found
+        '''
+        backend = backend or self.backend
+        kp1, des1, size = self.template_features(path, gray, backend)
+        kp2, des2 = self.frame_features(img_src, frame, gray, backend)
+        if des1 is None or des2 is None or len(des2) < 2:
+            return (0, 0)
+        matches = self._frame_matcher(frame, gray, backend, des2).knnMatch(des1, k=2)
+        return self._best(matches, kp2, min_good)
+
+    def match_images(self, img_template, img_src, min_good=1, backend=None):
+        '''
+        Find a template image by keypoints, without any caching
+        '''
+        backend = backend or self.backend
+        detector = self.detector(backend)
+        kp1, des1 = detector.detectAndCompute(img_template, None)
+        kp2, des2 = detector.detectAndCompute(img_src, None)
+        if des1 is None or des2 is None or len(des2) < 2:
+            return (0, 0)
+        return self._best(self._frame_matcher(None, 0, backend, des2).knnMatch(des1, k=2), kp2, min_good)
+
+    def _best(self, matches, kp_src, min_good):
+        # Template descriptors are the queries, so min_good counts template keypoints found in the frame
+        good = []
+        for pair in matches:
+            if len(pair) == 2 and pair[0].distance < self.ratio*pair[1].distance:
+                good.append(pair[0])
+        if len(good) < max(min_good, 1):
+            return (0, 0)
+        best = min(good, key=lambda m: m.distance)
+        maxLoc = kp_src[best.trainIdx].pt
+        return (int(maxLoc[0]), int(maxLoc[1]))
+
+
+_matchers = {}
+_matchersLock = threading.Lock()
+
+
+def get_feature_matcher(backend='sift'):
+    '''
+    Feature matcher shared by every GameControl of the process, one per backend
+    '''
+    with _matchersLock:
+        if backend not in _matchers:
+            _matchers[backend] = FeatureMatcher(backend)
+        return _matchers[backend]
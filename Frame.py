@@ -0,0 +1,166 @@
+import threading
+import time
+import weakref
+import cv2
+import numpy as np
+
+
+class FrameBuffers():
+    def __init__(self, height, width):
+        '''
+        Preallocated arrays of one frame, BGR and gray are allocated on first use
+        '''
+        self.shape = (height, width)
+        self.bgra = np.empty((height, width, 4), dtype=np.uint8)
+        self.bgr = None
+        self.gray = None
+        self.owner = None
+
+    def free(self):
+        return self.owner is None or self.owner() is None
+
+
+def _reserved():
+    # Owner of buffers handed out whose Frame is not created yet
+    return True
+
+
+class FramePool():
+    def __init__(self, size=4):
+        '''
+        Buffers reused across captures, a buffer is handed out again once its Frame is garbage collected
+
+            : param size = 4: buffers kept, captures get fresh unpooled buffers while all of them are in use
+        '''
+        self.size = size
+        self._buffers = []
+        self._lock = threading.Lock()
+
+    def acquire(self, height, width):
+        '''
+        : return: FrameBuffers of the given size not used by any living Frame
+        '''
+        with self._lock:
+            for buffers in self._buffers:
+                if buffers.shape == (height, width) and buffers.free():
+                    buffers.owner = _reserved
+                    return buffers
+            buffers = FrameBuffers(height, width)
+            buffers.owner = _reserved
+            if len(self._buffers) < self.size:
+                self._buffers.append(buffers)
+            else:
+                # Window resized or every buffer still held, replace the first free one
+                for index, item in enumerate(self._buffers):
+                    if item.free():
+                        self._buffers[index] = buffers
+                        break
+            return buffers
+
+
+class Frame():
+    def __init__(self, bgra, timestamp=None, buffers=None):
+        '''
+        Snapshot of the game window, shared by every detection of a loop iteration
+
+            : param bgra: (h, w, 4) BGRA capture buffer
+
+            : param timestamp = None: capture time, now if empty
+
+            : param buffers = None: FrameBuffers bgra belongs to, color conversions then write into them
+        '''
+        self.bgra = bgra
+        self.buffers = buffers
+        if buffers is not None:
+            buffers.owner = weakref.ref(self)
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self._bgr = None
+        self._gray = None
+        self._pyramid = {}
+        self._thumbnail = None
+        # Detection results computed on this frame, keyed by the caller
+        self.results = {}
+        # True if the frame differs from the previous one, None if it was not compared
+        self.changed = None
+        # Monotonic id given by CaptureThread, None for frames captured inline
+        self.id = None
+
+    @property
+    def bgr(self):
+        '''
+        BGR version, converted on first use
+        '''
+        if self._bgr is None:
+            buffers = self.buffers
+            if buffers is None:
+                self._bgr = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2BGR)
+            else:
+                if buffers.bgr is None:
+                    buffers.bgr = np.empty(buffers.shape + (3,), dtype=np.uint8)
+                self._bgr = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2BGR, dst=buffers.bgr)
+        return self._bgr
+
+    @property
+    def gray(self):
+        '''
+        Grayscale version, converted on first use
+        '''
+        if self._gray is None:
+            buffers = self.buffers
+            if buffers is None:
+                self._gray = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2GRAY)
+            else:
+                if buffers.gray is None:
+                    buffers.gray = np.empty(buffers.shape, dtype=np.uint8)
+                self._gray = cv2.cvtColor(self.bgra, cv2.COLOR_BGRA2GRAY, dst=buffers.gray)
+        return self._gray
+
+    def image(self, gray=0):
+        '''
+        : param gray = 0: 0: return BGR color image, others: return grayscale image
+        '''
+        if gray == 0:
+            return self.bgr
+        return self.gray
+
+    def pyramid(self, gray=0, level=1):
+        '''
+        Downscaled version for coarse matching, computed on first use
+
+            : param gray = 0: 0: BGR color image, others: grayscale image
+
+            : param level = 1: number of pyrDown steps, every step halves the size
+        '''
+        if level == 0:
+            return self.image(gray)
+        key = (gray != 0, level)
+        img = self._pyramid.get(key)
+        if img is None:
+            img = cv2.pyrDown(self.pyramid(gray, level - 1))
+            self._pyramid[key] = img
+        return img
+
+    def thumbnail(self, scale=8):
+        '''
+        Small grayscale version for change detection, computed on first use
+
+            : param scale = 8: the frame is divided by scale on both sides
+        '''
+        if self._thumbnail is None or self._thumbnail[0] != scale:
+            size = (max(1, self.width // scale), max(1, self.height // scale))
+            self._thumbnail = (scale, cv2.resize(self.gray, size, interpolation=cv2.INTER_AREA))
+        return self._thumbnail[1]
+
+    def age(self):
+        '''
+        : return: seconds since the frame was captured
+        '''
+        return time.time() - self.timestamp
+
+    @property
+    def width(self):
+        return self.bgra.shape[1]
+
+    @property
+    def height(self):
+        return self.bgra.shape[0]
@@ -1,24 +1,37 @@
 import ctypes
 import logging
-import os
 import sys
 import time
 import traceback
 import random
 import cv2
 import numpy as np
-import win32api
-import win32con
-import win32gui
-import win32ui
-from timeit import default_timer as timer
-from PIL import Image
-
-
+try:
+    import win32api
+    import win32con
+    import win32gui
+except ImportError:
+    # Replay runs (CaptureBackend.ReplayCapture) work without pywin32
+    win32api = win32con = win32gui = None
+from TemplateRegistry import get_registry
+from Frame import Frame
+from Matcher import MatchRequest, get_matcher, match_in_frame, match_all
+from RoiIndex import get_roi_index
+from FeatureMatcher import get_feature_matcher
+from ChangeDetector import ChangeDetector
+from CaptureBackend import GdiCapture, CaptureThread
+from AdbInput import get_adb_shell
+from Recorder import Recorder
+from InputDispatcher import InputDispatcher
+from Waiter import Waiter, ColorTarget, PredicateTarget
+from PopupDetectors import PopupWatcher
+
+# Seconds between two keypoint matches of wait_game_img_knn on changing frames
+KNN_WAIT_INTERVAL = 0.25
 
 
 class GameControl():
-    def __init__(self, hwnd, quit_game_enable=1):
+    def __init__(self, hwnd, quit_game_enable=1, capture=None):
         '''
         initialization
 
@@ -26,29 +39,187 @@ class GameControl():
 
             : param quit_game_enable: Whether to exit the game when the program dies. 
             True is yes, False is no
+
+            : param capture = None: CaptureBackend the pictures come from, GDI capture of hwnd if empty
         '''
         self.run = True
         self.hwnd = hwnd
         self.quit_game_enable = quit_game_enable
         self.debug_enable = False
-        l1, t1, r1, b1 = win32gui.GetWindowRect(self.hwnd)
-        #print(l1,t1, r1,b1)
-        l2, t2, r2, b2 = win32gui.GetClientRect(self.hwnd)
-        # print(l2,t2,r2,b2)
-        self._client_h = b2 - t2
-        self._client_w = r2 - l2
-        self._border_l = ((r1 - l1) - (r2 - l2)) // 2
-        self._border_t = ((b1 - t1) - (b2 - t2)) - self._border_l
+        self.capture = capture if capture is not None else GdiCapture(hwnd)
         self.client = 0
+        # Inputs are only logged into self.inputs, for replay runs
+        self.dry_run = False
+        self.inputs = []
+        self.recorder = None
+        self.waiter = Waiter(self)
+        # Clicks and drags are played in order on this thread
+        self.dispatcher = InputDispatcher('InputDispatcher-%s' % (hwnd))
+        # Device of the emulator when client != 0
+        self.adb_serial = None
+        self.adb_path = 'adb'
+        self.templates = get_registry()
+        self.matcher = get_matcher()
+        self.roi_index = get_roi_index()
+        self.roi_enable = True
+        self.pyramid_levels = 0
+        self.knn_backend = 'sift'
+        self.frame = None
+        self.frame_max_age = 0.5
+        self.previous_frame = None
+        self.input_time = 0
+        # Future of the last input, the snapshot is dropped on the game loop thread once it is played
+        self.pending_input = None
+        # Snapshot current when the last input was sent, what the screen has to change from
+        self.input_frame = None
+        self.change_detector = ChangeDetector()
+        self.reuse_unchanged = True
+        # Frame whose detections are reused, and how many snapshots reused them
+        self.anchor_frame = None
+        self.reused = 0
+        self.max_reuse = 20
+        # Popups of PopupDetectors.get_popup_registry() are dealt with on every new frame, None to disable
+        self.popups = PopupWatcher(self)
       
-    def init_mem(self):
-        self.hwindc = win32gui.GetWindowDC(self.hwnd)
-        self.srcdc = win32ui.CreateDCFromHandle(self.hwindc)
-        self.memdc = self.srcdc.CreateCompatibleDC()
-        self.bmp = win32ui.CreateBitmap()
-        self.bmp.CreateCompatibleBitmap(
-            self.srcdc, self._client_w, self._client_h)
-        self.memdc.SelectObject(self.bmp)
+    @property
+    def client(self):
+        return self._client
+
+    @client.setter
+    def client(self, value):
+        self._client = value
+        if hasattr(self.capture, 'client'):
+            self.capture.client = value
+
+    def capture_frame(self):
+        '''
+        Capture the whole window into a new Frame
+
+            : return: Frame, None if the capture failed
+        '''
+        return self.capture.capture_after(self.input_time)
+
+    def start_capture_thread(self, fps=10, size=4):
+        '''
+        Capture on a background thread, snapshots are then the newest frame captured after the last input
+
+            : param fps = 10: captures per second
+
+            : param size = 4: frames kept in the ring buffer
+        '''
+        if not isinstance(self.capture, CaptureThread):
+            self.capture = CaptureThread(self.capture, fps, size)
+        self.capture.start()
+        return self.capture
+
+    def stop_capture_thread(self):
+        if isinstance(self.capture, CaptureThread):
+            self.capture.stop()
+            self.capture = self.capture.backend
+
+    def new_frame(self, delay=0):
+        '''
+        Take a new snapshot, detections of the current loop iteration will run on it
+
+            : param delay = 0: seconds to wait before capturing
+
+            : return: Frame, None if the capture failed
+        '''
+        if delay:
+            time.sleep(delay)
+        self._settle_input()
+        previous = self.frame
+        frame = self.capture_frame()
+        anchor = self.anchor_frame if self.anchor_frame is not None else previous
+        if frame is not None and anchor is not None:
+            # Compared with the frame the detections come from, small changes can not add up unseen
+            frame.changed = self.change_detector.changed(anchor, frame)
+            if not frame.changed and self.reuse_unchanged and self.reused < self.max_reuse:
+                # Same picture as the anchor, its detections still hold
+                frame.results = anchor.results
+                self.reused += 1
+            else:
+                self.anchor_frame = frame
+                self.reused = 0
+            self.previous_frame = previous
+        else:
+            self.anchor_frame = frame
+            self.reused = 0
+        self.frame = frame
+        if self.recorder is not None:
+            self.recorder.record_frame(frame)
+        if self.popups is not None:
+            self.popups(frame)
+        return frame
+
+    def start_recording(self, folder='./recordings', **kwargs):
+        '''
+        Record snapshots, detections and inputs in the background, see Recorder for the options
+        '''
+        if self.recorder is None:
+            self.recorder = Recorder(folder, **kwargs).start()
+        return self.recorder
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.stop()
+            self.recorder = None
+
+    def frame_changed(self):
+        '''
+        : return: False if the current snapshot is the same picture as the previous one,
+        True if it changed or could not be compared
+        '''
+        frame = self.frame
+        return frame is None or frame.changed is not False
+
+    def changed_regions(self):
+        '''
+        : return: dict name -> True if that region of change_detector changed since the previous snapshot
+        '''
+        return self.change_detector.changed_regions(self.previous_frame, self.frame)
+
+    def get_frame(self, max_age=None, delay=0):
+        '''
+        Get the current snapshot, capture a new one if it is missing or too old
+
+            : param max_age = None: staleness budget in seconds, self.frame_max_age if empty
+
+            : param delay = 0: seconds to wait before capturing, only when a capture is needed
+
+            : return: Frame, None if the capture failed
+        '''
+        if max_age is None:
+            max_age = self.frame_max_age
+        self._settle_input()
+        frame = self.frame
+        if frame is not None and frame.age() <= max_age:
+            return frame
+        return self.new_frame(delay)
+
+    def stop(self):
+        '''
+        Stop the game loop of the window, e.g. from a popup handler: both runtimes end the account as stopped
+        '''
+        self.run = False
+
+    def invalidate_frame(self):
+        '''
+        Drop the current snapshot, called after every input since the screen will change
+        '''
+        self.frame = None
+        self.previous_frame = None
+        self.anchor_frame = None
+        self.input_time = time.time()
+
+    def _settle_input(self):
+        '''
+        Drop the snapshot if the last input was played since, the frame fields are only written by the game loop
+        '''
+        future = self.pending_input
+        if future is not None and future.done():
+            self.pending_input = None
+            self.invalidate_frame()
 
     def window_full_shot(self, file_name=None, gray=0):
         '''
@@ -60,34 +231,16 @@ class GameControl():
 
             : return: return RGB data if file_name is empty
         '''
-        try:
-            if (not hasattr(self, 'memdc')):
-                self.init_mem()
-            if self.client == 0:
-                self.memdc.BitBlt((0, 0), (self._client_w, self._client_h), self.srcdc,
-                                  (self._border_l, self._border_t), win32con.SRCCOPY)
-            else:
-                self.memdc.BitBlt((0, -35), (self._client_w, self._client_h), self.srcdc,
-                                  (self._border_l, self._border_t), win32con.SRCCOPY)
-            if file_name != None:
-                self.bmp.SaveBitmapFile(self.memdc, file_name)
-                return
-            else:
-                signedIntsArray = self.bmp.GetBitmapBits(True)
-                #img = np.fromstring(signedIntsArray, dtype='uint8')
-                img = np.frombuffer(signedIntsArray, dtype='uint8')
-                img.shape = (self._client_h, self._client_w, 4)
-                #cv2.imshow("image", cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY))
-                # cv2.waitKey(0)
-                if gray == 0:
-                    return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-                else:
-                    return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
-        except Exception:
-            self.init_mem()
-            #logging.warning('window_full_shot执行失败')
-            #a = traceback.format_exc()
-            #logging.warning(a)
+        if file_name != None:
+            self.capture.save(file_name)
+            return
+        frame = self.new_frame()
+        if frame is None:
+            return None
+        if gray == 0:
+            return cv2.cvtColor(frame.bgra, cv2.COLOR_BGRA2BGR)
+        else:
+            return cv2.cvtColor(frame.bgra, cv2.COLOR_BGRA2GRAY)
 
     def window_part_shot(self, pos1, pos2, file_name=None, gray=0):
         '''
@@ -101,45 +254,47 @@ class GameControl():
 
             : param gray = 0: whether to return grayscale image, 0: return BGR color image, others: return grayscale black and white image
 
-            : return: return RGB data if file_name is empty
-        '''
-        w = pos2[0]-pos1[0]
-        h = pos2[1]-pos1[1]
-        hwindc = win32gui.GetWindowDC(self.hwnd)
-        srcdc = win32ui.CreateDCFromHandle(hwindc)
-        memdc = srcdc.CreateCompatibleDC()
-        bmp = win32ui.CreateBitmap()
-        bmp.CreateCompatibleBitmap(srcdc, w, h)
-        memdc.SelectObject(bmp)
-        if self.client == 0:
-            memdc.BitBlt((0, 0), (w, h), srcdc,
-                         (pos1[0]+self._border_l, pos1[1]+self._border_t), win32con.SRCCOPY)
-        else:
-            memdc.BitBlt((0, -35), (w, h), srcdc,
-                         (pos1[0]+self._border_l, pos1[1]+self._border_t), win32con.SRCCOPY)
+            : return: return RGB data if file_name is empty, copied from the snapshot when it is fresh enough
+        '''
+        if file_name == None:
+            self._settle_input()
+            frame = self.frame
+            if frame is not None and frame.age() <= self.frame_max_age:
+                # The snapshot buffers go back to the pool once the frame is dropped, never hand out a view
+                return frame.image(gray)[pos1[1]:pos2[1], pos1[0]:pos2[0]].copy()
+        img = self.capture.capture_part(pos1, pos2)
+        if img is None:
+            return None
         if file_name != None:
-            bmp.SaveBitmapFile(memdc, file_name)
-            srcdc.DeleteDC()
-            memdc.DeleteDC()
-            win32gui.ReleaseDC(self.hwnd, hwindc)
-            win32gui.DeleteObject(bmp.GetHandle())
+            cv2.imwrite(file_name, img)
             return
+        if gray == 0:
+            return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
         else:
-            signedIntsArray = bmp.GetBitmapBits(True)
-            img = np.frombuffer(signedIntsArray, dtype='uint8')
-            img.shape = (h, w, 4)
-            srcdc.DeleteDC()
-            memdc.DeleteDC()
-            win32gui.ReleaseDC(self.hwnd, hwindc)
-            win32gui.DeleteObject(bmp.GetHandle())
-            #cv2.imshow("image", cv2.cvtColor(img, cv2.COLOR_BGRA2BGR))
-            # cv2.waitKey(0)
-            if gray == 0:
-                return cv2.cvtColor(img, cv2.COLOR_BGRA2BGR)
-            else:
-                return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
+            return cv2.cvtColor(img, cv2.COLOR_BGRA2GRAY)
 
-    def find_color(self, region, color, tolerance=0):
+    def region_image(self, pos1, pos2, frame=None):
+        '''
+        BGR pixels of a window area, sliced from the snapshot when it is fresh enough
+
+            : param pos1: (x, y) coordinates of the upper left corner of the area
+
+            : param pos2: (x, y) coordinates of the lower right corner of the area
+
+            : param frame = None: snapshot to read, the current one if empty
+
+            : return: (h, w, 3) BGR array, a copy the caller owns
+        '''
+        if frame is None:
+            self._settle_input()
+            frame = self.frame
+            if frame is not None and frame.age() > self.frame_max_age:
+                frame = None
+        if frame is not None:
+            return frame.bgra[pos1[1]:pos2[1], pos1[0]:pos2[0], :3].copy()
+        return self.window_part_shot(pos1, pos2)
+
+    def find_color(self, region, color, tolerance=0, mode='first', frame=None):
         '''
         Looking for color
 
@@ -149,27 +304,35 @@ class GameControl():
 
             : param tolerance = 0: tolerance value
 
-            : return: successfully returns the coordinates of the client area, -1 if it fails
-        '''
-        img = Image.fromarray(self.window_part_shot(
-            region[0], region[1]), 'RGB')
-        width, height = img.size
-        r1, g1, b1 = color[:3]
-        for x in range(width):
-            for y in range(height):
-                try:
-                    pixel = img.getpixel((x, y))
-                    r2, g2, b2 = pixel[:3]
-                    if abs(r1-r2) <= tolerance and abs(g1-g2) <= tolerance and abs(b1-b2) <= tolerance:
-                        return x+region[0][0], y+region[0][1]
-                except Exception:
-                    logging.warning('find_color failed to execute')
-                    a = traceback.format_exc()
-                    logging.warning(a)
-                    return -1
-        return -1
-
-    def check_color(self, pos, color, tolerance=0):
+            : param mode = 'first': 'first': first match scanning column by column, 'all': every match, 'count': number of matches
+
+            : param frame = None: snapshot to search in, the current one if empty
+
+            : return: 'first': coordinates of the client area, -1 if it fails; 'all': list of coordinates; 'count': int
+        '''
+        try:
+            img = self.region_image(region[0], region[1], frame)
+            mask = color_mask(img, color, tolerance)
+        except Exception:
+            logging.warning('find_color failed to execute')
+            a = traceback.format_exc()
+            logging.warning(a)
+            if mode == 'all':
+                return []
+            if mode == 'count':
+                return 0
+            return -1
+        if mode == 'count':
+            return int(np.count_nonzero(mask))
+        # Transposed so matches come out ordered by x then y
+        xs, ys = np.nonzero(mask.T)
+        if mode == 'all':
+            return [(int(x)+region[0][0], int(y)+region[0][1]) for x, y in zip(xs, ys)]
+        if len(xs) == 0:
+            return -1
+        return int(xs[0])+region[0][0], int(ys[0])+region[0][1]
+
+    def check_color(self, pos, color, tolerance=0, frame=None):
         '''
         Compare the color of a point in the window
 
@@ -179,17 +342,29 @@ class GameControl():
 
             : param tolerance = 0: tolerance value
 
+            : param frame = None: snapshot to read, the current one if empty
+
             : return: returns True on success, False on failure
         '''
-        img = Image.fromarray(self.window_full_shot(), 'RGB')
-        r1, g1, b1 = color[:3]
-        r2, g2, b2 = img.getpixel(pos)[:3]
-        if abs(r1-r2) <= tolerance and abs(g1-g2) <= tolerance and abs(b1-b2) <= tolerance:
-            return True
-        else:
-            return False
+        img = self.region_image(pos, (pos[0]+1, pos[1]+1), frame)
+        return bool(color_mask(img, color, tolerance).any())
+
+    def _source_image(self, part=0, pos1=None, pos2=None, gray=0, delay=0):
+        '''
+        Image to search in, the current snapshot for full window searches
 
-    def find_img(self, img_template_path, part=0, pos1=None, pos2=None, gray=0, center=True,delay=0.1):
+            : return: numpy image, None if the capture failed
+        '''
+        if part == 1:
+            if delay:
+                time.sleep(delay)
+            return self.window_part_shot(pos1, pos2, None, gray)
+        frame = self.get_frame(delay=delay)
+        if frame is None:
+            return None
+        return frame.image(gray)
+
+    def find_img(self, img_template_path, part=0, pos1=None, pos2=None, gray=0, center=True,delay=0.1, thread=None, pyramid=None):
         '''
         Find pictures
 
@@ -203,32 +378,38 @@ class GameControl():
 
             : param gray = 0: whether to search by color, 0: find color pictures, 1: find black and white pictures
 
+            : param thread = None: threshold of the caller, full window searches then look in the learned region of the template first
+
+            : param pyramid = None: pyramid levels of full window searches, self.pyramid_levels if empty, 0 to disable
+
             : return: (maxVal, maxLoc) maxVal is the correlation, the closer to 1, the better, maxLoc is the obtained coordinate
         '''
-        time.sleep(delay)
         # Get screenshot
         if part == 1:
-            img_src = self.window_part_shot(pos1, pos2, None, gray)
-            #print('take part shot')
+            frame = None
+            img_src = self._source_image(part, pos1, pos2, gray, delay)
         else:
-            img_src = self.window_full_shot(None, gray)
-            #print('take full shot')
+            frame = self.get_frame(delay=delay)
+            img_src = frame.image(gray) if frame is not None else None
         # show_img(img_src)
 
-        # Read file
-        if gray == 0:
-            img_template = cv2.imread(img_template_path, cv2.IMREAD_COLOR)
-        else:
-            img_template = cv2.imread(img_template_path, cv2.IMREAD_GRAYSCALE)
+        # Get template
+        img_template = self.templates.get(img_template_path, gray)
 
         #show_img(img_template)
         try:
-            res = cv2.matchTemplate(
-                img_src, img_template, cv2.TM_CCOEFF_NORMED)
-            minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(res)
+            if frame is not None:
+                roi_index = self.roi_index if self.roi_enable else None
+                if pyramid is None:
+                    pyramid = self.pyramid_levels
+                maxVal, maxLoc = match_in_frame(frame, img_template_path, img_template, gray, thread, roi_index, pyramid)
+            else:
+                res = cv2.matchTemplate(
+                    img_src, img_template, cv2.TM_CCOEFF_NORMED)
+                minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(res)
             if self.debug_enable:
                 if part == 1:
-                    img = self.window_part_shot(pos1,pos2,None,gray)
+                    img = self.window_part_shot(pos1,pos2,None,gray).copy()
                 else :
                     img = self.window_full_shot()
                 self.img = cv2.rectangle(img, maxLoc, (maxLoc[0]+img_template.shape[1],maxLoc[1]+img_template.shape[0]), (0, 255, 0), 3)
@@ -254,28 +435,29 @@ class GameControl():
         param pos1 = None: the coordinates of the upper left corner of the range to be searched
         param pos2 = None: the coordinates of the lower right corner of the range to be searched
         param gray = 0: whether to search by color, 0: find color pictures, 1: find black and white pictures
+        param thread = 0: minimum number of good keypoint matches
         return: coordinates (x, y), return (0, 0) if not found, -1 if it fails
         '''
         # Get screenshot
         if part == 1:
-            img_src = self.window_part_shot(pos1, pos2, None, gray)
+            frame = None
+            img_src = self._source_image(part, pos1, pos2, gray)
         else:
-            img_src = self.window_full_shot(None, gray)
+            frame = self.get_frame()
+            img_src = frame.image(gray) if frame is not None else None
 
         # show_img(img_src)
 
-        # Read file
-        if gray == 0:
-            img_template = cv2.imread(img_template_path, cv2.IMREAD_COLOR)
-        else:
-            img_template = cv2.imread(img_template_path, cv2.IMREAD_GRAYSCALE)
+        # Get template
+        img_template = self.templates.get(img_template_path, gray)
 
         try:
-            maxLoc = match_img_knn(img_template, img_src, thread)
+            features = get_feature_matcher(self.knn_backend)
+            maxLoc = features.match(img_template_path, img_src, gray, thread, frame)
             # print(maxLoc)
             if self.debug_enable:
                 if part == 1:
-                    img = self.window_part_shot(pos1,pos2,None,gray)
+                    img = self.window_part_shot(pos1,pos2,None,gray).copy()
                 else :
                     img = self.window_full_shot()
 
@@ -283,7 +465,7 @@ class GameControl():
                 print("Top left point location: ",maxLoc)
                 #print("Score: ",maxVal)
                 show_img(img)
-            if center:
+            if center and maxLoc != (0, 0):
                 maxLoc=list(maxLoc)
                 maxLoc[0]=int(maxLoc[0]+(img_template.shape[1]/2))
                 maxLoc[1]=int(maxLoc[1]+(img_template.shape[0]/2))
@@ -305,39 +487,87 @@ class GameControl():
         : param gray = 0: whether to search by colo:r, 0: find color pictures, 1: find black and white pictures
         : return: (maxVal, maxLoc) maxVal is the correlation list, the closer to 1, the better, maxLoc is the obtained coordinate list
         '''
-        
-        # Window screenshot
-        if part == 1:
-            img_src = self.window_part_shot(pos1, pos2, None, gray)
-        else:
-            img_src = self.window_full_shot(None, gray)
+        if part != 1:
+            pos1 = pos2 = None
+        requests = [MatchRequest(item, 0, pos1, pos2, gray, name=index, roi=False)
+                    for index, item in enumerate(img_template_path)]
+        result = self.find_batch(requests)
 
         # Return value list
         maxVal_list = []
         maxLoc_list = []
-        for item in img_template_path:
-            # Read file
-            if gray == 0:
-                img_template = cv2.imread(item, cv2.IMREAD_COLOR)
-            else:
-                img_template = cv2.imread(item, cv2.IMREAD_GRAYSCALE)
-
-            # Start recognition
-            try:
-                res = cv2.matchTemplate(
-                    img_src, img_template, cv2.TM_CCOEFF_NORMED)
-                minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(res)
-                maxVal_list.append(maxVal)
-                maxLoc_list.append(maxLoc)
-            except Exception:
-                logging.warning('find_multi_img执行失败')
-                a = traceback.format_exc()
-                logging.warning(a)
+        for item in result:
+            if item.top_left is None:
                 maxVal_list.append(0)
                 maxLoc_list.append(0)
+            elif part == 1:
+                maxVal_list.append(item.score)
+                maxLoc_list.append((item.top_left[0]-pos1[0], item.top_left[1]-pos1[1]))
+            else:
+                maxVal_list.append(item.score)
+                maxLoc_list.append(item.top_left)
         # Back to list
         return maxVal_list, maxLoc_list
 
+    def find_all(self, img_template_path, part=0, pos1=None, pos2=None, gray=1, thread=0.9, center=True, sort='score', max_results=None):
+        '''
+        Find every instance of a picture on one snapshot
+        : param img_template_path: the path of the image to be found
+        : param part = 0: whether to search in full screen, 1 is no, other is yes
+        : param pos1 = None: the coordinates of the upper left corner of the range to be searched
+        : param pos2 = None: the coordinates of the lower right corner of the range to be searched
+        : param gray = 1: whether to search by color, 0: find color pictures, 1: find black and white pictures
+        : param thread = 0.9: custom threshold
+        : param sort = 'score': 'score': best match first, 'position': top to bottom then left to right
+        : param max_results = None: max number of instances returned
+        : return: list of window coordinates, empty if nothing was found. Unlike find_img and find_game_img,
+        the positions found in a region (part=1) are already offset by pos1, click them as they are
+        '''
+        frame = self.get_frame()
+        img_template = self.templates.get(img_template_path, gray)
+        if frame is None or img_template is None:
+            return []
+        if part != 1:
+            pos1 = pos2 = None
+        else:
+            # Regions are lists or tuples, only tuples go into the memo key
+            pos1, pos2 = tuple(pos1), tuple(pos2)
+        key = ('find_all', img_template_path, gray, thread, pos1, pos2)
+        found = frame.results.get(key)
+        if found is None:
+            img_src = frame.image(gray)
+            x, y = 0, 0
+            if pos1 is not None:
+                x, y = pos1
+                img_src = img_src[pos1[1]:pos2[1], pos1[0]:pos2[0]]
+            try:
+                found = [(score, (loc[0]+x, loc[1]+y)) for score, loc in match_all(img_src, img_template, thread)]
+            except cv2.error:
+                found = []
+            frame.results[key] = found
+        if sort == 'position':
+            found = sorted(found, key=lambda item: (item[1][1], item[1][0]))
+        if max_results is not None:
+            found = found[:max_results]
+        positions = []
+        for score, loc in found:
+            if center:
+                positions.append([int(loc[0]+img_template.shape[1]/2), int(loc[1]+img_template.shape[0]/2)])
+            else:
+                positions.append(list(loc))
+        return positions
+
+    def find_batch(self, requests, frame=None):
+        '''
+        Find many pictures on one snapshot in parallel
+        : param requests: list of MatchRequest, each with its own threshold and region
+        : param frame = None: snapshot to search in, the current one if empty
+        : return: BatchResult, coordinates are window coordinates
+        '''
+        if frame is None:
+            frame = self.get_frame()
+        return self.matcher.match(frame, requests, self.roi_index)
+
     def activate_window(self):
         user32 = ctypes.WinDLL('user32.dll')
         user32.SwitchToThisWindow(self.hwnd, True)
@@ -365,6 +595,8 @@ class GameControl():
         win32api.mouse_event(win32con.MOUSEEVENTF_LEFTDOWN, 0, 0, 0, 0)
         time.sleep(random.randint(20, 80)/1000)
         win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+        self.input_frame = self.frame
+        self.invalidate_frame()
 
     def mouse_drag(self, pos1, pos2):
         '''
@@ -391,13 +623,17 @@ class GameControl():
                                  win32con.MOUSEEVENTF_ABSOLUTE, x, y, 0, 0)
             time.sleep(0.01)
         win32api.mouse_event(win32con.MOUSEEVENTF_LEFTUP, 0, 0, 0, 0)
+        self.input_frame = self.frame
+        self.invalidate_frame()
 
-    def mouse_click_bg(self, pos, pos_end=None):
+    def mouse_click_bg(self, pos, pos_end=None, wait=True):
         '''
             Background mouse click
             : param pos: (x, y) the coordinates of the mouse click
             : param pos_end = None: (x, y) If pos_end is not empty, 
             the mouse clicks a random position in the area where pos is the upper left corner coordinate pos_end is the lower right corner coordinate
+            : param wait = True: wait until the click is played, False to keep capturing while it plays
+            : return: Future of the click
         '''
         if self.debug_enable:
             img = self.window_full_shot()
@@ -409,7 +645,14 @@ class GameControl():
         else:
             pos_rand = (random.randint(
                 pos[0], pos_end[0]), random.randint(pos[1], pos_end[1]))
-        if self.client == 0:
+        if self.recorder is not None:
+            self.recorder.record_event('click', tuple(pos_rand))
+        return self._dispatch(self._click_bg, wait, pos_rand)
+
+    def _click_bg(self, pos_rand):
+        if self.dry_run:
+            self.inputs.append((time.time(), 'click', tuple(pos_rand)))
+        elif self.client == 0:
             #win32gui.SendMessage(self.hwnd, win32con.BM_CLICK,300,300)
             win32gui.SendMessage(self.hwnd, win32con.WM_MOUSEMOVE,
                                  0, win32api.MAKELONG(pos_rand[0], pos_rand[1]))
@@ -419,15 +662,65 @@ class GameControl():
             win32gui.SendMessage(self.hwnd, win32con.WM_LBUTTONUP,
                                  0, win32api.MAKELONG(pos_rand[0], pos_rand[1]))
         else:
-            command = str(pos_rand[0]) + ' ' + str(pos_rand[1])
-            os.system('adb shell input tap ' + command)
+            self.adb_shell().tap(pos_rand[0], pos_rand[1])
 
-    def mouse_drag_bg(self, pos1, pos2,delay=0.04):
+    def _dispatch(self, gesture, wait, *args):
+        '''
+        Play a gesture on the input thread of the window, the snapshot is dropped when it is queued and when it is done,
+        by this thread or by the next capture once the gesture is played
+        '''
+        self.input_frame = self.frame
+        self.invalidate_frame()
+        future = self.dispatcher.submit(gesture, *args)
+        self.pending_input = future
+        if wait:
+            try:
+                future.result()
+            except Exception:
+                logging.warning('input failed to execute')
+                logging.warning(traceback.format_exc())
+            self._settle_input()
+        return future
+
+    def wait_inputs(self, timeout=None):
+        '''
+        Wait until every queued click and drag is played
+        '''
+        return self.dispatcher.flush(timeout)
+
+    def use_adb(self, serial=None, adb='adb'):
+        '''
+        Send the clicks and drags to an Android emulator through adb instead of the window
+
+            : param serial = None: device serial, the only connected device if empty
+
+            : param adb = 'adb': path of the adb executable
+        '''
+        self.adb_serial = serial
+        self.adb_path = adb
+        self.client = 1
+
+    def adb_shell(self):
+        '''
+        : return: AdbShell of the emulator, use its batch() to send several inputs at once
+        '''
+        return get_adb_shell(self.adb_serial, self.adb_path)
+
+    def mouse_drag_bg(self, pos1, pos2,delay=0.04, wait=True):
         '''
             :param pos1: (x,y) 
             :param pos2: (x,y) 
+            :param wait = True: wait until the drag is played, False to keep capturing while it plays
+            :return: Future of the drag
         '''
-        if self.client == 0:
+        if self.recorder is not None:
+            self.recorder.record_event('drag', (tuple(pos1), tuple(pos2)))
+        return self._dispatch(self._drag_bg, wait, pos1, pos2, delay)
+
+    def _drag_bg(self, pos1, pos2, delay):
+        if self.dry_run:
+            self.inputs.append((time.time(), 'drag', (tuple(pos1), tuple(pos2))))
+        elif self.client == 0:
             move_x = np.linspace(pos1[0], pos2[0], num=20, endpoint=True)[0:]
             move_y = np.linspace(pos1[1], pos2[1], num=20, endpoint=True)[0:]
             win32gui.SendMessage(self.hwnd, win32con.WM_LBUTTONDOWN,
@@ -441,9 +734,23 @@ class GameControl():
             win32gui.SendMessage(self.hwnd, win32con.WM_LBUTTONUP,
                                  0, win32api.MAKELONG(pos2[0], pos2[1]))
         else:
-            command = str(pos1[0])+' ' + str(pos1[1]) + \
-                ' '+str(pos2[0])+' '+str(pos2[1])
-            os.system('adb shell input swipe '+command)
+            self.adb_shell().swipe(pos1[0], pos1[1], pos2[0], pos2[1])
+
+    def wait_any(self, targets, timeout=100, cancel=None, interval=None):
+        '''
+        Wait for the first of several templates, colors or predicates, checked on every new frame
+
+            : param targets: list of MatchRequest, Waiter.ColorTarget and Waiter.PredicateTarget
+
+            : param timeout = 100: seconds before giving up
+
+            : param cancel = None: threading.Event ending the wait early
+
+            : param interval = None: seconds between two checks, every 0.05s if empty
+
+            : return: Waiter.WaitResult, false on timeout, the process is never exited
+        '''
+        return self.waiter.wait_any(targets, timeout, cancel, interval)
 
     def wait_game_img(self, img_path, max_time=100, quit=True):
         """
@@ -453,16 +760,9 @@ class GameControl():
         : param quit = True: whether to quit after timeout
         : return: return coordinates successfully, False if failed
         """
-        self.rejectbounty()
-        start_time = time.time()
-        while time.time()-start_time <= max_time and self.run:
-            maxVal, maxLoc = self.find_img(img_path)
-            if maxVal > 0.9:
-                return maxLoc
-            if max_time > 5:
-                time.sleep(1)
-            else:
-                time.sleep(0.1)
+        result = self.wait_any([MatchRequest(img_path, 0.9, gray=0)], max_time)
+        if result:
+            return result.position
         if quit:
             # Time out to exit the game
             self.quit_game()
@@ -477,16 +777,23 @@ class GameControl():
         : param quit = True: whether to quit after timeout
         : return: return coordinates successfully, False if failed
         '''
-        self.rejectbounty()
-        start_time = time.time()
-        while time.time()-start_time <= max_time and self.run:
-            maxLoc = self.find_img_knn(img_path, thread=thread)
-            if maxLoc != (0, 0):
-                return maxLoc
-            if max_time > 5:
-                time.sleep(1)
-            else:
-                time.sleep(0.1)
+        checked = [0]
+
+        def knn(frame):
+            # Keypoint matching is the costly check: its result is kept on the frame so unchanged frames sharing
+            # the results of their anchor skip it, and changed ones are matched at most every KNN_WAIT_INTERVAL
+            key = ('wait_knn', img_path, thread)
+            if key not in frame.results:
+                now = time.time()
+                if now - checked[0] < KNN_WAIT_INTERVAL:
+                    return None
+                checked[0] = now
+                maxLoc = self.find_img_knn(img_path, thread=thread)
+                frame.results[key] = maxLoc if maxLoc != (0, 0) else None
+            return frame.results[key]
+        result = self.wait_any([PredicateTarget(knn, img_path)], max_time)
+        if result:
+            return result.position
         if quit:
             # Time out to exit the game
             self.quit_game()
@@ -503,13 +810,9 @@ class GameControl():
         : param quit = True: whether to quit after timeout
         : return: Returns True on success, False on failure
         '''
-        self.rejectbounty()
-        start_time = time.time()
-        while time.time()-start_time <= max_time and self.run:
-            pos = self.find_color(region, color)
-            if pos != -1:
-                return True
-            time.sleep(1)
+        result = self.wait_any([ColorTarget(region, color, tolerance)], max_time)
+        if result:
+            return True
         if quit:
             # Time out to exit the game
             self.quit_game()
@@ -520,9 +823,8 @@ class GameControl():
         '''
         exit the game
         '''
-        #self.takescreenshot()  # Save the scene
-        self.clean_mem()    # Clean up memory
-        #logging.info('Exit, the last display has been saved to the /img/screenshots folder')
+        self.takescreenshot()  # Save the scene
+        self.close()    # Clean up memory
         sys.exit(0)
 
     def takescreenshot(self):
@@ -534,18 +836,7 @@ class GameControl():
         self.window_full_shot(img_src_path)
         logging.info('Screenshot has been saved to img/screenshots/%s.png' %(name))
 
-    def rejectbounty(self):
-        '''
-        Refusal
-        return: refuse to return True, otherwise return False
-        '''
-        maxVal, maxLoc = self.find_img('./screenshots/coopwanted.png',thread=0.8)
-        if maxVal > 0.9:
-            self.mouse_click_bg((749, 453))
-            return True
-        return False
-
-    def find_game_img(self, img_path, part=0, pos1=None, pos2=None, gray=1, center=True,thread=0.9):
+    def find_game_img(self, img_path, part=0, pos1=None, pos2=None, gray=1, center=True,thread=0.9, pyramid=None):
         '''
         Find pictures
         : param img_path: search path
@@ -554,11 +845,13 @@ class GameControl():
         : param pos2 = None: the coordinates of the lower right corner of the range to be searched
         : param gray = 0: whether to find black and white pictures, 0: find color pictures, 1: find black and white pictures
         : param thread = 0.9: custom threshold
+        : param pyramid = None: pyramid levels, coarse to fine search for big templates
         : return: Returns the position coordinates after successful search, otherwise returns False
         '''
-        #self.rejectbounty()
-        maxVal, maxLoc = self.find_img(img_path, part, pos1, pos2, gray,center)
+        maxVal, maxLoc = self.find_img(img_path, part, pos1, pos2, gray,center, thread=thread, pyramid=pyramid)
         # print(maxVal)
+        if self.recorder is not None:
+            self.recorder.record_event('find', (img_path, float(maxVal), maxLoc if maxVal > thread else None))
         if maxVal > thread:
             return list(maxLoc)
         else:
@@ -575,7 +868,6 @@ class GameControl():
         : param thread = 0:
         : return: Returns the position coordinates after successful search, otherwise returns False
         '''
-        #self.rejectbounty()
         maxLoc = self.find_img_knn(img_path, part, pos1, pos2, gray, thread,center)
         # print(maxVal)
         if maxLoc != (0, 0):
@@ -609,49 +901,36 @@ class GameControl():
         '''
         Clean up memory
         '''
-        self.srcdc.DeleteDC()
-        self.memdc.DeleteDC()
-        win32gui.ReleaseDC(self.hwnd, self.hwindc)
-        win32gui.DeleteObject(self.bmp.GetHandle())
+        self.capture.close()
+
+    def close(self):
+        '''
+        Release everything the window holds: capture thread, input thread, recording and capture
+        '''
+        self.stop_capture_thread()
+        self.dispatcher.stop()
+        self.stop_recording()
+        self.clean_mem()
 
 
 # For testing
 
 def match_img_knn(queryImage, trainingImage, thread=0):
-    thread=0
-    sift = cv2.xfeatures2d.SIFT_create()  
-    #sift=cv2.ORB_create(nfeatures=2500)
-    #sift=cv2.xfeatures2d.SURF_create()
-    kp1, des1 = sift.detectAndCompute(queryImage, None)
-    kp2, des2 = sift.detectAndCompute(trainingImage, None)
-  
-    FLANN_INDEX_KDTREE = 1
-    indexParams = dict(algorithm=FLANN_INDEX_KDTREE, trees=5)
-    searchParams = dict(checks=50)
-    flann = cv2.FlannBasedMatcher(indexParams, searchParams)
-    matches = flann.knnMatch(des1, des2, k=2)
-
-    good = []
-
-    matchesMask = [[0, 0] for i in range(len(matches))]
-    for i, (m, n) in enumerate(matches):
-        if m.distance < 0.7*n.distance: 
-            matchesMask[i] = [1, 0]
-            good.append(m)
+    return get_feature_matcher().match_images(queryImage, trainingImage, thread)
 
-    s = sorted(good, key=lambda x: x.distance)
-    
+def color_mask(img, color, tolerance=0):
     '''
-    drawParams=dict(matchColor=(0,0,255),singlePointColor=(255,0,0),matchesMask=matchesMask,flags=0) #给特征点和匹配的线定义颜色
-    resultimage=cv2.drawMatchesKnn(queryImage,kp1,trainingImage,kp2,matches,None,**drawParams) #画出匹配的结果
-    show_img(resultimage)
+    Pixels of a BGR image within tolerance of a color, all channels compared at once
+    : param img: (h, w, 3) BGR image
+    : param color: (r, g, b) the color to compare with
+    : param tolerance = 0: tolerance value per channel
+    : return: (h, w) bool mask
     '''
-
-    if len(good) > thread:
-        maxLoc = kp2[s[0].trainIdx].pt
-        return (int(maxLoc[0]), int(maxLoc[1]))
-    else:
-        return (0, 0)
+    r, g, b = color[:3]
+    target = np.array((b, g, r), dtype=np.int16)
+    lower = np.clip(target - tolerance, 0, 255).astype(np.uint8)
+    upper = np.clip(target + tolerance, 0, 255).astype(np.uint8)
+    return np.all((img >= lower) & (img <= upper), axis=2)
 
 def show_img(img):
     cv2.imshow("image", img)
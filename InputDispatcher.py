@@ -0,0 +1,69 @@
+import logging
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class InputDispatcher():
+    def __init__(self, name='InputDispatcher'):
+        '''
+        Play the gestures of one window in order on a dedicated thread, the callers get futures
+
+            : param name = 'InputDispatcher': name of the thread
+        '''
+        self.name = name
+        self._queue = queue.Queue()
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(None, self._run, name=self.name, daemon=True)
+                self._thread.start()
+
+    def submit(self, gesture, *args, **kwargs):
+        '''
+        Queue a gesture, it runs after the ones queued before
+
+            : param gesture: callable doing the input and its timing
+
+            : return: Future of the gesture result, wait on it when the order with later captures matters
+        '''
+        future = Future()
+        self._start()
+        self._queue.put((future, gesture, args, kwargs))
+        return future
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            future, gesture, args, kwargs = item
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(gesture(*args, **kwargs))
+            except BaseException as e:
+                logging.warning('%s: gesture failed: %s' % (self.name, e))
+                future.set_exception(e)
+
+    def flush(self, timeout=None):
+        '''
+        Wait until every gesture queued so far is played
+
+            : return: True if done before timeout
+        '''
+        try:
+            self.submit(lambda: None).result(timeout)
+            return True
+        except Exception:
+            return False
+
+    def stop(self):
+        if self._thread is not None:
+            self._queue.put(None)
+            if self._thread is not threading.current_thread():
+                self._thread.join(5)
+            self._thread = None
@@ -0,0 +1,385 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from TemplateRegistry import get_registry
+from RoiIndex import get_roi_index
+
+
+class MatchRequest():
+    def __init__(self, template, thread=0.9, pos1=None, pos2=None, gray=1, name=None, roi=True, pyramid=0):
+        '''
+        One template to look for in a batch
+
+            : param template: path of the template
+
+            : param thread = 0.9: threshold of this template
+
+            : param pos1 = None: upper left corner of the region to search, full frame if empty
+
+            : param pos2 = None: lower right corner of the region to search
+
+            : param gray = 1: 0: match color pictures, 1: match black and white pictures
+
+            : param name = None: key of the result, the template path if empty
+
+            : param roi = True: whether searches without a region may use the learned region of the template
+
+            : param pyramid = 0: pyramid levels of searches without a region, 0 to match at full resolution only
+        '''
+        self.template = template
+        self.thread = thread
+        self.pos1 = pos1
+        self.pos2 = pos2
+        self.gray = gray
+        self.name = template if name is None else name
+        self.roi = roi
+        self.pyramid = pyramid
+
+    @property
+    def part(self):
+        return self.pos1 is not None and self.pos2 is not None
+
+
+class MatchResult():
+    def __init__(self, request, score=0, top_left=None, size=None):
+        '''
+        Result of one template of a batch, coordinates are window coordinates
+
+            : param request: the MatchRequest
+
+            : param score = 0: best correlation
+
+            : param top_left = None: (x, y) of the best match
+
+            : param size = None: (w, h) of the template
+        '''
+        self.request = request
+        self.name = request.name
+        self.score = score
+        self.top_left = top_left
+        self.size = size
+
+    @property
+    def found(self):
+        return self.top_left is not None and self.score > self.request.thread
+
+    @property
+    def center(self):
+        if self.top_left is None:
+            return None
+        return [int(self.top_left[0]+self.size[0]/2), int(self.top_left[1]+self.size[1]/2)]
+
+    def position(self, center=True):
+        '''
+        : return: coordinates like find_game_img, False if not found
+        '''
+        if not self.found:
+            return False
+        if center:
+            return self.center
+        return list(self.top_left)
+
+    def __bool__(self):
+        return self.found
+
+    def __repr__(self):
+        return 'MatchResult(%s, score=%.3f, top_left=%s)' % (self.name, self.score, str(self.top_left))
+
+
+class BatchResult():
+    def __init__(self, results):
+        '''
+        Results of a batch, in request order
+
+            : param results: list of MatchResult
+        '''
+        self.results = results
+        self._by_name = dict((item.name, item) for item in results)
+
+    def __getitem__(self, name):
+        return self._by_name[name]
+
+    def __iter__(self):
+        return iter(self.results)
+
+    def __len__(self):
+        return len(self.results)
+
+    def found(self):
+        '''
+        : return: list of the results above their threshold, in request order
+        '''
+        return [item for item in self.results if item.found]
+
+    def first(self):
+        '''
+        : return: first result above its threshold in request order, None if nothing was found
+        '''
+        for item in self.results:
+            if item.found:
+                return item
+        return None
+
+    def best(self):
+        '''
+        : return: result above its threshold with the highest score, None if nothing was found
+        '''
+        found = self.found()
+        if not found:
+            return None
+        return max(found, key=lambda item: item.score)
+
+    def positions(self, center=True):
+        '''
+        : return: list of coordinates like find_game_img, False for templates not found
+        '''
+        return [item.position(center) for item in self.results]
+
+
+def match_template(img_src, img_template):
+    '''
+    Run TM_CCOEFF_NORMED and keep the best match
+
+        : return: (maxVal, maxLoc)
+    '''
+    res = cv2.matchTemplate(img_src, img_template, cv2.TM_CCOEFF_NORMED)
+    minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(res)
+    return maxVal, maxLoc
+
+
+# Templates are not downscaled below this size, smaller ones lose too much detail
+MIN_PYRAMID_SIZE = 12
+
+
+def match_pyramid(frame, template, gray=0, levels=2, candidates=3, registry=None):
+    '''
+    Coarse to fine matching: match the downscaled template on the downscaled frame,
+    then refine the best candidates at full resolution
+
+        : param frame: Frame to search in
+
+        : param template: path of the template
+
+        : param gray = 0: 0: match color pictures, others: match black and white pictures
+
+        : param levels = 2: pyrDown steps of the coarse pass, lowered for small templates
+
+        : param candidates = 3: coarse candidates refined at full resolution
+
+        : param registry = None: template registry, the shared one if empty
+
+        : return: (maxVal, maxLoc) full resolution TM_CCOEFF_NORMED score, same scale as match_template
+    '''
+    if registry is None:
+        registry = get_registry()
+    item = registry.template(template)
+    img_src = frame.image(gray)
+    img_template = item.image(gray)
+    th, tw = img_template.shape[:2]
+    level = levels
+    while level > 0 and min(th, tw) >> level < MIN_PYRAMID_SIZE:
+        level -= 1
+    if level == 0:
+        return match_template(img_src, img_template)
+    coarse = cv2.matchTemplate(frame.pyramid(gray, level), item.pyramid(gray, level), cv2.TM_CCOEFF_NORMED)
+    scale = 1 << level
+    margin = 2 * scale
+    h, w = img_src.shape[:2]
+    hw, hh = max(1, (tw // scale) // 2), max(1, (th // scale) // 2)
+    best = (-1.0, (0, 0))
+    for i in range(candidates):
+        minVal, maxVal, minLoc, maxLoc = cv2.minMaxLoc(coarse)
+        if maxVal <= -1.0:
+            break
+        cx, cy = maxLoc
+        x1 = max(0, cx*scale - margin)
+        y1 = max(0, cy*scale - margin)
+        x2 = min(w, cx*scale + tw + margin)
+        y2 = min(h, cy*scale + th + margin)
+        val, loc = match_template(img_src[y1:y2, x1:x2], img_template)
+        if val > best[0]:
+            best = (val, (loc[0]+x1, loc[1]+y1))
+        # Suppress this candidate so the next minMaxLoc finds another place
+        coarse[max(0, cy-hh):cy+hh+1, max(0, cx-hw):cx+hw+1] = -1.0
+    return best
+
+
+def match_all(img_src, img_template, thread=0.9, overlap=0.3, max_results=None):
+    '''
+    Every instance of a template: threshold the response map, keep its local maxima
+    and apply non-maximum suppression
+
+        : param img_src: image to search in
+
+        : param img_template: template to find
+
+        : param thread = 0.9: minimum correlation
+
+        : param overlap = 0.3: two matches overlapping more than this (intersection over union) are one instance
+
+        : param max_results = None: stop after this many instances
+
+        : return: list of (score, (x, y)) top left corners, best score first
+    '''
+    res = cv2.matchTemplate(img_src, img_template, cv2.TM_CCOEFF_NORMED)
+    th, tw = img_template.shape[:2]
+    # Only keep the peaks, there are many pixels above the threshold around each instance
+    kernel = np.ones((max(3, th//2 | 1), max(3, tw//2 | 1)), np.uint8)
+    peaks = (res >= thread) & (res >= cv2.dilate(res, kernel))
+    ys, xs = np.nonzero(peaks)
+    if len(xs) == 0:
+        return []
+    scores = res[ys, xs]
+    order = np.argsort(-scores)
+    kept = []
+    area = float(tw*th)
+    for i in order:
+        x, y = int(xs[i]), int(ys[i])
+        suppressed = False
+        for score, (kx, ky) in kept:
+            iw = tw - abs(kx - x)
+            ih = th - abs(ky - y)
+            if iw > 0 and ih > 0 and iw*ih / (2*area - iw*ih) > overlap:
+                suppressed = True
+                break
+        if suppressed:
+            continue
+        kept.append((float(scores[i]), (x, y)))
+        if max_results is not None and len(kept) >= max_results:
+            break
+    return kept
+
+
+def match_in_frame(frame, template, img_template, gray=0, thread=None, roi_index=None, levels=0):
+    '''
+    Best match of a template on the whole frame, memoized on the frame and narrowed by the ROI index
+
+        : param frame: Frame to search in
+
+        : param template: path of the template, key of the memo and of the ROI index
+
+        : param img_template: decoded template
+
+        : param gray = 0: 0: match color pictures, others: match black and white pictures
+
+        : param thread = None: threshold accepting a match inside the learned region, no region is used if empty
+
+        : param roi_index = None: RoiIndex to narrow the search, full frame if empty
+
+        : param levels = 0: pyramid levels of full frame searches, 0 for a plain full resolution search
+
+        : return: (maxVal, maxLoc) maxLoc is the top left corner in window coordinates
+    '''
+    use_roi = roi_index is not None and thread is not None
+    # A full frame result answers every query, a region result only queries with the same threshold
+    full_key = ('find_img', template, gray, levels, False, None)
+    key = ('find_img', template, gray, levels, True, thread) if use_roi else full_key
+    if full_key in frame.results:
+        return frame.results[full_key]
+    if key in frame.results:
+        return frame.results[key]
+    img_src = frame.image(gray)
+    size = (img_template.shape[1], img_template.shape[0])
+    if use_roi:
+        region = roi_index.region(template, frame.width, frame.height)
+        if region is not None:
+            x1, y1, x2, y2 = region
+            maxVal, maxLoc = match_template(img_src[y1:y2, x1:x2], img_template)
+            maxLoc = (maxLoc[0]+x1, maxLoc[1]+y1)
+            if maxVal > thread:
+                roi_index.record(template, maxLoc, size)
+                frame.results[key] = (maxVal, maxLoc)
+                return maxVal, maxLoc
+            if roi_index.trust_miss(template):
+                frame.results[key] = (maxVal, maxLoc)
+                return maxVal, maxLoc
+    # Unknown template or region miss, fall back to the full frame
+    if levels > 0:
+        maxVal, maxLoc = match_pyramid(frame, template, gray, levels)
+    else:
+        maxVal, maxLoc = match_template(img_src, img_template)
+    if use_roi and maxVal > thread:
+        roi_index.record(template, maxLoc, size)
+    frame.results[full_key] = (maxVal, maxLoc)
+    return maxVal, maxLoc
+
+
+class BatchMatcher():
+    def __init__(self, workers=None, registry=None, roi_index=None):
+        '''
+        Match many templates against one frame on a thread pool, cv2 releases the GIL while matching
+
+            : param workers = None: size of the pool, number of cpus if empty
+
+            : param registry = None: template registry, the shared one if empty
+
+            : param roi_index = None: ROI index used for requests without a region, the shared one if empty
+        '''
+        self.workers = workers or os.cpu_count() or 1
+        self.templates = registry if registry is not None else get_registry()
+        self.roi_index = roi_index if roi_index is not None else get_roi_index()
+        self._executor = None
+        self._lock = threading.Lock()
+
+    @property
+    def executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
+
+    def _match_one(self, frame, request, roi_index):
+        img_template = self.templates.get(request.template, request.gray)
+        if img_template is None:
+            return MatchResult(request)
+        size = (img_template.shape[1], img_template.shape[0])
+        try:
+            if not request.part:
+                roi_index = roi_index if request.roi else None
+                maxVal, maxLoc = match_in_frame(frame, request.template, img_template,
+                                                request.gray, request.thread, roi_index, request.pyramid)
+                return MatchResult(request, maxVal, tuple(maxLoc), size)
+            x, y = request.pos1
+            img_src = frame.image(request.gray)[request.pos1[1]:request.pos2[1], request.pos1[0]:request.pos2[0]]
+            maxVal, maxLoc = match_template(img_src, img_template)
+        except cv2.error:
+            return MatchResult(request)
+        return MatchResult(request, maxVal, (maxLoc[0]+x, maxLoc[1]+y), size)
+
+    def match(self, frame, requests, roi_index=None):
+        '''
+        Match every request against the frame
+
+            : param frame: Frame to search in
+
+            : param requests: list of MatchRequest
+
+            : param roi_index = None: ROI index used for requests without a region, the one of the matcher if empty
+
+            : return: BatchResult in request order
+        '''
+        if frame is None:
+            return BatchResult([MatchResult(request) for request in requests])
+        if roi_index is None:
+            roi_index = self.roi_index
+        # Convert once here so that the workers do not race on the lazy conversions
+        if any(request.gray == 0 for request in requests):
+            frame.bgr
+        if any(request.gray != 0 for request in requests):
+            frame.gray
+        if len(requests) <= 1:
+            return BatchResult([self._match_one(frame, request, roi_index) for request in requests])
+        futures = [self.executor.submit(self._match_one, frame, request, roi_index) for request in requests]
+        return BatchResult([future.result() for future in futures])
+
+
+_matcher = BatchMatcher()
+
+
+def get_matcher():
+    '''
+    Batch matcher shared by every GameControl of the process
+    '''
+    return _matcher
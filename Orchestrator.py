@@ -0,0 +1,228 @@
+import json
+import logging
+import os
+import threading
+import time
+try:
+    import win32gui
+except ImportError:
+    win32gui = None
+
+WINDOW_TITLES = ('Onmyoji', '[#] Onmyoji [#]')
+CONFIG_PATH = './accounts.json'
+
+
+def find_windows(titles=WINDOW_TITLES):
+    '''
+    : param titles = WINDOW_TITLES: window names of the game clients
+
+    : return: list of (hwnd, title) of the visible game windows, every client is listed even if they share a name
+    '''
+    if win32gui is None:
+        return []
+
+    def callback(hwnd, windows):
+        if win32gui.IsWindowVisible(hwnd) and win32gui.IsWindowEnabled(hwnd):
+            title = win32gui.GetWindowText(hwnd)
+            if title in titles:
+                windows.append((hwnd, title))
+        return True
+
+    windows = []
+    win32gui.EnumWindows(callback, windows)
+    return windows
+
+
+class AccountConfig():
+    def __init__(self, window='Onmyoji', mode=2, rounds=9999, captain=True, main_dmg=True, stage=None, hwnd=None,
+                 adb_serial=None, adb_path='adb', replay=None):
+        '''
+        One account to play
+
+            : param window = 'Onmyoji': name of the game window
+
+            : param mode = 2: game mode, see main.py
+
+            : param rounds = 9999: number of rounds
+
+            : param captain = True: leader of the team
+
+            : param main_dmg = True: main damage dealer
+
+            : param stage = None: name of the stage played
+
+            : param hwnd = None: handle of the window, found by name if empty
+
+            : param adb_serial = None: serial of an emulator played through adb (screencap and shell input)
+            instead of a window, '' for the only connected device
+
+            : param adb_path = 'adb': path of the adb executable
+
+            : param replay = None: recording, folder of screenshots or video played in a loop instead of the window,
+            nothing is clicked, for regression runs
+        '''
+        self.window = window
+        self.mode = mode
+        self.rounds = rounds
+        self.captain = captain
+        self.main_dmg = main_dmg
+        self.stage = stage
+        self.hwnd = hwnd
+        self.adb_serial = adb_serial
+        self.adb_path = adb_path
+        self.replay = replay
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**dict((key, value) for key, value in data.items() if key in
+                          ('window', 'mode', 'rounds', 'captain', 'main_dmg', 'stage', 'hwnd',
+                           'adb_serial', 'adb_path', 'replay')))
+
+    def to_dict(self):
+        return {'window': self.window, 'mode': self.mode, 'rounds': self.rounds, 'captain': self.captain,
+                'main_dmg': self.main_dmg, 'stage': self.stage, 'hwnd': self.hwnd,
+                'adb_serial': self.adb_serial, 'adb_path': self.adb_path, 'replay': self.replay}
+
+    def capture(self):
+        '''
+        : return: ReplayCapture of replay, None to capture the window or the emulator
+        '''
+        if self.replay is None:
+            return None
+        from CaptureBackend import ReplayCapture
+        return ReplayCapture(self.replay, loop=True)
+
+
+def load_config(path=CONFIG_PATH):
+    '''
+    Read the accounts of a json file, a list of AccountConfig fields:
+
+        [{"window": "Onmyoji", "mode": 1, "rounds": 100, "captain": true}, ...]
+
+    Accounts without hwnd get the windows of their name in the order they are found
+
+    : return: list of AccountConfig, empty if the file does not exist
+    '''
+    if not os.path.exists(path):
+        return []
+    with open(path, 'r') as f:
+        configs = [AccountConfig.from_dict(item) for item in json.load(f)]
+    assign_windows(configs)
+    return configs
+
+
+def assign_windows(configs, windows=None):
+    '''
+    Give every config without hwnd its own window with the same name
+    '''
+    windows = find_windows() if windows is None else windows
+    taken = set(config.hwnd for config in configs if config.hwnd is not None)
+    for config in configs:
+        if config.hwnd is not None or config.adb_serial is not None or config.replay is not None:
+            # Emulators played through adb and replays need no window
+            continue
+        for hwnd, title in windows:
+            if title == config.window and hwnd not in taken:
+                config.hwnd = hwnd
+                taken.add(hwnd)
+                break
+        else:
+            logging.warning('Orchestrator: no free window named %s' % (config.window))
+    return configs
+
+
+class Orchestrator():
+    def __init__(self, configs, start_interval=1.0):
+        '''
+        Run one Processing worker per account, the template registry and matchers are shared by the process
+
+            : param configs: list of AccountConfig
+
+            : param start_interval = 1.0: seconds between two starts in start_all
+        '''
+        self.configs = list(configs)
+        self.start_interval = start_interval
+        self.workers = [None] * len(self.configs)
+        self._lock = threading.Lock()
+
+    def _create(self, index):
+        # Imported here, Processing loads the templates at import
+        from Processing import Processing
+        config = self.configs[index]
+        return Processing(config.window, config.mode, config.rounds, config.captain, config.main_dmg,
+                          capture=config.capture(), stage=config.stage, hwnd=config.hwnd, adbSerial=config.adb_serial, adbPath=config.adb_path)
+
+    def start(self, index):
+        '''
+        Start an account, nothing happens if it is running
+        '''
+        with self._lock:
+            worker = self.workers[index]
+            if worker is not None and worker.is_alive():
+                return worker
+            return self._launch(index)
+
+    def _launch(self, index):
+        worker = self.workers[index] = self._create(index)
+        worker.daemon = True
+        worker.start()
+        logging.info('Orchestrator: account %d started on window %s' % (index, str(self.configs[index].hwnd)))
+        return worker
+
+    def stop(self, index, timeout=10):
+        '''
+        Ask an account to stop and wait for it
+
+            : return: True if it stopped within timeout
+        '''
+        with self._lock:
+            worker = self.workers[index]
+        if worker is None:
+            return True
+        worker.stop()
+        if worker is not threading.current_thread():
+            worker.join(timeout)
+        return not worker.is_alive()
+
+    def restart(self, index, timeout=10):
+        '''
+        Stop an account and start a new worker for it, also when the old one did not stop within timeout:
+        its loop is already told to end and it releases its GameControl when it does
+        '''
+        if not self.stop(index, timeout):
+            logging.warning('Orchestrator: account %d did not stop, starting a new one anyway' % (index))
+        with self._lock:
+            return self._launch(index)
+
+    def start_all(self):
+        for index in range(len(self.configs)):
+            self.start(index)
+            if index + 1 < len(self.configs):
+                time.sleep(self.start_interval)
+
+    def stop_all(self, timeout=10):
+        for worker in self.workers:
+            if worker is not None:
+                worker.stop()
+        end = time.time() + timeout
+        for worker in self.workers:
+            if worker is not None:
+                worker.join(max(0, end - time.time()))
+
+    def status(self):
+        '''
+        : return: list of dict with the config of every account and whether it is running
+        '''
+        with self._lock:
+            return [dict(config.to_dict(), index=index, running=worker is not None and worker.is_alive())
+                    for index, (config, worker) in enumerate(zip(self.configs, self.workers))]
+
+    def join(self, interval=1.0):
+        '''
+        Block until every account is done, Ctrl+C stops them
+        '''
+        try:
+            while any(worker is not None and worker.is_alive() for worker in self.workers):
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stop_all()
@@ -0,0 +1,456 @@
+import asyncio
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from AsyncEngine import run_step
+
+
+def percentile(values, q):
+    '''
+    : param values: list of numbers
+
+    : param q: 0..1
+
+    : return: linear interpolated percentile, None if values is empty
+    '''
+    if not values:
+        return None
+    values = sorted(values)
+    pos = (len(values) - 1) * q
+    low = int(pos)
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (values[high] - values[low]) * (pos - low)
+
+
+class FixedPolicy():
+    def __init__(self, seconds):
+        '''
+        Always sleep the same time
+        '''
+        self.seconds = seconds
+
+    def delay(self, pacer, name, streak, elapsed):
+        return self.seconds
+
+
+class BackoffPolicy():
+    def __init__(self, initial=0.5, factor=2.0, maximum=5.0):
+        '''
+        Short sleeps first, longer ones while the same wait point keeps being hit
+
+            : param initial = 0.5: first sleep
+
+            : param factor = 2.0: growth of every following sleep
+
+            : param maximum = 5.0: longest sleep
+        '''
+        self.initial = initial
+        self.factor = factor
+        self.maximum = maximum
+
+    def delay(self, pacer, name, streak, elapsed):
+        return min(self.maximum, self.initial * self.factor ** streak)
+
+
+class LearnedPolicy():
+    def __init__(self, default, minimum=0.5, maximum=None, quantile=0.5, min_samples=5):
+        '''
+        Sleep until the usual end of the state the wait point is waiting out
+
+            : param default: sleep while fewer than min_samples durations are known
+
+            : param minimum = 0.5: shortest sleep, also once the usual end is past
+
+            : param maximum = None: longest sleep, no limit if empty
+
+            : param quantile = 0.5: part of the known durations that are over when waking up
+        '''
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.quantile = quantile
+        self.min_samples = min_samples
+
+    def delay(self, pacer, name, streak, elapsed):
+        durations = pacer.stats.durations(name)
+        if len(durations) < self.min_samples:
+            seconds = self.default
+        else:
+            seconds = max(self.minimum, percentile(durations, self.quantile) - elapsed)
+        if self.maximum is not None:
+            seconds = min(seconds, self.maximum)
+        return seconds
+
+
+class BattlePolicy():
+    def __init__(self, light=5.0, dense=0.5, early=0.1, min_samples=5):
+        '''
+        Learned battle length: sparse checks while the battle surely goes on, dense ones once it may end
+
+            : param light = 5.0: longest sleep during the battle, also while fewer than min_samples battles are known
+
+            : param dense = 0.5: sleep once the battle may be over
+
+            : param early = 0.1: percentile of the known battle durations where dense checks start
+        '''
+        self.light = light
+        self.dense = dense
+        self.early = early
+        self.min_samples = min_samples
+
+    def delay(self, pacer, name, streak, elapsed):
+        durations = pacer.stats.durations(name)
+        if len(durations) < self.min_samples:
+            return self.light
+        remaining = percentile(durations, self.early) - elapsed
+        if remaining <= self.dense:
+            return self.dense
+        # Wake up right where the shortest battles end
+        return min(self.light, remaining)
+
+
+class FrameChangePolicy():
+    def __init__(self, maximum=2.0, settle=0.2, interval=0.1, minimum=0.1):
+        '''
+        Wake up once the screen changed from the snapshot of the last input and stayed still for settle seconds,
+        e.g. after a click
+
+            : param maximum = 2.0: longest wait
+
+            : param settle = 0.2: seconds without change after the change
+
+            : param interval = 0.1: seconds between two captures
+
+            : param minimum = 0.1: shortest wait, also covers inputs sent without a snapshot to compare with
+        '''
+        self.maximum = maximum
+        self.settle = settle
+        self.interval = interval
+        self.minimum = minimum
+
+    def delay(self, pacer, name, streak, elapsed):
+        return self.maximum
+
+    def observe(self, gui, reference, frame, changed_at, now):
+        '''
+        : param reference: GameControl.input_frame when the wait began
+
+        : return: time of the last change seen, None while the screen still shows the reference
+        '''
+        if frame is None:
+            return now
+        if changed_at is None and reference is not None:
+            # The first frame after an input can not be compared with the previous one,
+            # only a difference with the screen the input was sent on counts as the change
+            return now if gui.change_detector.changed(reference, frame) else None
+        if frame.changed is not False:
+            return now
+        return changed_at
+
+    def settled(self, start, changed_at, now):
+        return changed_at is not None and now - changed_at >= self.settle and now - start >= self.minimum
+
+    def wait(self, pacer, seconds):
+        gui = pacer.gui
+        if gui is None:
+            return pacer.sleep(seconds)
+        reference = gui.input_frame
+        start = time.time()
+        changed_at = None
+        while gui.run:
+            if time.time() - start >= seconds:
+                break
+            frame = gui.new_frame(delay=self.interval)
+            now = time.time()
+            changed_at = self.observe(gui, reference, frame, changed_at, now)
+            if self.settled(start, changed_at, now):
+                break
+        return time.time() - start
+
+    async def wait_async(self, pacer, seconds, executor=None):
+        '''
+        wait for coroutines, every capture runs in executor and the intervals are slept on the event loop
+        '''
+        gui = pacer.gui
+        if gui is None:
+            await asyncio.sleep(seconds)
+            return seconds
+        reference = gui.input_frame
+        start = time.time()
+        changed_at = None
+        while gui.run:
+            if time.time() - start >= seconds:
+                break
+            await asyncio.sleep(self.interval)
+            frame = await run_step(executor, gui.new_frame, stop=gui.stop)
+            now = time.time()
+            changed_at = self.observe(gui, reference, frame, changed_at, now)
+            if self.settled(start, changed_at, now):
+                break
+        return time.time() - start
+
+
+class PacingStats():
+    def __init__(self, path='./pacing.json', samples=200, save_interval=30):
+        '''
+        Measured waits of every wait point, shared by the accounts and saved between runs
+
+            : param path = './pacing.json': file the durations are saved to, None to keep them in memory
+
+            : param samples = 200: durations kept per wait point
+
+            : param save_interval = 30: min seconds between two saves
+        '''
+        self.path = path
+        self.samples = samples
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._points = {}
+        self._dirty = False
+        self._saved = 0
+        # Measures not handed over yet, kept once journal() is called
+        self._journal = None
+        self.load()
+
+    def _point(self, name):
+        point = self._points.get(name)
+        if point is None:
+            point = self._points[name] = {'count': 0, 'waited': 0.0, 'durations': deque(maxlen=self.samples)}
+        return point
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            with self._lock:
+                for name, value in data.items():
+                    point = self._point(name)
+                    point['count'] = int(value['count'])
+                    point['waited'] = float(value['waited'])
+                    point['durations'].extend(value['durations'])
+        except Exception:
+            logging.warning('PacingStats: can not read %s, starting empty' % (self.path))
+
+    def save(self, force=False):
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty or (not force and time.time() - self._saved < self.save_interval):
+                return
+            data = json.dumps(dict((name, {'count': point['count'], 'waited': point['waited'],
+                                           'durations': list(point['durations'])})
+                                   for name, point in self._points.items()))
+            self._dirty = False
+            self._saved = time.time()
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError:
+            logging.warning('PacingStats: can not write %s' % (self.path))
+
+    def journal(self):
+        '''
+        Stop saving to the file and keep the new measures for drain(), in the account processes of the Supervisor
+        '''
+        with self._lock:
+            self.path = None
+            if self._journal is None:
+                self._journal = {}
+
+    def _journal_point(self, name):
+        point = self._journal.get(name)
+        if point is None:
+            point = self._journal[name] = {'count': 0, 'waited': 0.0, 'durations': []}
+        return point
+
+    def drain(self):
+        '''
+        : return: dict wait point -> count, waited and durations measured since the last drain, see merge
+        '''
+        with self._lock:
+            if self._journal is None:
+                return {}
+            journal, self._journal = self._journal, {}
+        return journal
+
+    def merge(self, measures):
+        '''
+        Add the measures drained from another process
+        '''
+        if not measures:
+            return
+        with self._lock:
+            for name, value in measures.items():
+                point = self._point(name)
+                point['count'] += value['count']
+                point['waited'] += value['waited']
+                point['durations'].extend(value['durations'])
+            self._dirty = True
+        self.save()
+
+    def record_wait(self, name, seconds):
+        with self._lock:
+            point = self._point(name)
+            point['count'] += 1
+            point['waited'] += seconds
+            if self._journal is not None:
+                point = self._journal_point(name)
+                point['count'] += 1
+                point['waited'] += seconds
+            self._dirty = True
+
+    def record_duration(self, name, seconds):
+        '''
+        Record how long the state behind a wait point lasted, from its first wait to the end of its last one
+        '''
+        with self._lock:
+            self._point(name)['durations'].append(round(seconds, 3))
+            if self._journal is not None:
+                self._journal_point(name)['durations'].append(round(seconds, 3))
+            self._dirty = True
+        self.save()
+
+    def durations(self, name):
+        with self._lock:
+            point = self._points.get(name)
+            return [] if point is None else list(point['durations'])
+
+    def report(self):
+        '''
+        : return: dict wait point -> count, mean wait, p10, p50 and p90 of the durations
+        '''
+        with self._lock:
+            points = [(name, point['count'], point['waited'], list(point['durations']))
+                      for name, point in self._points.items()]
+        report = {}
+        for name, count, waited, durations in sorted(points):
+            report[name] = {'count': count, 'mean_wait': waited / count if count else 0, 'samples': len(durations),
+                            'p10': percentile(durations, 0.1), 'p50': percentile(durations, 0.5),
+                            'p90': percentile(durations, 0.9)}
+        return report
+
+
+class Pacer():
+    def __init__(self, gui=None, policies=None, stats=None, reset_after=3.0, default=None, on_streak_end=None):
+        '''
+        Named wait points of one account, 'name@stage' points use the policy of 'name' and learn on their own
+
+            : param gui = None: GameControl, needed by FrameChangePolicy
+
+            : param policies = None: dict wait point -> policy
+
+            : param stats = None: PacingStats, the shared one if empty
+
+            : param reset_after = 3.0: a wait point hit again within this many seconds continues its streak
+
+            : param default = None: policy of unknown wait points, FrameChangePolicy() if empty
+
+            : param on_streak_end = None: callable(name, seconds) called when a streak is over
+        '''
+        self.gui = gui
+        self.policies = dict(policies or {})
+        self.stats = stats if stats is not None else get_pacing_stats()
+        self.reset_after = reset_after
+        self.default = default if default is not None else FrameChangePolicy()
+        self.on_streak_end = on_streak_end
+        self._current = None
+        self._streak = 0
+        self._streak_start = 0
+        self._last_end = 0
+
+    def sleep(self, seconds):
+        '''
+        Sleep that returns early when the account is stopped
+        '''
+        start = time.time()
+        end = start + seconds
+        while True:
+            remaining = end - time.time()
+            if remaining <= 0 or (self.gui is not None and not self.gui.run):
+                break
+            time.sleep(min(remaining, 0.5))
+        return time.time() - start
+
+    def end_streak(self):
+        '''
+        The state behind the current wait point is over, record how long it lasted
+        '''
+        if self._current is not None:
+            seconds = self._last_end - self._streak_start
+            self.stats.record_duration(self._current, seconds)
+            if self.on_streak_end is not None:
+                self.on_streak_end(self._current, seconds)
+        self._current = None
+        self._streak = 0
+
+    def _begin(self, name, policy):
+        now = time.time()
+        if name == self._current and now - self._last_end <= self.reset_after:
+            self._streak += 1
+        else:
+            self.end_streak()
+            self._current = name
+            self._streak_start = now
+        if policy is None:
+            policy = self.policies.get(name.split('@')[0], self.default)
+        return policy, policy.delay(self, name, self._streak, now - self._streak_start)
+
+    def _end(self, name, waited):
+        self._last_end = time.time()
+        self.stats.record_wait(name, waited)
+        return waited
+
+    def wait(self, name, policy=None):
+        '''
+        Wait at a named point
+
+            : param name: name of the wait point, e.g. 'soul.battle'
+
+            : param policy = None: policy to use, the configured one if empty
+
+            : return: seconds actually waited
+        '''
+        policy, seconds = self._begin(name, policy)
+        if hasattr(policy, 'wait'):
+            waited = policy.wait(self, seconds)
+        else:
+            waited = self.sleep(seconds)
+        return self._end(name, waited)
+
+    async def wait_async(self, name, policy=None, executor=None):
+        '''
+        wait for coroutines, no thread is held while waiting: policies capturing frames send only the captures
+        to executor
+        '''
+        policy, seconds = self._begin(name, policy)
+        start = time.time()
+        if hasattr(policy, 'wait_async'):
+            await policy.wait_async(self, seconds, executor)
+        elif hasattr(policy, 'wait'):
+            await run_step(executor, policy.wait, self, seconds, stop=self.gui.stop if self.gui is not None else None)
+        else:
+            await asyncio.sleep(seconds)
+        return self._end(name, time.time() - start)
+
+_stats = None
+_statsLock = threading.Lock()
+
+
+def get_pacing_stats():
+    '''
+    Stats shared by every account of the process, saved at exit
+    '''
+    global _stats
+    with _statsLock:
+        if _stats is None:
+            _stats = PacingStats()
+            atexit.register(_stats.save, True)
+        return _stats
@@ -0,0 +1,172 @@
+import logging
+import os
+import threading
+import time
+import weakref
+from collections import deque
+from Matcher import MatchRequest
+from TemplateRegistry import resolve_path
+
+
+class PopupDetector():
+    def __init__(self, name, template, handler, thread=0.9, pos1=None, pos2=None, gray=1, interval=1.0, cooldown=3.0):
+        '''
+        A popup that may show up at any time, e.g. a co-op invitation or a disconnection
+
+            : param name: name of the popup
+
+            : param template: path of the template of the popup
+
+            : param handler: callable(gui, position) dealing with the popup, runs on the thread of the game loop
+
+            : param thread = 0.9: threshold
+
+            : param pos1 = None: upper left corner of the region the popup shows up in, the learned region if empty
+
+            : param pos2 = None: lower right corner of the region
+
+            : param gray = 1: 0: match color pictures, 1: match black and white pictures
+
+            : param interval = 1.0: min seconds between two checks of one window
+
+            : param cooldown = 3.0: seconds the popup is ignored after its handler ran, the time it takes to close
+        '''
+        self.name = name
+        self.handler = handler
+        self.interval = interval
+        self.cooldown = cooldown
+        # Popups are rarely on screen, a coarse pass keeps the full frame searches cheap until their region is learned
+        self.request = MatchRequest(template, thread, pos1, pos2, gray, name=name, pyramid=2)
+
+
+class PopupRegistry():
+    def __init__(self):
+        '''
+        Popup detectors checked on the frames of every window
+        '''
+        self._lock = threading.Lock()
+        self._detectors = []
+
+    def register(self, detector):
+        '''
+        Add a detector, a detector with the same name is replaced
+        '''
+        with self._lock:
+            self._detectors = [item for item in self._detectors if item.name != detector.name] + [detector]
+        return detector
+
+    def register_if_present(self, detector):
+        '''
+        Add a detector if its template file exists, popups whose screenshot is not shipped are left out
+
+            : return: the detector, None if its template is missing
+        '''
+        if not os.path.exists(resolve_path(detector.request.template)):
+            logging.warning('Popup: no template %s, %s is not checked' % (detector.request.template, detector.name))
+            return None
+        return self.register(detector)
+
+    def unregister(self, name):
+        with self._lock:
+            self._detectors = [item for item in self._detectors if item.name != name]
+
+    def detectors(self):
+        with self._lock:
+            return list(self._detectors)
+
+    def __len__(self):
+        return len(self._detectors)
+
+
+class PopupWatcher():
+    def __init__(self, gui, registry=None):
+        '''
+        Check the popups on the frames the game loop of a window captures anyway, see GameControl.new_frame
+
+            : param gui: GameControl of the window
+
+            : param registry = None: PopupRegistry, the shared one if empty
+        '''
+        self.gui = gui
+        self.registry = registry if registry is not None else get_popup_registry()
+        self.enable = True
+        self.handled = {}
+        self._checked = {}
+        # Anchor frame each detector was last matched on, see GameControl.anchor_frame
+        self._anchors = {}
+        self._pending = deque()
+        self._busy = False
+
+    def check(self, frame):
+        '''
+        Match the due detectors on frame and queue the handlers of the popups found
+
+            : return: number of popups found
+        '''
+        if not self.enable or frame is None:
+            return 0
+        # An unchanged frame shows the popups of its anchor, a detector that already checked the anchor is skipped.
+        # A detector that was not due on the anchor still checks the unchanged frames once it is
+        anchor = self.gui.anchor_frame if frame.changed is False and self.gui.anchor_frame is not None else frame
+        now = time.time()
+        due = [detector for detector in self.registry.detectors()
+               if not self._checked_on(detector, anchor)
+               and now - self._checked.get(detector.name, 0) >= detector.interval
+               and now - self.handled.get(detector.name, 0) >= detector.cooldown]
+        if not due:
+            return 0
+        for detector in due:
+            self._checked[detector.name] = now
+            self._anchors[detector.name] = weakref.ref(anchor)
+        results = self.gui.find_batch([detector.request for detector in due], frame)
+        found = 0
+        for detector in due:
+            position = results[detector.name].position()
+            if position is False:
+                continue
+            self.handled[detector.name] = now
+            self._pending.append((detector, position))
+            if self.gui.recorder is not None:
+                self.gui.recorder.record_event('popup', (detector.name, position))
+            found += 1
+        return found
+
+    def _checked_on(self, detector, anchor):
+        reference = self._anchors.get(detector.name)
+        return reference is not None and reference() is anchor
+
+    def handle(self):
+        '''
+        Run the queued handlers in order
+        '''
+        while self._pending:
+            detector, position = self._pending.popleft()
+            logging.info('Popup: %s at %s' % (detector.name, str(position)))
+            try:
+                detector.handler(self.gui, position)
+            except Exception:
+                logging.exception('Popup: handler of %s failed' % (detector.name))
+
+    def __call__(self, frame):
+        '''
+        Check frame and deal with the popups found, handlers capturing frames do not check again
+        '''
+        if self._busy:
+            return 0
+        self._busy = True
+        try:
+            found = self.check(frame)
+            self.handle()
+            return found
+        finally:
+            self._busy = False
+
+
+_registry = PopupRegistry()
+
+
+def get_popup_registry():
+    '''
+    Popup detectors shared by every GameControl of the process
+    '''
+    return _registry
@@ -1,8 +1,17 @@
 import threading
-import keyboard
+try:
+    import keyboard
+except ImportError:
+    keyboard = None
 from GameControl import *
+from TemplateRegistry import get_registry
+from TemplateAtlas import load_atlas
+from Matcher import MatchRequest
+from RoiIndex import get_roi_index
+from CaptureBackend import AdbCapture, ReplayCapture
+from Pacing import Pacer, BattlePolicy, FixedPolicy, FrameChangePolicy, LearnedPolicy
+from PopupDetectors import PopupDetector, get_popup_registry
 import os
-import pyautogui
 from ThreadGame import *
 from Util import *
 
@@ -33,6 +42,7 @@ OK_SOUL_DIALOG_COORDINATE=(679, 375)
 CHECKBOX_COORDINATE=(390, 300)
 SOUL_ICON_COORDINATE=(173, 584)
 INVITE_SOUL_ONLY_COORDINATE=(670, 445)
+REFUSE_COOP_COORDINATE=(750, 452)
 SLIDE_LEVEL_OROCHI=[(276, 137),(271, 505)]
 CREATE_TEAM_SOUL_COORDINATE=(868, 564)
 REGION_TEAM_INVITE_SOUL=[(0,0),(729, 409)]
@@ -110,6 +120,8 @@ IMAGE_STORY_LIST_CHAPTER_PATH="./screenshots/Story/listchapter.png"
 IMAGE_STORY_SPIRIT_PATH="./screenshots/Story/spirit.png"
 IMAGE_STORY_ISINTEAM_PATH="./screenshots/Story/lead.png"
 IMAGE_STORY_CREATE_PATH="./screenshots/Story/create.png"
+IMAGE_STORY_SHIKIGAMI_SELECTED_LIST=[IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,IMAGE_STORY_SHIKIGAMI_SELECTED1_PATH,
+    IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,IMAGE_STORY_SHIKIGAMI_SELECTED3_PATH,IMAGE_STORY_SHIKIGAMI_SELECTED8_PATH]
 
 
 IMAGE_SOUL_X_START_PATH="./screenshots/SoulX/start.png"
@@ -150,7 +162,71 @@ IMAGE_COOP_SEAL="./screenshots/coopwanted.png"
 IMAGE_START_FIGHT="./screenshots/Event/fight.png"
 IMAGE_TARGET_SHIKIGAMI="./screenshots/Event/target.png"
 
-_localVariable=threading.local()
+_PYRAMID_LEVELS=2
+#captures per second of the background capture thread of every window, 0 to capture inline
+_CAPTURE_FPS=0
+#folder of the rolling session recording of every account (last 10 minutes), None to disable
+_RECORDING_FOLDER=None
+_RECORDING_SECONDS=600
+
+#wait points of the game loops, the measured waits are saved to pacing.json
+#FrameChangePolicy: wake up once the screen changed from the last click and settled, at most the given seconds,
+#the slow dialogs also wait a minimum
+#BattlePolicy: checks every 5s, every 0.5s once the shortest known battles of the mode and stage are over
+_PACING={
+    "soul.battle":BattlePolicy(5,0.5),
+    "realm.battle":BattlePolicy(5,0.5),
+    "seal.battle":BattlePolicy(5,0.5),
+    "event.battle":BattlePolicy(5,0.5),
+    "seal.finding_team":LearnedPolicy(10,minimum=2,maximum=10),
+    "seal.ready":FixedPolicy(5),
+    "soul.captain":FrameChangePolicy(1),
+    "soul.invite":FrameChangePolicy(2,minimum=0.6),
+    "invite.click":FrameChangePolicy(2,minimum=0.6),
+    "invite.step":FrameChangePolicy(1),
+    "invite.sent":FrameChangePolicy(2),
+    "story.back":FrameChangePolicy(2),
+    "story.ok":FrameChangePolicy(1),
+    "story.start":FrameChangePolicy(0.5),
+    "story.invite":FrameChangePolicy(2,minimum=0.6),
+    "story.team":FrameChangePolicy(0.5),
+    "story.select_level":FrameChangePolicy(2,minimum=0.6),
+    "story.drag":FrameChangePolicy(0.5),
+    "realm.enemy":FrameChangePolicy(1),
+    "seal.matching":FrameChangePolicy(1),
+    "event.target":FrameChangePolicy(1),
+    "event.idle":FixedPolicy(1),
+}
+_TEMPLATE_ATLAS_PATH="./templates.atlas"
+
+#decode every template once at startup, the compiled atlas (py TemplateAtlas.py) is used when present
+load_atlas(_TEMPLATE_ATLAS_PATH,roi_index=get_roi_index())
+get_registry().preload([value for key,value in list(globals().items()) if key.startswith('IMAGE_') and isinstance(value,str)],levels=_PYRAMID_LEVELS)
+
+#popups checked on the frames of every account, see PopupDetectors
+def rejectCoopWanted(gui,position):
+    printWithTime("Message: Window %s: Refuse to accept the invitation for the wanted seal..."%(str(gui.hwnd)))
+    gui.mouse_click_bg(REFUSE_COOP_COORDINATE)
+
+def confirmDisconnected(gui,position):
+    printWithTime("Message: Window %s: Disconnected, confirming to reconnect..."%(str(gui.hwnd)))
+    gui.takescreenshot()
+    gui.mouse_click_bg(position)
+
+def waitConnecting(gui,position):
+    printWithTime("Message: Window %s: Connecting..."%(str(gui.hwnd)))
+
+def stopFoodInsufficiency(gui,position):
+    printWithTime("Message: Window %s: Not enough food, stopping the account..."%(str(gui.hwnd)))
+    gui.takescreenshot()
+    gui.stop()
+
+get_popup_registry().register(PopupDetector("coop_wanted",IMAGE_COOP_SEAL,rejectCoopWanted))
+#the screenshots of these popups are not shipped, each one is checked once its template is saved under its path (see README)
+get_popup_registry().register_if_present(PopupDetector("disconnected",IMAGE_DISCONNECTED_PATH,confirmDisconnected))
+get_popup_registry().register_if_present(PopupDetector("connecting",IMAGE_CONNECTING_PATH,waitConnecting,cooldown=10))
+get_popup_registry().register_if_present(PopupDetector("food_insufficiency",IMAGE_FOOD_INSUFFICIENCY_PATH,stopFoodInsufficiency))
+
 _DETECTION_INTERVAL=0.2
 _accountCount=0
 _fullShikigamiCount=0
@@ -160,34 +236,61 @@ _isFullTeam=False
 _detectExitThread=threading.Thread()
 _accountLocker=threading.Lock()
 _replaceShikigamiIfFull=True
+#seconds given to the shikigami replacement before it is given up
+_REPLACE_TIMEOUT=30
 
 #
 class Processing(threading.Thread):
-    def __init__(self,windowName,gameMode,total,isCaptain=False,isMainDMG=True):
+    def __init__(self,windowName,gameMode,total,isCaptain=False,isMainDMG=True,capture=None,stage=None,hwnd=None,adbSerial=None,adbPath='adb',pauseHotkey=True):
         threading.Thread.__init__(self)
         global _accountCount
         global _detectExitThread
         global _accountLocker
 
-        self.__hwnd=win32gui.FindWindow(0, windowName)
+        #capture: CaptureBackend to use instead of the window, a ReplayCapture runs without clicking
+        #hwnd: handle of the window, for several windows with the same name
+        #adbSerial: serial of an emulator captured and clicked through adb instead of a window, '' for the only device
+        if adbSerial is not None and capture is None:
+            capture=AdbCapture(adbSerial,adbPath)
+        if hwnd is not None:
+            self.__hwnd=hwnd
+        else:
+            self.__hwnd=win32gui.FindWindow(0, windowName) if capture is None else 0
+        self.windowName=windowName
         self.__gameMode=gameMode
         self.__total=total
+        #completed: rounds played so far
+        self.completed=0
+        #finished: no further round can be played, e.g. no realm raid ticket left
+        self.finished=False
+        self.__isBossDetected=False
+        self.__isInBattle=False
+        self.__isInRoom=False
+        self.__detectCount=10
         self.__isCaptain=isCaptain
         self.__isMainDMG=isMainDMG
         self.__id=_accountCount
-        self.__gui=GameControl(self.__hwnd,0)
+        self.__gui=GameControl(self.__hwnd,0,capture)
+        self.__gui.dry_run=isinstance(capture,ReplayCapture)
+        if adbSerial is not None:
+            self.__gui.use_adb(adbSerial,adbPath)
+        if _CAPTURE_FPS:
+            self.__gui.start_capture_thread(_CAPTURE_FPS)
+        if _RECORDING_FOLDER:
+            self.__gui.start_recording(os.path.join(_RECORDING_FOLDER,"account%d"%(self.__id)),rolling=_RECORDING_SECONDS)
         self.__thread=ThreadGame()
+        #stage: name of the stage played, battle durations are learned per game mode and stage
+        self.__stage=stage
+        self.__pace=Pacer(self.__gui,_PACING,on_streak_end=self.battleEnded)
         self.__delay=0.5
         self.__debug=False
         _accountCount+=1
         _accountLocker.acquire()
-        if not _detectExitThread.isAlive():
+        #the F1 hotkey needs the keyboard module, pauseHotkey=False when the runtime has its own, see AsyncProcessing
+        if pauseHotkey and keyboard is not None and not _detectExitThread.is_alive():
             _detectExitThread=threading.Thread(None,self.detectPause)
-            _detectAssistantThread=threading.Thread(None,self.detectAssistance)
             _detectExitThread.setDaemon(True)
-            _detectAssistantThread.setDaemon(True)
             _detectExitThread.start()
-            _detectAssistantThread.start()
             if self.__debug==True:
                 _debugTread=threading.Thread(None,self.__gui.debug())
                 _debugTread.setDaemon(True)
@@ -197,40 +300,72 @@ class Processing(threading.Thread):
     @property
     def accountCount(self):
         return _accountCount
+
+    @property
+    def accountId(self):
+        return self.__id
+
+    @property
+    def hwnd(self):
+        return self.__hwnd
+
+    @property
+    def gui(self):
+        return self.__gui
+
+    @property
+    def pacer(self):
+        return self.__pace
+
+    def stop(self):
+        '''
+        Ask the game loop to end, waits and sleeps return early
+        '''
+        self.__gui.stop()
+
+    @property
+    def stopped(self):
+        #stopped on request, by the runtime or by a popup handler (gui.stop()), rather than ended by itself
+        return not self.__gui.run
 #
+    #The game modes are scripts: generators doing the detections themselves and yielding their inputs and waits,
+    #("frame", delay), ("click", position), ("drag", position1, position2[, delay]), ("wait", wait point) or ("sleep", seconds),
+    #the result of the action is sent back. play() runs them on this thread, AsyncProcessing.play on an event loop
     def gameModeSoul(self):
         printWithTime("Message: Account %s: Multiplayer Soul/Evolution"%(str(self.__id)))
-        while True:
+        while self.__gui.run:
+            #one snapshot per iteration, shared by every detection below
+            yield "frame",0.1
             position=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.85)
             if position != False or self.__gui.find_game_img(IMAGE_SOUL_SET_PATH,thread=0.8) != False:
-                printWithTime("Message: Account %s: In battle detected, sleep 5s ..."%(str(self.__id)))
-                time.sleep(5)
+                printWithTime("Message: Account %s: In battle detected, waiting ..."%(str(self.__id)))
+                yield "wait",self.battlePoint("soul")
                 continue
 
             #whether is in room..
             if self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.8) != False: #and self.__gui.find_game_img(IMAGE_SOUL_CLOCL_PATH,thread=0.8) ==False:
-                _localVariable.isInRoom = True
-                _localVariable.isInBattle=False
+                self.__isInRoom=True
+                self.__isInBattle=False
             #Whether is a leader
             if self.__isCaptain:
-                time.sleep(1)
+                yield "wait","soul.captain"
                 #starting..
                 position=self.__gui.find_game_img(IMAGE_SOUL_START_PATH,thread=0.98,gray=0)
                 if position != False:
                     printWithTime("Message: Account %s: Starting... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
-                    _localVariable.isInBattle=True
-                    _localVariable.isInRoom=True
+                    yield "click",position
+                    self.__isInBattle=True
+                    self.__isInRoom=True
                     continue
-                
+
                 #invite  to continues..
-                position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_DIALOG_PATH,thread=0.7)
+                position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_DIALOG_PATH,thread=0.7,pyramid=_PYRAMID_LEVELS)
                 if position != False:
                     printWithTime("Message: Account %s: Invite member to continue... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(CHECKBOX_COORDINATE)
-                    time.sleep(2)
-                    self.__gui.mouse_click_bg(OK_SOUL_DIALOG_COORDINATE)
-                    _localVariable.isInBattle=False
+                    yield "click",CHECKBOX_COORDINATE
+                    yield "wait","soul.invite"
+                    yield "click",OK_SOUL_DIALOG_COORDINATE
+                    self.__isInBattle=False
                     continue
 
                 if _isFullTeam:
@@ -239,131 +374,27 @@ class Processing(threading.Thread):
                         position=self.__gui.find_game_img(IMAGE_SOUL_START_PATH)
                         if position != False:
                             printWithTime("Message: Account %s: Full slot detectection =>> Starting game...%s: "%(str(self.__id),IMAGE_SOUL_START_PATH))
-                            self.__gui.mouse_click_bg(position)
+                            yield "click",position
                             continue
                 else:
                     if self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.8) != False:
-                        position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7)
-                        if position != False:
-                            while True:
-                                position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7)
-                                if position==False:
-                                    break
-                                else:
-                                    self.__gui.mouse_click_bg(position)
-                                    time.sleep(2)
-                                    position=self.__gui.find_game_img(IMAGE_STORY_INVITATION_CONFIRMED_PATH)
-                                    if position != False:
-                                        printWithTime("Message: Account %s: Choosing teammate..... "%(str(self.__id)))
-                                        position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
-                                        if position != False:
-                                            self.__gui.mouse_click_bg(position)
-                                            time.sleep(1)
-                                            self.__gui.mouse_click_bg(INVITE_MEMBER_SOUL_COORDINATE)
-                                            time.sleep(1)
-                                            self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                                            _localVariable.isInBattle=True
-                                            _localVariable.isInRoom=True  
-                                            printWithTime("Message: Account %s: Invite teamate..... "%(str(self.__id)))
-                                            time.sleep(2)
-                                        else:
-                                            count=6
-                                            while count>0:
-                                                count-=1
-                                                printWithTime("Message: Account %s: Can't finding ig, re trying..... "%(str(self.__id)))
-                                                position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
-                                                if position != False:
-                                                    self.__gui.mouse_click_bg(position)
-                                                    time.sleep(1)
-                                                    self.__gui.mouse_click_bg(INVITE_MEMBER_SOUL_COORDINATE)
-                                                    time.sleep(1)
-                                                    self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                                                    _localVariable.isInBattle=True
-                                                    _localVariable.isInRoom=True
-                                                    printWithTime("Message: Account %s: Sucessfully finding teammate, starting battle..... "%(str(self.__id)))
-                                                    break
-                                                if count>3:
-                                                    self.__gui.mouse_drag_bg(SLIDE_FRIEND_LIST_SOUL[0],SLIDE_FRIEND_LIST_SOUL[1])
-                                                else:
-                                                    self.__gui.mouse_drag_bg(SLIDE_FRIEND_LIST_SOUL[1],SLIDE_FRIEND_LIST_SOUL[0])
-                        elif position ==False and _localVariable.isInBattle==False:
-                            self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                            _localVariable.isInBattle=True
-                            _localVariable.isInRoom=True
-
-                #whether is outside soul room...
-                # while self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.8) == False and _localVariable.isInBattle==False:
-                #     if self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.8) != False or _localVariable.isInBattle==True:
-                #         _localVariable.isInRoom = True
-                #         break
-
-                #     printWithTime("Message: Account %s: Not in soul room was detected, create a room... "%(str(self.__id)))
-                #     #click soul icon
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_ICON_PATH)
-                #     if position != False:
-                #         self.__gui.mouse_click_bg(position)
-                #         printWithTime("Message: Account %s: Clicking soul icon... "%(str(self.__id)))
-                #         time.sleep(1)
-                #         continue
-                        
-
-                #     #click orochi
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_OROCHI_PATH)
-                #     if position != False:
-                #         self.__gui.mouse_click_bg(position)
-                #         printWithTime("Message: Account %s: Choosing orochi... "%(str(self.__id)))
-                #         time.sleep(1)
-                #         continue
-                        
-                    
-                #     #choose level
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_OROCHI_STAGE10_PATH,gray=1, thread=0.9)
-                #     if position != False:
-                #         printWithTime("Message: Account %s: Choosing orochi stage 10... "%(str(self.__id)))
-                #         self.__gui.mouse_click_bg(position)
-                #     else:
-                #         printWithTime("Message: Account %s: Cant find orochi level 10, try again... "%(str(self.__id)))
-                #         count=4
-                #         while count>0:
-                #             position=self.__gui.find_game_img(IMAGE_SOUL_OROCHI_STAGE10_PATH)
-                #             if position != False:
-                #                 self.__gui.mouse_click_bg(position)
-                #                 time.sleep(1)
-                #                 self.__gui.mouse_click_bg(CREATE_TEAM_SOUL_COORDINATE)
-                #                 printWithTime("Message: Account %s: Choosing orochi stage 10... "%(str(self.__id)))
-                #                 break
-                #             self.__gui.mouse_drag_bg(SLIDE_LEVEL_OROCHI[1],SLIDE_LEVEL_OROCHI[0])
-                #             time.sleep(1)
-                #             count-=1
-                    
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_TEAM_PATH,thread=0.7)
-                #     if position != False:
-                #         self.__gui.mouse_click_bg(position)
-                #         continue
-                        
-
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_CREATE_TEAM_PATH)
-                #     if position != False:
-                #         printWithTime("Message: Account %s: Create team... "%(str(self.__id)))
-                #         self.__gui.mouse_click_bg(position)
-                #         time.sleep(1)
-                #         continue
-
-                #     position=self.__gui.find_game_img(IMAGE_SOUL_CREATE_ROOM_PATH)
-                #     if position != False:
-                #         printWithTime("Message: Account %s: Create soul room... "%(str(self.__id)))
-                #         self.__gui.mouse_click_bg(INVITE_SOUL_ONLY_COORDINATE)
-                #         time.sleep(1)
-                #         self.__gui.mouse_click_bg(position)
-                #         _localVariable.isInRoom=True
-                #         time.sleep(1)
+                        #every free slot from one snapshot, the room layout does not move between invites
+                        slots=self.__gui.find_all(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7,sort='position')
+                        if slots:
+                            if (yield from self.inviteTeammates(slots)):
+                                self.__isInBattle=True
+                                self.__isInRoom=True
+                        elif self.__isInBattle==False:
+                            yield "click",START_SOUL_COORDINATE
+                            self.__isInBattle=True
+                            self.__isInRoom=True
             else:
                 if self.__isMainDMG:
                     position=self.__gui.find_game_img(IMAGE_SOUL_SOUGENBI_CHALLENGE)
                     if position != False:
                         message="Message: Account %s: Start new round..."%(str(self.__id))
                         printWithTime(message)
-                        self.__gui.mouse_click_bg(position)
+                        yield "click",position
                         continue
 
                 else:
@@ -371,596 +402,252 @@ class Processing(threading.Thread):
                     if position != False:
                         message="Message: Account %s: Tried to accept a new round..."%(str(self.__id))
                         printWithTime(message)
-                        self.__gui.mouse_click_bg(position)
+                        yield "click",position
                         continue
-            
-            #check finish
-            # position=self.__gui.find_game_img(IMAGE_REALM_FINISHED1_PATH,gray=0)
-            # if position != False:
-            #     printWithTime("Message: Account %s: Finishing..."%(str(self.__id)))
-            #     self.__gui.mouse_click_bg(position)
-            #     self.__gui.mouse_click_bg(position)
-            #     self.__gui.mouse_click_bg(position)
-            #     self.__gui.mouse_click_bg(position)
-            #     continue
+
             #claim reward
             position=self.__gui.find_game_img(IMAGE_SOUL_STAT_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Claim reward... "%(str(self.__id)))
-                self.__gui.mouse_click_bg((564, 603))
-                self.__gui.mouse_click_bg((564, 603))
-                self.__gui.mouse_click_bg((564, 603))
-                self.__gui.mouse_click_bg((564, 603))
+                yield "click",(564, 603)
+                yield "click",(564, 603)
+                yield "click",(564, 603)
+                yield "click",(564, 603)
                 continue
             #Fail
             position=self.__gui.find_game_img(IMAGE_REALM_FAILED_PATH,gray=0)
             if position != False:
                 printWithTime("Message: Account %s: Failed... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
+#
+    def inviteTeammates(self,slots):
+        #invite a friend into every free slot of the room
+        #return: True if a teammate was invited and the battle started
+        started=False
+        for index,position in enumerate(slots):
+            #the battle may have started after the previous invite
+            if index>0 and self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.7)==False:
+                break
+            yield "click",position
+            yield "wait","invite.click"
+            position=self.__gui.find_game_img(IMAGE_STORY_INVITATION_CONFIRMED_PATH)
+            if position == False:
+                continue
+            printWithTime("Message: Account %s: Choosing teammate..... "%(str(self.__id)))
+            position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
+            if position != False:
+                yield "click",position
+                yield "wait","invite.step"
+                yield "click",INVITE_MEMBER_SOUL_COORDINATE
+                yield "wait","invite.step"
+                yield "click",START_SOUL_COORDINATE
+                started=True
+                printWithTime("Message: Account %s: Invite teamate..... "%(str(self.__id)))
+                yield "wait","invite.sent"
+                continue
+            count=6
+            while count>0 and self.__gui.run:
+                count-=1
+                printWithTime("Message: Account %s: Can't finding ig, re trying..... "%(str(self.__id)))
+                position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
+                if position != False:
+                    yield "click",position
+                    yield "wait","invite.step"
+                    yield "click",INVITE_MEMBER_SOUL_COORDINATE
+                    yield "wait","invite.step"
+                    yield "click",START_SOUL_COORDINATE
+                    started=True
+                    printWithTime("Message: Account %s: Sucessfully finding teammate, starting battle..... "%(str(self.__id)))
+                    break
+                if count>3:
+                    yield "drag",SLIDE_FRIEND_LIST_SOUL[0],SLIDE_FRIEND_LIST_SOUL[1]
+                else:
+                    yield "drag",SLIDE_FRIEND_LIST_SOUL[1],SLIDE_FRIEND_LIST_SOUL[0]
+        return started
 #
     def gameModeStory(self):
-        global _fullShikigamiCount
-        global _isPaused
         printWithTime("Message: Account %s: Game mode Exploration"%(str(self.__id)))
 
-        while True:
+        while self.__gui.run:
+            #one snapshot per iteration, shared by every detection below
+            yield "frame",0.1
             #Reward settlement
             if (self.__gui.find_game_img(IMAGE_STORY_BACK_PATH)!= False
                 or self.__gui.find_game_img(IMAGE_STORY_REWARD_CONFIRMED_PATH) != False):
                 position=self.__gui.find_game_img(IMAGE_STORY_GET_REWARD_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Get reward.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
 
                 position=self.__gui.find_game_img(IMAGE_STORY_REWARD_CONFIRMED_PATH)
                 if position != False:
                     printWithTime("Message: Account%s: Confirm.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(CLAIM_REWARD)
+                    yield "click",CLAIM_REWARD
                     continue
 
                 position=self.__gui.find_game_img(IMAGE_STORY_SPIRIT_PATH,thread=0.7)
                 if position != False:
                     printWithTime("Message: Account%s: Spirit found.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(CLAIM_REWARD)
+                    yield "click",CLAIM_REWARD
                     continue
-            
+
             #detect whether is in batte ?
             if self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH,thread=0.8) != False:
                 if self.__gui.find_game_img(IMAGE_STORY_ISINTEAM_PATH,thread=0.65) == False:
                     printWithTime("Message: Account %s: Team not detected, exit round.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(STORY_BACK_COORDINATE)
-                    time.sleep(2)
-                    self.__gui.mouse_click_bg(STORY_OK_COORDINATE,None)
-                    time.sleep(1)
+                    yield "click",STORY_BACK_COORDINATE
+                    yield "wait","story.back"
+                    yield "click",STORY_OK_COORDINATE
+                    yield "wait","story.ok"
                     continue
-            
-            
-
 
             if self.__isCaptain:
                 #=============================================check in battle=================================================
 
                 if self.__gui.find_game_img(IMAGE_STORY_SEAL_TICKET_PATH,thread=0.6) != False:
                     printWithTime("Message: Account %s: In game battle not detected.... "%(str(self.__id)))
-                    _localVariable.isInBattle = False
+                    self.__isInBattle = False
                 else:
-                    _localVariable.isInBattle = True
+                    self.__isInBattle = True
 
                 #detect whether in room ?
                 if self.__gui.find_game_img(IMAGE_SOUL_INROOM_PATH,thread=0.7) != False:
-                        position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7)
-                        if position != False:
-                            while True:
-                                position=self.__gui.find_game_img(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7)
-                                if position==False:
-                                    break
-                                else:
-                                    self.__gui.mouse_click_bg(position)
-                                    time.sleep(2)
-                                    position=self.__gui.find_game_img(IMAGE_STORY_INVITATION_CONFIRMED_PATH)
-                                    if position != False:
-                                        printWithTime("Message: Account %s: Choosing teammate..... "%(str(self.__id)))
-                                        position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
-                                        if position != False:
-                                            self.__gui.mouse_click_bg(position)
-                                            time.sleep(1)
-                                            self.__gui.mouse_click_bg(INVITE_MEMBER_SOUL_COORDINATE)
-                                            time.sleep(1)
-                                            self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                                            printWithTime("Message: Account %s: Invite teamate..... "%(str(self.__id)))
-                                            time.sleep(2)
-                                        else:
-                                            count=6
-                                            while count>0:
-                                                count-=1
-                                                printWithTime("Message: Account %s: Can't finding ig, re trying..... "%(str(self.__id)))
-                                                position=self.__gui.find_game_img(IMAGE_STORY_TEAMMATE_PATH)
-                                                if position != False:
-                                                    self.__gui.mouse_click_bg(position)
-                                                    time.sleep(1)
-                                                    self.__gui.mouse_click_bg(INVITE_MEMBER_SOUL_COORDINATE)
-                                                    time.sleep(1)
-                                                    self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                                                    printWithTime("Message: Account %s: Sucessfully finding teammate, starting battle..... "%(str(self.__id)))
-                                                    break
-                                                if count>3:
-                                                    self.__gui.mouse_drag_bg(SLIDE_FRIEND_LIST_SOUL[0],SLIDE_FRIEND_LIST_SOUL[1])
-                                                else:
-                                                    self.__gui.mouse_drag_bg(SLIDE_FRIEND_LIST_SOUL[1],SLIDE_FRIEND_LIST_SOUL[0])
-                        else:
-                            self.__gui.mouse_click_bg(START_SOUL_COORDINATE)
-                            time.sleep(0.5)
-
-                if self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH) == False and _localVariable.isInBattle == False:
-                    position=self.__gui.find_game_img(IMAGE_STORY_INVITE_PATH,thread=0.7)                    
+                    #every free slot from one snapshot, the room layout does not move between invites
+                    slots=self.__gui.find_all(IMAGE_SOUL_INVITE_PATH,1,REGION_TEAM_INVITE_SOUL[0],REGION_TEAM_INVITE_SOUL[1],thread=0.7,sort='position')
+                    if slots:
+                        yield from self.inviteTeammates(slots)
+                    else:
+                        yield "click",START_SOUL_COORDINATE
+                        yield "wait","story.start"
+
+                if self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH) == False and self.__isInBattle == False:
+                    position=self.__gui.find_game_img(IMAGE_STORY_INVITE_PATH,thread=0.7)
                     if position != False:
-                        _localVariable.isBossDetected=False
+                        self.__isBossDetected=False
                         printWithTime("Message: Account %s: Invite Teamate to continue.... "%(str(self.__id)))
-                        self.__gui.mouse_click_bg(position)
+                        yield "click",position
                         continue
-                    
-                    time.sleep(2)
+
+                    yield "wait","story.invite"
                     position=self.__gui.find_game_img(IMAGE_STORY_INVITATION_CONFIRMED_PATH,thread=0.7)
                     if position != False and self.__gui.find_game_img(IMAGE_STORY_APPROVE_PATH,thread=0.7) != False:
-                        _localVariable.isBossDetected=False
+                        self.__isBossDetected=False
                         printWithTime("Message: Account %s: Click OK..... "%(str(self.__id)))
-                        self.__gui.mouse_click_bg(position)
-                        time.sleep(1)
+                        yield "click",position
+                        yield "wait","story.ok"
                         continue
-                    
+
                     if self.__gui.find_game_img(IMAGE_STORY_LIST_CHAPTER_PATH)  != False:
-                        position=self.__gui.find_game_img(IMAGE_STORY_LAST_CHAPTER)                    
+                        position=self.__gui.find_game_img(IMAGE_STORY_LAST_CHAPTER)
                         if position != False:
                             printWithTime("Message: Account %s: Entering last chapter.... "%(str(self.__id)))
-                            self.__gui.mouse_click_bg(position)
+                            yield "click",position
                             continue
-                    
+
                     position=self.__gui.find_game_img(IMAGE_STORY_TEAM_PATH)
                     if  position == False and self.__gui.find_game_img(IMAGE_STORY_CREATE_PATH,thread=0.8)==False:
                         printWithTime("Message: Account %s: Choosing HARD level..... "%(str(self.__id)))
-                        self.__gui.mouse_click_bg(CHOOSE_LEVEL_HARD_COORDINATE)
-                        self.__gui.mouse_click_bg(CHOOSE_LEVEL_HARD_COORDINATE)
+                        yield "click",CHOOSE_LEVEL_HARD_COORDINATE
+                        yield "click",CHOOSE_LEVEL_HARD_COORDINATE
                         continue
                     else:
-                        self.__gui.mouse_click_bg(TEAM_COORDINATE)
-                        time.sleep(0.5)
+                        yield "click",TEAM_COORDINATE
+                        yield "wait","story.team"
 
                     position=self.__gui.find_game_img(IMAGE_STORY_CREATE_PATH,thread=0.8)
                     if position != False:
                         printWithTime("Message: Account %s: Create room..... "%(str(self.__id)))
-                        self.__gui.mouse_click_bg(position)
+                        yield "click",position
                         continue
-                    
-                    
+
                 #===============================================slide windows if not found monster
                 if self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH) == False and self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH) != False and self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH) == False:
-                    _localVariable.detectCount-=1
-                    _localVariable.isInBattle = True
-                    if self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH) == False and self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH) == False:
-                        if _localVariable.detectCount > 6:
-                            self.__gui.mouse_drag_bg(SLIDE_STORY_COORDINATE[1],SLIDE_STORY_COORDINATE[0])
-                        else:
-                            self.__gui.mouse_drag_bg(SLIDE_STORY_COORDINATE[0],SLIDE_STORY_COORDINATE[1])
-                        printWithTime("Message: Account %s: No Monster was detected..."%(str(self.__id)))
-                        printWithTime("Message: Account %s: No Boss was detected..."%(str(self.__id)))
-                        if _localVariable.detectCount==3:
-                            _localVariable.detectCount=10
-                            
+                    self.__detectCount-=1
+                    self.__isInBattle = True
+                    if self.__detectCount > 6:
+                        yield "drag",SLIDE_STORY_COORDINATE[1],SLIDE_STORY_COORDINATE[0]
+                    else:
+                        yield "drag",SLIDE_STORY_COORDINATE[0],SLIDE_STORY_COORDINATE[1]
+                    printWithTime("Message: Account %s: No Monster was detected..."%(str(self.__id)))
+                    printWithTime("Message: Account %s: No Boss was detected..."%(str(self.__id)))
+                    if self.__detectCount==3:
+                        self.__detectCount=10
 
                 position=self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: BOSS was detected%s: "%(str(self.__id),IMAGE_STORY_FIGHT_BOSS_PATH))
-                    self.__gui.mouse_click_bg(position)
-                    _localVariable.isBossDetected=True
-                    _localVariable.isInBattle = True
+                    yield "click",position
+                    self.__isBossDetected=True
+                    self.__isInBattle = True
                     continue
 
                 position=self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Monster was detected..%s: "%(str(self.__id),IMAGE_STORY_FIGHT_PATH))
-                    self.__gui.mouse_click_bg(position)
-                    _localVariable.isInBattle = True
+                    yield "click",position
+                    self.__isInBattle = True
                     continue
-                
-                
+
                 #=========================================replace shikigami=========================================
                 if self.__isMainDMG==True:
                     #if Main dmg is leader
                     if _replaceShikigamiIfFull and self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_FIND_FULL_EXP_LEADER[0], \
                             REGION_FIND_FULL_EXP_LEADER[1], thread=0.7) != False:
                         printWithTime("Message: Account %s: Full-EXP shikigami was detected..."%(str(self.__id)))
-                        def inner():
-                            global _fullShikigamiCount 
-                            #ready
-                            while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
-                                time.sleep(0.1)
-                                continue
-
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
-                            #change shikigami
-                            while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)==False:
-                                self.__gui.mouse_click_bg(SHIKI_LEVEL_COORDINATE)
-                                time.sleep(2)
-
-                            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                            while True:
-                                if position == False:
-                                    printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                                    continue          
-
-                                self.__gui.mouse_click_bg(position)    
-                                printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
-                                if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH)==False:
-                                    break      
-                            
-                            count=0
-                            while count<2:
-                                count+=1
-                                while True:
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,thread=0.9)
-                                    sel1=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED1_PATH,thread=0.9)
-                                    sel2=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                                    sel3=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED3_PATH,thread=0.9)
-                                    sel8=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED8_PATH,thread=0.9)
-                                    if position or sel1 or sel2 or sel3 or sel8:
-                                        break
-                                    self.__gui.mouse_drag_bg(SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0])
-                                    
-                                
-                                printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
-                                position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_FULL_EXP_LEADER[0],REGION_CHANGE_FULL_EXP_LEADER[1],thread=0.7)
-                                if position1 != False:
-                                    if position != False:
-                                        self.__gui.mouse_drag_bg(position,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel1 != False:
-                                        self.__gui.mouse_drag_bg(sel1,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel2 != False:
-                                        self.__gui.mouse_drag_bg(sel2,(position1[0],position1[1]+30),delay=0.1)
-                                    
-                                    elif sel3 != False:
-                                        self.__gui.mouse_drag_bg(sel3,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel8 != False:
-                                        self.__gui.mouse_drag_bg(sel8,(position1[0],position1[1]+30),delay=0.1)
-                                    time.sleep(0.5)
-                                    
-
-                                positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_FIND_FULL_EXP_LEADER[0],REGION_FIND_FULL_EXP_LEADER[1],thread=0.8)
-                                if position1!=positionTmp:
-                                    _fullShikigamiCount+=1
-                                    printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
-
-                                if self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_FIND_FULL_EXP_LEADER[0],REGION_FIND_FULL_EXP_LEADER[1],thread=0.8)==False:
-                                    printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
-                                    break
-
-                        innerThread=threading.Thread(None,inner,str(self.__id))
-                        innerThread.start()
-                        winsound.Beep(1000,3000)
-                        seconds=30
-                        while seconds and not innerThread.isAlive():
-                            time.sleep(1.0)
-                            seconds-=1
-
-                        seconds=30
-                        while seconds and innerThread.isAlive():
-                            printWithTime("Message: Account %s: Waiting for food to replace"%(str(self.__id)))
-                            time.sleep(1.0)
-                            seconds-=1
-                        stopThread(innerThread)
+                        beep(1000,3000,wait=False)
+                        yield from self.replaceShikigami(REGION_CHANGE_FULL_EXP_LEADER,REGION_FIND_FULL_EXP_LEADER,rounds=2)
                         if not _isPaused:
                             self.__thread.threadGameRelease()
                 else:
                     if _replaceShikigamiIfFull and self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,thread=0.7) != False:
                         printWithTime("Message: Account %s: Full-EXP shikigami was detected..."%(str(self.__id)))
-                        def inner():
-                            global _fullShikigamiCount 
-                            #ready
-                            while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
-                                time.sleep(0.1)
-                                continue
-
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
-                            #change shikigami
-                            while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)==False:
-                                self.__gui.mouse_click_bg(SHIKI_LEVEL_COORDINATE)
-                                time.sleep(2)
-
-                            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                            while True:
-                                if position == False:
-                                    printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                                    continue          
-
-                                self.__gui.mouse_click_bg(position)    
-                                printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
-                                if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH)==False:
-                                    break      
-                            
-                            count=0
-                            while count<2:
-                                sel2=False
-                                count+=1
-                                while True:
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,thread=0.9)
-                                    sel1=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED1_PATH,thread=0.9)
-                                    sel2=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                                    sel3=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED3_PATH,thread=0.9)
-                                    sel8=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED8_PATH,thread=0.9)
-                                    if position or sel1 or sel2 or sel3 or sel8:
-                                        break
-                                    self.__gui.mouse_drag_bg(SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0])
-                                    
-                                    
-                                
-                                printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
-                                position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,(0,0),(1100,350),thread=0.7)
-                                if position1 != False:
-                                    if position != False:
-                                        self.__gui.mouse_drag_bg(position,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel1 != False:
-                                        self.__gui.mouse_drag_bg(sel1,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel2 != False:
-                                        self.__gui.mouse_drag_bg(sel2,(position1[0],position1[1]+30),delay=0.1)
-                                    
-                                    elif sel3 != False:
-                                        self.__gui.mouse_drag_bg(sel3,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel8 != False:
-                                        self.__gui.mouse_drag_bg(sel8,(position1[0],position1[1]+30),delay=0.1)
-
-                                    time.sleep(0.5)
-                                   
-                                    
-
-                                positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,(0,0),(1100,350),thread=0.7)
-                                if position1!=positionTmp:
-                                    _fullShikigamiCount+=1
-                                    printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
-
-                                if self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,(0,0),(1100,350),thread=0.7)==False:
-                                    printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
-                                    break
-
-                        innerThread=threading.Thread(None,inner,str(self.__id))
-                        innerThread.start()
-                        winsound.Beep(1000,3000)
-                        seconds=30
-                        while seconds and not innerThread.isAlive():
-                            time.sleep(1.0)
-                            seconds-=1
-
-                        seconds=30
-                        while seconds and innerThread.isAlive():
-                            printWithTime("Message: Account %s: Waiting for food to replace"%(str(self.__id)))
-                            time.sleep(1.0)
-                            seconds-=1
-                        stopThread(innerThread)
+                        beep(1000,3000,wait=False)
+                        yield from self.replaceShikigami([(0,0),(1100,350)],rounds=2,checkThread=0.7)
                         if not _isPaused:
                             self.__thread.threadGameRelease()
-                
-                
+
                 #=========================================get ready=================================================
 
                 position=self.__gui.find_game_img(IMAGE_STORY_READY_PATH,thread=0.8)
                 if position != False:
                     printWithTime("Message: Account %s: Starting battle.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
-                    #time.sleep(2)
+                    yield "click",position
                     continue
-                
+
                 #=========================================Finish=================================================
 
                 position=self.__gui.find_game_img(IMAGE_STORY_FINISHED1_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Finishing.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
-                
+
                 position=self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Finished.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
-                    
-                    while True:
-                        if self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)== False:
-                            break
-                        self.__gui.mouse_click_bg(position)
+                    yield "click",position
+                    while self.__gui.run and self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH) != False:
+                        yield "click",position
                         printWithTime("Message: Account %s: Get reward.... position"%(str(self.__id)))
-                    break  
+                    break
             else:
                  #=========================================replace shikigami=========================================
 
                 if self.__isMainDMG==False:
                     if _replaceShikigamiIfFull and self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,thread=0.7) != False:
                         printWithTime("Message: Account %s: Full-EXP shikigami was detected..."%(str(self.__id)))
-                        def inner():
-                            global _fullShikigamiCount 
-                            #ready
-                            while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
-                                time.sleep(0.1)
-                                continue
-
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
-                            #change shikigami
-                            while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)==False:
-                                self.__gui.mouse_click_bg(SHIKI_LEVEL_COORDINATE)
-                                time.sleep(2)
-
-                            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                            while True:
-                                if position == False:
-                                    printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                                    continue          
-
-                                self.__gui.mouse_click_bg(position)    
-                                printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
-                                if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH)==False:
-                                    break      
-                            
-                            count=0
-                            while count<3:
-                                count+=1
-                                sel2=False
-                                while True:
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,thread=0.9)
-                                    sel1=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED1_PATH,thread=0.9)
-                                    sel2=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                                    sel3=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED3_PATH,thread=0.9)
-                                    sel8=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED8_PATH,thread=0.9)
-                                    if position != False or sel2 != False:
-                                        break
-                                    self.__gui.mouse_drag_bg(SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0])
-                                    
-                                
-                                printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
-                                position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_FULL_EXP_PASENGER[0],REGION_CHANGE_FULL_EXP_PASENGER[1],thread=0.7)
-                                if position1 != False:
-                                    if position != False:
-                                        self.__gui.mouse_drag_bg(position,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel1 != False:
-                                        self.__gui.mouse_drag_bg(sel1,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel2 != False:
-                                        self.__gui.mouse_drag_bg(sel2,(position1[0],position1[1]+30),delay=0.1)
-                                    
-                                    elif sel3 != False:
-                                        self.__gui.mouse_drag_bg(sel3,(position1[0],position1[1]+30),delay=0.1)
-
-                                    elif sel8 != False:
-                                        self.__gui.mouse_drag_bg(sel8,(position1[0],position1[1]+30),delay=0.1)
-                                    time.sleep(0.5)
-                                    
-
-                                positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_FULL_EXP_PASENGER[0],REGION_CHANGE_FULL_EXP_PASENGER[1],thread=0.8)
-                                if position1!=positionTmp:
-                                    _fullShikigamiCount+=1
-                                    printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
-
-                                if self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_FULL_EXP_PASENGER[0],REGION_CHANGE_FULL_EXP_PASENGER[1],thread=0.8)==False:
-                                    printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
-                                    break
-
-                        
-                        innerThread=threading.Thread(None,inner,str(self.__id))
-                        innerThread.start()
-                        winsound.Beep(1000,3000)
-                        seconds=30
-                        while seconds and not innerThread.isAlive():
-                            time.sleep(1.0)
-                            seconds-=1
-
-                        seconds=30
-                        while seconds and innerThread.isAlive():
-                            printWithTime("Message: Account %s: Waiting for food to replace..."%(str(self.__id)))
-                            time.sleep(1.0)
-                            seconds-=1
-                        stopThread(innerThread)
+                        beep(1000,3000,wait=False)
+                        #only the selected variants 0 and 2 are waited for, as a passenger
+                        yield from self.replaceShikigami(REGION_CHANGE_FULL_EXP_PASENGER,variants=(0,2))
                         if not _isPaused:
                             self.__thread.threadGameRelease()
                 else:
                     if _replaceShikigamiIfFull and self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_FIND_FULL_EXP_SOLO[0],REGION_FIND_FULL_EXP_SOLO[1],thread=0.75) != False:
                         printWithTime("Message: Account %s: Full-EXP shikigami was detected..."%(str(self.__id)))
-                        def inner():
-                            global _fullShikigamiCount 
-                            #ready
-                            while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
-                                time.sleep(0.1)
-                                continue
-
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                            printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
-                            #change shikigami
-                            while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)==False:
-                                self.__gui.mouse_click_bg(SHIKI_LEVEL_COORDINATE)
-                                time.sleep(2)
-
-                            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                            while True:
-                                if position == False:
-                                    printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                                    continue          
-
-                                self.__gui.mouse_click_bg(position)    
-                                printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
-                                if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH)==False:
-                                    break      
-                            
-                            count=0
-                            while count<3:
-                                count+=1
-                                while True:
-                                    position=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,thread=0.9)
-                                    sel1=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED1_PATH,thread=0.9)
-                                    sel2=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                                    sel3=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED3_PATH,thread=0.9)
-                                    sel8=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED8_PATH,thread=0.9)
-                                    if position or sel1 or sel2 or sel3 or sel8:
-                                        break
-                                    self.__gui.mouse_drag_bg(SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0])
-                                    
-                                
-                                printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
-                                position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.7)
-                                if position1 != False:
-                                    X=REGION_CHANGE_EXP_SOLO[0][0]+position1[0]
-                                    Y=REGION_CHANGE_EXP_SOLO[0][1]+position1[1]
-                                    if position !=False:
-                                        self.__gui.mouse_drag_bg(position,(X,Y))
-                                    elif sel1 !=False:
-                                        self.__gui.mouse_drag_bg(sel1,(X,Y))
-                                    elif sel2 !=False:
-                                        self.__gui.mouse_drag_bg(sel2,(X,Y))
-                                    elif sel3 !=False:
-                                        self.__gui.mouse_drag_bg(sel3,(X,Y))
-                                    elif sel8 !=False:
-                                        self.__gui.mouse_drag_bg(sel8,(X,Y))
-                                    
-                                    time.sleep(0.5)
-                                    
-
-                                positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.8)
-                                if position1!=positionTmp:
-                                    _fullShikigamiCount+=1
-                                    printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
-
-                                if self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.8)==False:
-                                    printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
-                                    break
-
-                
-                        innerThread=threading.Thread(None,inner,str(self.__id))
-                        innerThread.start()
-                        winsound.Beep(1000,3000)
-                        seconds=30
-                        while seconds and not innerThread.isAlive():
-                            time.sleep(1.0)
-                            seconds-=1
-
-                        seconds=30
-                        while seconds and innerThread.isAlive():
-                            printWithTime("Message: Account %s: Waiting for food to replace"%(str(self.__id)))
-                            time.sleep(1.0)
-                            seconds-=1
-                        stopThread(innerThread)
+                        beep(1000,3000,wait=False)
+                        yield from self.replaceShikigamiSolo()
                         if not _isPaused:
                             self.__thread.threadGameRelease()
 
@@ -968,371 +655,376 @@ class Processing(threading.Thread):
                 position=self.__gui.find_game_img(IMAGE_STORY_READY_PATH,thread=0.7)
                 if position != False:
                     printWithTime("Message: Account %s: Starting battle.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
-                    #time.sleep(2)
+                    yield "click",position
                     continue
-                
+
                 #=========================================Finish=================================================
 
                 position=self.__gui.find_game_img(IMAGE_STORY_FINISHED1_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Finishing.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
-                
+
                 position=self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)
                 if position != False:
                     printWithTime("Message: Finish2%s: Finished.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
-                    
-                    while True:
-                        if self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)== False:
-                            break
-                        self.__gui.mouse_click_bg(position)
+                    yield "click",position
+                    while self.__gui.run and self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH) != False:
+                        yield "click",position
                         printWithTime("Message: Account %s: Get reward...."%(str(self.__id)))
-                    break  
+                    break
 
                 position=self.__gui.find_game_img(IMAGE_STORY_ACCEPT_PATH,thread=0.7)
                 if position != False:
                     message="Message: Account %s: Tried to accept a new round Chapter Exploration..."%(str(self.__id))
                     printWithTime(message)
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
 #
     def gameModeSingleStory(self):
         global _fullShikigamiCount
-        global _isPaused
         printWithTime("Message: Account %s: Game mode Exploration"%(str(self.__id)))
-        while True:
-            #self.__gui.rejectbounty()
-            #printWithTime("Message: Account %s: Checking co-op wanted..."%(str(self.__id)))
+        while self.__gui.run:
+            #one snapshot per iteration, shared by every detection below
+            yield "frame",0.1
             if self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH) == False:
-                position=self.__gui.find_game_img(IMAGE_STORY_LAST_CHAPTER)                    
+                position=self.__gui.find_game_img(IMAGE_STORY_LAST_CHAPTER)
                 if position != False:
-                    _localVariable.isBossDetected=False
+                    self.__isBossDetected=False
                     printWithTime("Message: Account %s: Entering last chapter.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
 
-
                 position=self.__gui.find_game_img(IMAGE_STORY_START_PATH)
                 if position != False:
-                    _localVariable.isBossDetected=False
+                    self.__isBossDetected=False
                     printWithTime("Message: Account %s: Starting exploration.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
                     continue
 
             if self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH) == False and self.__gui.find_game_img(IMAGE_STORY_CHERRY_CAKE_PATH) != False and self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH) == False:
-                _localVariable.detectCount-=1
-                if self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH) == False and self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH) == False:
-                    if _localVariable.detectCount > 5:
-                        self.__gui.mouse_drag_bg(SLIDE_STORY_COORDINATE[1],SLIDE_STORY_COORDINATE[0])
-                    else:
-                        self.__gui.mouse_drag_bg(SLIDE_STORY_COORDINATE[0],SLIDE_STORY_COORDINATE[1])
-                    printWithTime("Message: Account %s: No Monster was detected..."%(str(self.__id)))
-                    printWithTime("Message: Account %s: No Boss was detected..."%(str(self.__id)))
-                    if _localVariable.detectCount==2:
-                        _localVariable.detectCount=10
+                self.__detectCount-=1
+                if self.__detectCount > 5:
+                    yield "drag",SLIDE_STORY_COORDINATE[1],SLIDE_STORY_COORDINATE[0]
+                else:
+                    yield "drag",SLIDE_STORY_COORDINATE[0],SLIDE_STORY_COORDINATE[1]
+                printWithTime("Message: Account %s: No Monster was detected..."%(str(self.__id)))
+                printWithTime("Message: Account %s: No Boss was detected..."%(str(self.__id)))
+                if self.__detectCount==2:
+                    self.__detectCount=10
 
             position=self.__gui.find_game_img(IMAGE_STORY_FIGHT_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Monster was detected... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
-            
+
             position=self.__gui.find_game_img(IMAGE_STORY_FIGHT_BOSS_PATH)
             if position != False:
                 printWithTime("Message: Account %s: BOSS was detected: "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                _localVariable.isBossDetected=True
+                yield "click",position
+                self.__isBossDetected=True
                 continue
-            
-            #=========================================replace shikigami=========================================
 
+            #=========================================replace shikigami=========================================
             if _replaceShikigamiIfFull and self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_FIND_FULL_EXP_SOLO[0],REGION_FIND_FULL_EXP_SOLO[1]) != False:
                 printWithTime("Message: Account %s: Full-EXP shikigami was detected..."%(str(self.__id)))
-                def inner():
-                    global _fullShikigamiCount 
-                    #ready
-                    while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
-                        time.sleep(0.1)
-                        continue
-
-                    self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                    self.__gui.mouse_click_bg(CHANGE_SHIKI_COORDINATE)
-                    printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
-                    #change shikigami
-                    while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)==False:
-                        self.__gui.mouse_click_bg(SHIKI_LEVEL_COORDINATE)
-                        time.sleep(2)
-
-                    position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                    while True:
-                        if position == False:
-                            printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
-                            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
-                            continue          
-
-                        self.__gui.mouse_click_bg(position)    
-                        printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
-                        if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH)==False:
-                            break      
-                    
-                    count=0
-                    while count<3:
-                        count+=1
-                        while True:
-                            position=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED_PATH,thread=0.9)
-                            sel1=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                            sel2=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                            sel3=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                            sel8=self.__gui.find_game_img(IMAGE_STORY_SHIKIGAMI_SELECTED2_PATH,thread=0.9)
-                            if position or sel1 or sel2 or sel3 or sel8:
-                                break
-                            self.__gui.mouse_drag_bg(SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0])
-                            
-                        
-                        printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
-                        position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.7)
-                        if position1 != False:
-                            X=REGION_CHANGE_EXP_SOLO[0][0]+position1[0]
-                            Y=REGION_CHANGE_EXP_SOLO[0][1]+position1[1]
-                            if position !=False:
-                                self.__gui.mouse_drag_bg(position,(X,Y))
-                            elif sel1 !=False:
-                                self.__gui.mouse_drag_bg(sel1,(X,Y))
-                            elif sel2 !=False:
-                                self.__gui.mouse_drag_bg(sel2,(X,Y))
-                            elif sel3 !=False:
-                                self.__gui.mouse_drag_bg(sel3,(X,Y))
-                            elif sel8 !=False:
-                                self.__gui.mouse_drag_bg(sel8,(X,Y))
-                            time.sleep(0.5)
-                            
-
-                        positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.8)
-                        if position1!=positionTmp:
-                            _fullShikigamiCount+=1
-                            printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
-
-                        if self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,REGION_CHANGE_EXP_SOLO[0],REGION_CHANGE_EXP_SOLO[1],thread=0.8)==False:
-                            printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
-                            break
-
-                
-                innerThread=threading.Thread(None,inner,str(self.__id))
-                innerThread.start()
-                winsound.Beep(1000,3000)
-                seconds=30
-                while seconds and not innerThread.isAlive():
-                    time.sleep(1.0)
-                    seconds-=1
-
-                seconds=30
-                while seconds and innerThread.isAlive():
-                    printWithTime("Message: Account %s: Waiting for food to replace"%(str(self.__id)))
-                    time.sleep(1.0)
-                    seconds-=1
-                stopThread(innerThread)
+                beep(1000,3000,wait=False)
+                yield from self.replaceShikigamiSolo()
                 if not _isPaused:
                     self.__thread.threadGameRelease()
-            
-            
-            #=========================================get ready=================================================
 
+            #=========================================get ready=================================================
             position=self.__gui.find_game_img(IMAGE_STORY_READY_PATH,gray=0,thread=0.8)
             if position != False:
                 printWithTime("Message: Account %s: Starting battle.... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                #time.sleep(2)
+                yield "click",position
                 continue
-            
-            #=========================================Finish=================================================
 
+            #=========================================Finish=================================================
             position=self.__gui.find_game_img(IMAGE_STORY_FINISHED1_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Finishing.... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
-            
+
             position=self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Finished... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                
-                while True:
-                    if self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH)== False:
-                        break
-                    self.__gui.mouse_click_bg(position)
+                yield "click",position
+                while self.__gui.run and self.__gui.find_game_img(IMAGE_STORY_FINISHED2_PATH) != False:
+                    yield "click",position
                     printWithTime("Message: Account %s: Get reward..."%(str(self.__id)))
-                break  
+                break
 
             #==========================================Reward settlement=============================================
-            if (self.__gui.find_game_img(IMAGE_STORY_BACK_PATH)!= False
+            if (self.__gui.find_game_img(IMAGE_STORY_BACK_PATH) != False
                 or self.__gui.find_game_img(IMAGE_STORY_REWARD_CONFIRMED_PATH) != False):
                 position=self.__gui.find_game_img(IMAGE_STORY_GET_REWARD_PATH)
                 if position != False:
                     printWithTime("Message: Account %s: Get treasure.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(position)
+                    yield "click",position
 
                 position=self.__gui.find_game_img(IMAGE_STORY_REWARD_CONFIRMED_PATH)
                 if position != False:
                     printWithTime("Message: Account%s: Confirm.... "%(str(self.__id)))
-                    self.__gui.mouse_click_bg(CLAIM_REWARD)
+                    yield "click",CLAIM_REWARD
+#
+    def replaceShikigamiSolo(self,timeout=_REPLACE_TIMEOUT):
+        return self.replaceShikigami(REGION_CHANGE_EXP_SOLO,shift=REGION_CHANGE_EXP_SOLO[0],delay=0.04,timeout=timeout)
+#
+    def replaceShikigami(self,changeRegion,checkRegion=None,rounds=3,shift=(0,30),delay=0.1,checkThread=0.8,variants=None,timeout=_REPLACE_TIMEOUT):
+        global _fullShikigamiCount
+        #changeRegion: where the full-exp shikigami is dragged onto, checkRegion: where it is looked for afterwards, changeRegion if empty
+        #shift: added to its position to get the drop point, variants: indexes of IMAGE_STORY_SHIKIGAMI_SELECTED_LIST waited for, all if empty
+        #the replacement is given up after timeout seconds, the exploration goes on
+        if checkRegion is None:
+            checkRegion=changeRegion
+        deadline=time.time()+timeout
+        def going():
+            if not self.__gui.run:
+                return False
+            if time.time()<deadline:
+                return True
+            printWithTime("Message: Account %s: Shikigami replacement timed out..."%(str(self.__id)))
+            return False
+        #ready
+        while self.__gui.find_game_img(IMAGE_STORY_READY_MARK_PATH) == False:
+            if not going():
+                return
+            yield "sleep",0.1
+
+        yield "click",CHANGE_SHIKI_COORDINATE
+        yield "click",CHANGE_SHIKI_COORDINATE
+        printWithTime("Message: Account %s: Changing shikigami..."%(str(self.__id)))
+        #change shikigami
+        while self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH) == False:
+            if not going():
+                return
+            yield "click",SHIKI_LEVEL_COORDINATE
+            yield "wait","story.select_level"
+
+        while True:
+            position=self.__gui.find_game_img(IMAGE_STORY_SELECTED_LEVEL_PATH)
+            if position == False:
+                printWithTime("Message: Account %s: Failed to selecting type of shikigami, try again..."%(str(self.__id)))
+                if not going():
+                    return
+                yield "frame",0.1
+                continue
+            yield "click",position
+            printWithTime("Message: Account %s: Selecting type of shikigami..."%(str(self.__id)))
+            if self.__gui.find_game_img(IMAGE_STORY_SELECT_LEVEL_PATH) == False:
+                break
+
+        count=0
+        while count<rounds:
+            count+=1
+            while True:
+                if not going():
+                    return
+                #every variant of the selected shikigami, matched once the last drag has settled
+                selected=self.findShikigamiSelected((yield "frame",0.1))
+                if any(selected[index] for index in (variants or range(len(selected)))):
+                    break
+                yield "drag",SLIDE_CHANGE_SHIKI[1],SLIDE_CHANGE_SHIKI[0]
+
+            printWithTime("Message: Account %s: Shikigami was found..."%(str(self.__id)))
+            position1=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,changeRegion[0],changeRegion[1],thread=0.7)
+            if position1 != False:
+                #first selected variant in the order of IMAGE_STORY_SHIKIGAMI_SELECTED_LIST
+                yield "drag",[position for position in selected if position][0],(position1[0]+shift[0],position1[1]+shift[1]),delay
+                yield "wait","story.drag"
+
+            positionTmp=self.__gui.find_game_img(IMAGE_STORY_FULL1_PATH,1,checkRegion[0],checkRegion[1],thread=checkThread)
+            if position1!=positionTmp:
+                _fullShikigamiCount+=1
+                printWithTime("Message: Account %s: Shikigami has been replaced..."%(str(self.__id)))
+
+            if positionTmp == False:
+                printWithTime("Message: Account %s: Completed, no full-exp Shikigami was found..."%(str(self.__id)))
+                break
 #
     def gameModeRealmRaid(self):
         printWithTime("Message: Account %s: Realm Raid mode, make sure to set up your lineup before starting...."%(str(self.__id)))
-        while True:
+        while self.__gui.run:
+            #one snapshot per iteration, shared by every detection below
+            yield "frame",0.1
             position=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.85)
             if position != False:
-                printWithTime("Message: Account %s: In battle detected, sleep 5s ..."%(str(self.__id)))
-                time.sleep(5)
+                printWithTime("Message: Account %s: In battle detected, waiting ..."%(str(self.__id)))
+                yield "wait",self.battlePoint("realm")
                 continue
 
             #Click icon realm
             position=self.__gui.find_game_img(IMAGE_REALM_RAID_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Click icon realm raid..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
-            
-            #not enough ticket
+
+            #not enough ticket, no further round can be played
             if self.__gui.find_game_img(IMAGE_REALM_EMPTY_TICKET,thread=0.97) !=False:
                 printWithTime("Message: Account %s: DONE... "%(str(self.__id)))
-                pyautogui.alert(text='REALM RAID DONE', title='FINISH', button='OK')
-                sys.exit()
+                alert('REALM RAID DONE','FINISH')
+                self.finished=True
                 break
-            
+
             #lock line up
             position=self.__gui.find_game_img(IMAGE_REALM_LOCK_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Successfully lock lineup..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 
             #Click Realm
             position=self.__gui.find_game_img(IMAGE_REALM_SECTION_PATH,thread=0.7)
             if position != False:
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 printWithTime("Message: Account %s: Enemy was found..."%(str(self.__id)))
-                time.sleep(1)
-                self.__gui.mouse_click_bg((position[0]-77,position[1]+144))
-                #time.sleep(15)
+                yield "wait","realm.enemy"
+                yield "click",(position[0]-77,position[1]+144)
                 continue
-            
-            
+
             #check finish
             position=self.__gui.find_game_img(IMAGE_REALM_FINISHED1_PATH,gray=0)
             if position != False:
                 printWithTime("Message: Account %s: Finishing..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 
             position=self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH,thread=0.7)
             if position != False:
                 printWithTime("Message: Account %s: Getting reward... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                
-                while True:
-                    if self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH,thread=0.7) == False:
-                        break
-                    self.__gui.mouse_click_bg(position)
+                yield "click",position
+                while self.__gui.run and self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH,thread=0.7) != False:
+                    yield "click",position
                 break
-            
+
             #Fail
             position=self.__gui.find_game_img(IMAGE_REALM_FAILED_PATH,gray=0)
             if position != False:
                 printWithTime("Message: Account %s: Failed, Enemy is very strong... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 
             #Refresh if can not fight
-            
             if self.__gui.find_game_img(IMAGE_REALM_SECTION_PATH,thread=0.6) == False and self.__gui.find_game_img(IMAGE_REALM_RANK_PATH,thread=1, gray=0) != False:
                 printWithTime("Message: Account %s: Enemy is very strong, refresh to get new turn... "%(str(self.__id)))
-                pyautogui.alert(text='Refresh new turn...', title='Realm raid', button='OK')
+                alert('Refresh new turn...','Realm raid')
                 # position=self.__gui.find_game_img(IMAGE_REALM_REFRESH_PATH,gray=0)
                 # self.__gui.mouse_click_bg(position)
                 continue
 #
     def gameModeDemonSeal(self):
         printWithTime("Message: Account :%s: Fairy Seal"%(str(self.__id)))
-        while True:
+        while self.__gui.run:
+            #one snapshot per iteration, shared by every detection below
+            yield "frame",0.1
             position=self.__gui.find_game_img(IMAGE_SEAL_WAIT_PATH,thread=0.8)
             if position != False:
-                printWithTime("Message: Account :%s: Finding team, sleep 10s..."%(str(self.__id)))
-                time.sleep(10)
+                printWithTime("Message: Account :%s: Finding team, waiting..."%(str(self.__id)))
+                yield "wait","seal.finding_team"
                 continue
-            
+
             position=self.__gui.find_game_img(IMAGE_STORY_READY_PATH,gray=0,thread=0.8)
             if position != False:
                 printWithTime("Message: Account %s: Ready for battle.... "%(str(self.__id)))
-                time.sleep(5)
-                self.__gui.mouse_click_bg(position)
-                #time.sleep(2)
-                continue  
+                yield "wait","seal.ready"
+                yield "click",position
+                continue
 
             position=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.85)
             if position != False:
-                printWithTime("Message: Account %s: In battle detected, sleep 5s ..."%(str(self.__id)))
-                time.sleep(5)
+                printWithTime("Message: Account %s: In battle detected, waiting ..."%(str(self.__id)))
+                yield "wait",self.battlePoint("seal")
                 continue
 
             position=self.__gui.find_game_img(IMAGE_SEAL_TEAM_PATH)
             if position != False:
                 printWithTime("Message: Account :%s: Clicking team icon..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 
             position=self.__gui.find_game_img(IMAGE_SEAL_MATCH_PATH)
             if position != False:
                 printWithTime("Message: Account :%s: Matching..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                time.sleep(1)
+                yield "click",position
+                yield "wait","seal.matching"
                 continue
-            
-
-            # if self.__gui.find_game_img(IMAGE_SEAL_REFRESH_PATH) != False:
-            #     while True:
-            #         self.__gui.mouse_click_bg(REFRESH_SEAL_COORDINATE)
-            #         time.sleep(0.5)
-            #         position=self.__gui.find_game_img(IMAGE_SEAL_JOIN_PATH)
-            #         if position != False:
-            #             self.__gui.mouse_click_bg(position)
-            #             self.__gui.mouse_click_bg(position)
-            #             self.__gui.mouse_click_bg(position)
-            #             printWithTime("Message: Account :%s: Click to join..."%(str(self.__id)))
-            #             break
-
-            
 
             #check finish
             position=self.__gui.find_game_img(IMAGE_REALM_FINISHED1_PATH,gray=0)
             if position != False:
                 printWithTime("Message: Account %s: Finishing..."%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 
             position=self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH)
             if position != False:
                 printWithTime("Message: Account %s: Getting reward... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
-                
-                while True:
-                    if self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH) == False:
-                        break
-                    self.__gui.mouse_click_bg(position)
+                yield "click",position
+                while self.__gui.run and self.__gui.find_game_img(IMAGE_REALM_FINISHED2_PATH) != False:
+                    yield "click",position
                 break
 
             position=self.__gui.find_game_img(IMAGE_SOUL_START_PATH,gray=0)
             if position != False:
                 printWithTime("Message: Account %s: Starting game... "%(str(self.__id)))
-                self.__gui.mouse_click_bg(position)
+                yield "click",position
                 continue
 #
     def gameModeEvent(self):
+        while self.__gui.run:
+            yield from self.targetShikigami()
+#
+    def script(self):
+        '''
+        : return: script of one round of the game mode
+        '''
+        if self.__gameMode==1:
+            return self.gameModeSoul()
+        if self.__gameMode==2:
+            self.__detectCount=10
+            return self.gameModeStory()
+        if self.__gameMode==3:
+            return self.gameModeSingleStory()
+        if self.__gameMode==4:
+            return self.gameModeRealmRaid()
+        if self.__gameMode==5:
+            return self.gameModeDemonSeal()
+        if self.__gameMode==6:
+            return self.gameModeEvent()
+        raise ValueError("unknown game mode %s"%(str(self.__gameMode)))
+
+    def play(self,script):
+        '''
+        Run a script on this thread
+
+            : return: value returned by the script
+        '''
+        result=None
         while True:
-            self.targetShikigami()
+            try:
+                action=script.send(result)
+            except StopIteration as stop:
+                return stop.value
+            result=self.act(action)
+
+    def act(self,action):
+        kind=action[0]
+        if kind=="frame":
+            return self.__gui.new_frame(delay=action[1])
+        if kind=="click":
+            return self.__gui.mouse_click_bg(action[1])
+        if kind=="drag":
+            return self.__gui.mouse_drag_bg(*action[1:])
+        if kind=="wait":
+            return self.__pace.wait(action[1])
+        if kind=="sleep":
+            return self.__pace.sleep(action[1])
+        raise ValueError("unknown action %s"%(str(kind)))
 #
 
     def detectPause(self):
@@ -1350,45 +1042,31 @@ class Processing(threading.Thread):
                 _accountLocker.acquire()
                 printWithTime("Paused")
 #
-    def detectAssistance(self):
-        
-        while True:
-            time.sleep(10)
-            message="Message: Account %s: Checking co-op wanted seal..."%(str(self.__id))
-            printWithTime(message)
-            
-            coop=self.__gui.find_game_img(IMAGE_COOP_SEAL,thread=0.8)
-            if coop == False:
-                continue
-            
-            message="Message: Account %s: An invitation for a wanted seal was detected..."%(str(self.__id))
-            printWithTime(message)
-
-
-            message="Message: Account %s: Refuse to accept the invitation for the wanted seal..."%(str(self.__id))
-            printWithTime(message)
-            self.__gui.mouse_click_bg((750, 452))
-#
-    def targetShikigami(self,location=None):
+    def targetShikigami(self):
+        yield "frame",0
         profile=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.8)
         set=self.__gui.find_game_img(IMAGE_SOUL_SET_PATH,thread=0.8)
         if profile!=False and set==False:
-            while True:
+            while self.__gui.run:
+                yield "frame",0
                 profile=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.8)
                 target=self.__gui.find_game_img(IMAGE_TARGET_SHIKIGAMI,thread=0.8)
                 if target==False and profile!=False:
                     message="Message: Account %s: Target to the 5th shikigami..."%(str(self.__id))
                     printWithTime(message)
-                    self.__gui.mouse_click_bg((859, 423))
-                    time.sleep(1)
-                
+                    yield "click",(859, 423)
+                    yield "wait","event.target"
+
                 if target!=False and profile!=False:
-                    while self.isInBattle():
-                        printWithTime("Message: Account %s: In battle detected, sleep 5s ..."%(str(self.__id)))
-                        time.sleep(5)
+                    while self.__gui.run:
+                        yield "frame",0
+                        if not self.isInBattle():
+                            break
+                        printWithTime("Message: Account %s: In battle detected, waiting ..."%(str(self.__id)))
+                        yield "wait",self.battlePoint("event")
                     break
         else:
-            time.sleep(1)
+            yield "wait","event.idle"
 
 
     def claimRewardBattle(self):
@@ -1408,6 +1086,25 @@ class Processing(threading.Thread):
                 self.__gui.mouse_click_bg(position)
                 printWithTime("Message: Account %s: Get reward.... position"%(str(self.__id)))
               
+    def battlePoint(self,mode):
+        if self.__stage:
+            return "%s.battle@%s"%(mode,self.__stage)
+        return "%s.battle"%(mode)
+
+    def battleEnded(self,name,seconds):
+        if ".battle" not in name:
+            return
+        stats=self.__pace.stats.report().get(name)
+        if stats and stats["p50"] is not None:
+            printWithTime("Message: Account %s: Battle lasted %.1fs, learned p10 %.1fs p50 %.1fs p90 %.1fs (%d battles)"%(str(self.__id),seconds,stats["p10"],stats["p50"],stats["p90"],stats["samples"]))
+
+    def findShikigamiSelected(self,frame=None):
+        #match every variant of the selected shikigami on one snapshot, taken once the last drag has settled if empty
+        requests=[MatchRequest(path,thread=0.9) for path in IMAGE_STORY_SHIKIGAMI_SELECTED_LIST]
+        if frame is None:
+            frame=self.__gui.new_frame(delay=0.1)
+        return self.__gui.find_batch(requests,frame).positions()
+
     def isInBattle(self):
         position=self.__gui.find_game_img(IMAGE_REALM_PROFILE_PATH,thread=0.85)
         if position != False or self.__gui.find_game_img(IMAGE_SOUL_SET_PATH,thread=0.8) != False:
@@ -1416,33 +1113,24 @@ class Processing(threading.Thread):
 
 
     def run(self):
-        _localVariable.isBossDetected=False
-        _localVariable.isInBattle=False
-        _localVariable.isInRoom=False
-        _localVariable.detectCount=10
-        count=0
-        while self.__total-count>0:
-            seconds=0
-            while seconds:
-                time.sleep(1)
-                seconds-=1
-            printWithTime("\n\n==============Account %s: "%(str(self.__id))+"Starting a new round==================")
-            if self.__gameMode==1:
-                self.gameModeSoul()
-            elif self.__gameMode==2:
-                _localVariable.detectCount=10
-                _localVariable.xDirection=-1.0
-                self.gameModeStory()
-            elif self.__gameMode==3:
-                self.gameModeSingleStory()
-            elif self.__gameMode==4:
-                self.gameModeRealmRaid()
-            elif self.__gameMode==5:
-                self.gameModeDemonSeal()
-            elif self.__gameMode==6:
-                self.gameModeEvent()
-            count+=1
-            message="Account %s: Game mode %s, completed %s round, remaining %s round..."%(str(self.__id),str(self.__gameMode),str(count),str(self.__total-count))
-            printWithTime(message)
+        try:
+            count=0
+            while self.__total-count>0 and self.__gui.run and not self.finished:
+                seconds=0
+                while seconds:
+                    time.sleep(1)
+                    seconds-=1
+                printWithTime("\n\n==============Account %s: "%(str(self.__id))+"Starting a new round==================")
+                self.play(self.script())
+                #a round cut short by stop() is not completed
+                if self.finished or not self.__gui.run:
+                    break
+                count+=1
+                self.completed=count
+                message="Account %s: Game mode %s, completed %s round, remaining %s round..."%(str(self.__id),str(self.__gameMode),str(count),str(self.__total-count))
+                printWithTime(message)
+        finally:
+            #also when the loop is stopped or crashed, a restarted account gets a new GameControl
+            self.__gui.close()
 
         
\ No newline at end of file
@@ -0,0 +1,335 @@
+'''
+Session recording for post-mortems: frames, detection results and inputs
+
+A recording is a folder of chunk files, each chunk starts with a keyframe followed by
+XOR deltas against the previous frame, both zlib compressed. index.json lists the frames
+of every closed chunk for seeking.
+'''
+import json
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+import numpy as np
+
+RECORD = struct.Struct('<cdIHHB')
+KEYFRAME = b'K'
+DELTA = b'D'
+EVENT = b'E'
+INDEX_FILE = 'index.json'
+CHUNK_PREFIX = 'chunk_'
+CHUNK_SUFFIX = '.rec'
+
+
+class Recorder():
+    def __init__(self, folder='./recordings', fps=2, keyframe_interval=30, max_bytes=500*1024*1024,
+                 rolling=None, cpu_budget=0.2, queue_size=16, level=1):
+        '''
+        Write frames and events on a background thread, the callers never wait for the disk
+
+            : param folder = './recordings': folder of the recording
+
+            : param fps = 2: max frames recorded per second, others are dropped
+
+            : param keyframe_interval = 30: frames per chunk, every chunk starts with a keyframe
+
+            : param max_bytes = 500MB: oldest chunks are deleted above this size
+
+            : param rolling = None: seconds kept, e.g. 600 for the last 10 minutes, everything if empty
+
+            : param cpu_budget = 0.2: max part of a core spent encoding, frames are dropped above it
+
+            : param queue_size = 16: pending items, new items are dropped while it is full
+
+            : param level = 1: zlib compression level
+        '''
+        self.folder = folder
+        self.interval = 1.0 / fps if fps else 0
+        self.keyframe_interval = keyframe_interval
+        self.max_bytes = max_bytes
+        self.rolling = rolling
+        self.cpu_budget = cpu_budget
+        self.level = level
+        self.dropped = 0
+        self._queue = queue.Queue(queue_size)
+        self._thread = None
+        self._last_frame = 0
+        self._file = None
+        self._chunk = None
+        self._previous = None
+        self._delta = None
+        self._count = 0
+        self._busy = 0.0
+        self._started = 0.0
+        self._index = []
+
+    def start(self):
+        if self._thread is not None:
+            return self
+        os.makedirs(self.folder, exist_ok=True)
+        self._index = _read_index(self.folder)
+        self._started = time.time()
+        self._thread = threading.Thread(None, self._run, name='Recorder', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        '''
+        Write the pending items and close the current chunk
+        '''
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(10)
+        self._thread = None
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    def record_frame(self, frame):
+        '''
+        Queue a Frame, dropped if the last recorded one is more recent than 1 / fps
+        '''
+        if self._thread is None or frame is None or frame.timestamp - self._last_frame < self.interval:
+            return False
+        self._last_frame = frame.timestamp
+        # The queue keeps the Frame alive, so its pooled buffer is not reused before it is written
+        return self._put((KEYFRAME, frame.timestamp, frame))
+
+    def record_event(self, kind, data=None, timestamp=None):
+        '''
+        Queue an event, e.g. record_event('click', (x, y)) or record_event('find', {...})
+        '''
+        if self._thread is None:
+            return False
+        timestamp = time.time() if timestamp is None else timestamp
+        return self._put((EVENT, timestamp, (kind, data)))
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            if item is None:
+                break
+            kind, timestamp, payload = item
+            try:
+                if kind == EVENT:
+                    self._write_event(timestamp, payload)
+                elif self._within_budget():
+                    start = time.thread_time()
+                    self._write_frame(timestamp, payload.bgra[:, :, :3])
+                    self._busy += time.thread_time() - start
+                else:
+                    self.dropped += 1
+            except Exception:
+                logging.warning('Recorder: can not write to %s' % (self.folder))
+        self._close_chunk()
+
+    def _within_budget(self):
+        elapsed = time.time() - self._started
+        return elapsed <= 0 or self._busy / elapsed <= self.cpu_budget
+
+    def _open_chunk(self, timestamp):
+        self._close_chunk()
+        name = '%s%.3f%s' % (CHUNK_PREFIX, timestamp, CHUNK_SUFFIX)
+        self._file = open(os.path.join(self.folder, name), 'wb')
+        self._chunk = {'file': name, 'start': timestamp, 'end': timestamp, 'frames': []}
+        self._count = 0
+        self._previous = None
+
+    def _close_chunk(self):
+        if self._file is None:
+            return
+        self._file.close()
+        self._file = None
+        self._index.append(self._chunk)
+        self._chunk = None
+        self._trim()
+        _write_index(self.folder, self._index)
+
+    def _write(self, kind, timestamp, data, height=0, width=0, channels=0):
+        offset = self._file.tell()
+        self._file.write(RECORD.pack(kind, timestamp, len(data), height, width, channels))
+        self._file.write(data)
+        self._chunk['end'] = timestamp
+        return offset
+
+    def _write_event(self, timestamp, payload):
+        if self._file is None:
+            self._open_chunk(timestamp)
+        kind, data = payload
+        self._write(EVENT, timestamp, json.dumps({'kind': kind, 'data': data}, default=str).encode('utf-8'))
+
+    def _write_frame(self, timestamp, img):
+        if self._file is None or self._count >= self.keyframe_interval:
+            self._open_chunk(timestamp)
+        height, width, channels = img.shape
+        if self._previous is None or self._previous.shape != img.shape:
+            self._previous = np.empty(img.shape, dtype=np.uint8)
+            self._delta = np.empty(img.shape, dtype=np.uint8)
+            kind = KEYFRAME
+            data = img
+        else:
+            # Unchanged pixels XOR to zero and compress to almost nothing
+            kind = DELTA
+            data = np.bitwise_xor(img, self._previous, out=self._delta)
+        offset = self._write(kind, timestamp, zlib.compress(np.ascontiguousarray(data).tobytes(), self.level),
+                             height, width, channels)
+        np.copyto(self._previous, img)
+        self._chunk['frames'].append([timestamp, offset])
+        self._count += 1
+
+    def _trim(self):
+        now = time.time()
+        total = sum(_size(self.folder, chunk['file']) for chunk in self._index)
+        while len(self._index) > 1:
+            oldest = self._index[0]
+            expired = self.rolling is not None and oldest['end'] < now - self.rolling
+            if not expired and total <= self.max_bytes:
+                break
+            total -= _size(self.folder, oldest['file'])
+            try:
+                os.remove(os.path.join(self.folder, oldest['file']))
+            except OSError:
+                pass
+            del self._index[0]
+
+
+def _size(folder, name):
+    try:
+        return os.path.getsize(os.path.join(folder, name))
+    except OSError:
+        return 0
+
+
+def _read_index(folder):
+    path = os.path.join(folder, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)['chunks']
+    except (OSError, ValueError, KeyError):
+        logging.warning('Recorder: can not read %s, chunks will be scanned' % (path))
+        return []
+
+
+def _write_index(folder, chunks):
+    path = os.path.join(folder, INDEX_FILE)
+    tmp = path + '.tmp'
+    with open(tmp, 'w') as f:
+        json.dump({'version': 1, 'chunks': chunks}, f)
+    os.replace(tmp, path)
+
+
+def is_recording(folder):
+    '''
+    : return: True if folder holds a recording
+    '''
+    return os.path.isdir(folder) and any(name.startswith(CHUNK_PREFIX) for name in os.listdir(folder))
+
+
+class RecordingReader():
+    def __init__(self, folder='./recordings'):
+        '''
+        Read a recording, chunks missing from the index (e.g. after a crash) are scanned
+        '''
+        self.folder = folder
+        indexed = dict((chunk['file'], chunk) for chunk in _read_index(folder))
+        self.chunks = []
+        for name in sorted(os.listdir(folder)):
+            if not (name.startswith(CHUNK_PREFIX) and name.endswith(CHUNK_SUFFIX)):
+                continue
+            chunk = indexed.get(name)
+            if chunk is None:
+                chunk = self._scan(name)
+            self.chunks.append(chunk)
+        self.chunks.sort(key=lambda chunk: chunk['start'])
+
+    def _records(self, name):
+        with open(os.path.join(self.folder, name), 'rb') as f:
+            while True:
+                offset = f.tell()
+                header = f.read(RECORD.size)
+                if len(header) < RECORD.size:
+                    return
+                kind, timestamp, length, height, width, channels = RECORD.unpack(header)
+                data = f.read(length)
+                if len(data) < length:
+                    # Truncated by a crash
+                    return
+                yield offset, kind, timestamp, data, (height, width, channels)
+
+    def _scan(self, name):
+        chunk = {'file': name, 'start': None, 'end': None, 'frames': []}
+        for offset, kind, timestamp, data, shape in self._records(name):
+            if chunk['start'] is None:
+                chunk['start'] = timestamp
+            chunk['end'] = timestamp
+            if kind in (KEYFRAME, DELTA):
+                chunk['frames'].append([timestamp, offset])
+        if chunk['start'] is None:
+            chunk['start'] = chunk['end'] = 0
+        return chunk
+
+    def _decode_chunk(self, chunk):
+        previous = None
+        for offset, kind, timestamp, data, shape in self._records(chunk['file']):
+            if kind == EVENT:
+                continue
+            img = np.frombuffer(zlib.decompress(data), dtype=np.uint8).reshape(shape)
+            if kind == KEYFRAME or previous is None or previous.shape != img.shape:
+                if kind == DELTA:
+                    # Delta without its keyframe, the chunk start was lost
+                    continue
+                previous = img.copy()
+            else:
+                np.bitwise_xor(previous, img, out=previous)
+            yield timestamp, previous
+
+    def frames(self, start=None):
+        '''
+        : param start = None: first timestamp to return, from the beginning if empty
+
+        : return: generator of (timestamp, (h, w, 3) BGR image), the image is reused, copy it to keep it
+        '''
+        for chunk in self.chunks:
+            if start is not None and chunk['end'] < start:
+                continue
+            for timestamp, img in self._decode_chunk(chunk):
+                if start is None or timestamp >= start:
+                    yield timestamp, img
+
+    def seek(self, timestamp):
+        '''
+        : return: (timestamp, BGR image) of the last frame at or before timestamp, None if there is none
+        '''
+        found = None
+        for chunk in self.chunks:
+            if chunk['frames'] and chunk['frames'][0][0] <= timestamp:
+                found = chunk
+        if found is None:
+            return None
+        result = None
+        for frame_time, img in self._decode_chunk(found):
+            if frame_time > timestamp:
+                break
+            result = (frame_time, img.copy())
+        return result
+
+    def events(self):
+        '''
+        : return: generator of (timestamp, kind, data)
+        '''
+        for chunk in self.chunks:
+            for offset, kind, timestamp, data, shape in self._records(chunk['file']):
+                if kind == EVENT:
+                    event = json.loads(data.decode('utf-8'))
+                    yield timestamp, event['kind'], event['data']
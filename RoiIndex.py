@@ -0,0 +1,247 @@
+import atexit
+import json
+import logging
+import os
+import threading
+from TemplateRegistry import template_key
+
+# The templates ship with the repo, its root is where their paths are relative to
+ROOT = os.path.normcase(os.path.dirname(os.path.abspath(__file__))).lower()
+
+
+def roi_key(path):
+    '''
+    Key of a template in the index: its lowercased path relative to the repo root, like the paths of
+    TemplateAtlas, so roi_index.json still matches when the checkout moves or is shared between machines
+    '''
+    key = template_key(path)
+    try:
+        key = os.path.relpath(key, ROOT)
+    except ValueError:
+        # Another drive than the repo
+        return key
+    return key.replace(os.sep, '/')
+
+
+class RoiIndex():
+    def __init__(self, path='./roi_index.json', padding=16, min_hits=3, recheck=10, max_ratio=0.5, save_interval=30):
+        '''
+        Remember where each template has been found, so later searches only look there
+
+            : param path = './roi_index.json': file the index is saved to between runs, None to keep it in memory
+
+            : param padding = 16: pixels added around the learned bounding box
+
+            : param min_hits = 3: hits needed before a miss in the region of a template of set_trust is trusted
+
+            : param recheck = 10: a trusted region still falls back to a full search every recheck misses
+
+            : param max_ratio = 0.5: regions bigger than this part of the frame are not used
+
+            : param save_interval = 30: seconds between two saves of the background thread, see start_autosave
+        '''
+        self.path = path
+        self.padding = padding
+        self.min_hits = min_hits
+        self.recheck = recheck
+        self.max_ratio = max_ratio
+        self.save_interval = save_interval
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._misses = {}
+        self._trusted = set()
+        self._dirty = False
+        self._autosave = None
+        self._closing = threading.Event()
+        self.load()
+
+    def load(self):
+        if self.path is None or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            with self._lock:
+                for key, value in data.items():
+                    if os.path.isabs(key):
+                        # Saved before the keys were relative to the repo root
+                        key = roi_key(key)
+                    self._entries[key] = {'box': list(value['box']), 'hits': int(value['hits']),
+                                          'moved': bool(value.get('moved', False))}
+        except Exception:
+            logging.warning('RoiIndex: can not read %s, starting empty' % (self.path))
+
+    def save(self):
+        '''
+        Write the index to disk if it changed, never called from the matching itself
+        '''
+        if self.path is None:
+            return
+        with self._lock:
+            if not self._dirty:
+                return
+            data = json.dumps(self._entries)
+            self._dirty = False
+        try:
+            tmp = self.path + '.tmp'
+            with open(tmp, 'w') as f:
+                f.write(data)
+            os.replace(tmp, self.path)
+        except OSError:
+            logging.warning('RoiIndex: can not write %s' % (self.path))
+
+    def start_autosave(self):
+        '''
+        Save the changes every save_interval seconds on a background thread, until close()
+        '''
+        if self._autosave is not None or self.path is None:
+            return
+        self._closing.clear()
+        self._autosave = threading.Thread(None, self._autosave_loop, name='RoiIndex', daemon=True)
+        self._autosave.start()
+
+    def _autosave_loop(self):
+        while not self._closing.wait(self.save_interval):
+            self.save()
+
+    def close(self):
+        '''
+        Stop the background saves and write the last changes
+        '''
+        if self._autosave is not None:
+            self._closing.set()
+            self._autosave.join()
+            self._autosave = None
+        self.save()
+
+    def record(self, template, top_left, size):
+        '''
+        Record a match of the template
+
+            : param template: path of the template
+
+            : param top_left: (x, y) window coordinates of the match
+
+            : param size: (w, h) of the template
+        '''
+        key = roi_key(template)
+        x1, y1 = int(top_left[0]), int(top_left[1])
+        x2, y2 = x1 + int(size[0]), y1 + int(size[1])
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self._entries[key] = {'box': [x1, y1, x2, y2], 'hits': 1, 'moved': False}
+            else:
+                box = entry['box']
+                if entry['hits'] >= self.min_hits and not (box[0] - self.padding <= x1 and box[1] - self.padding <= y1
+                                                           and x2 <= box[2] + self.padding and y2 <= box[3] + self.padding):
+                    # Found outside a region whose misses were trusted, the template shows up in several places
+                    entry['moved'] = True
+                entry['box'] = [min(box[0], x1), min(box[1], y1), max(box[2], x2), max(box[3], y2)]
+                entry['hits'] += 1
+            self._misses[key] = 0
+            # Saved by the background thread or by close(), the matching threads never write the file
+            self._dirty = True
+
+    def seed(self, template, box):
+        '''
+        Start a template from a known region, e.g. stored in the template atlas, an already learned region is kept
+
+            : param box: (x1, y1, x2, y2) window coordinates
+        '''
+        key = roi_key(template)
+        with self._lock:
+            if key in self._entries:
+                return
+            # No hits yet, the region is searched first but its misses are not trusted before min_hits new hits
+            self._entries[key] = {'box': [int(v) for v in box], 'hits': 0, 'moved': False}
+
+    def box(self, template):
+        '''
+        : return: learned (x1, y1, x2, y2) of the template without padding, None if unknown
+        '''
+        with self._lock:
+            entry = self._entries.get(roi_key(template))
+            return None if entry is None else tuple(entry['box'])
+
+    def region(self, template, width, height):
+        '''
+        Padded region to search the template in
+
+            : param template: path of the template
+
+            : param width: width of the frame
+
+            : param height: height of the frame
+
+            : return: (x1, y1, x2, y2), None if the template has no usable region
+        '''
+        with self._lock:
+            entry = self._entries.get(roi_key(template))
+            if entry is None:
+                return None
+            box = entry['box']
+        x1 = max(0, box[0] - self.padding)
+        y1 = max(0, box[1] - self.padding)
+        x2 = min(width, box[2] + self.padding)
+        y2 = min(height, box[3] + self.padding)
+        if x2 <= x1 or y2 <= y1:
+            return None
+        if (x2 - x1) * (y2 - y1) > self.max_ratio * width * height:
+            return None
+        return x1, y1, x2, y2
+
+    def trust_miss(self, template):
+        '''
+        Whether a miss inside the region can be returned without a full frame search
+
+            : param template: path of the template
+
+            : return: True to trust the miss, False to fall back to the full frame, always False for
+            the templates that did not opt in with set_trust
+        '''
+        key = roi_key(template)
+        with self._lock:
+            if key not in self._trusted:
+                return False
+            entry = self._entries.get(key)
+            if entry is None or entry['hits'] < self.min_hits or entry.get('moved'):
+                return False
+            misses = self._misses.get(key, 0) + 1
+            self._misses[key] = misses
+            return misses % self.recheck != 0
+
+    def set_trust(self, template, trust=True):
+        '''
+        Let a template opt in to trusted misses: once its region has min_hits hits, a miss in the region is
+        returned without a full frame search, except every recheck misses. Only for templates that never move,
+        a template shown somewhere else is reported missing until the next full search
+        '''
+        key = roi_key(template)
+        with self._lock:
+            if trust:
+                self._trusted.add(key)
+            else:
+                self._trusted.discard(key)
+
+    def forget(self, template):
+        with self._lock:
+            if self._entries.pop(roi_key(template), None) is not None:
+                self._dirty = True
+
+
+_index = None
+_indexLock = threading.Lock()
+
+
+def get_roi_index():
+    '''
+    Index shared by every GameControl of the process, saved in the background and at exit
+    '''
+    global _index
+    with _indexLock:
+        if _index is None:
+            _index = RoiIndex()
+            _index.start_autosave()
+            atexit.register(_index.close)
+        return _index
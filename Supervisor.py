@@ -0,0 +1,247 @@
+'''
+Run every account in its own process, so the Python loops of the accounts do not share one GIL
+
+The children load the template atlas themselves, the atlas is memory mapped read only so
+its pages are shared by all of them through the page cache. Every child reports its status
+and pacing measures to the supervisor over a pipe and is restarted with a growing delay when
+it crashes. Only the supervisor saves pacing.json.
+'''
+import logging
+import multiprocessing
+import threading
+import time
+from Orchestrator import AccountConfig
+from Pacing import get_pacing_stats
+
+STATE_STARTING = 'starting'
+STATE_RUNNING = 'running'
+STATE_FINISHED = 'finished'
+STATE_STOPPED = 'stopped'
+STATE_CRASHED = 'crashed'
+STATE_WAITING = 'waiting'
+
+
+def _worker_main(index, config, conn, report_interval):
+    '''
+    Entry point of a child process
+
+        : param config: AccountConfig as dict, picklable under spawn
+    '''
+    # Imported in the child, Processing loads the atlas and preloads the templates at import
+    import Processing as game
+    config = AccountConfig.from_dict(config)
+    stats = get_pacing_stats()
+    # Every child writing pacing.json would keep only the last writer's measures, the supervisor merges and saves them
+    stats.journal()
+    # Ids are per process, keep the account number of the supervisor for logs and recordings
+    game._accountCount = index
+    worker = game.Processing(config.window, config.mode, config.rounds, config.captain, config.main_dmg,
+                             capture=config.capture(), stage=config.stage, hwnd=config.hwnd, adbSerial=config.adb_serial, adbPath=config.adb_path)
+    worker.daemon = True
+    worker.start()
+    stopping = False
+    while worker.is_alive():
+        worker.join(report_interval)
+        try:
+            while conn.poll():
+                if conn.recv() == 'stop':
+                    stopping = True
+                    worker.stop()
+            conn.send({'index': index, 'state': STATE_RUNNING, 'rounds': worker.completed,
+                       'cpu': time.process_time(), 'time': time.time(), 'pacing': stats.report(),
+                       'measures': stats.drain()})
+        except (EOFError, OSError):
+            # The supervisor is gone
+            stopping = True
+            worker.stop()
+    # Stopped by a popup handler (GameControl.stop) or out of rounds to play (Processing.finished) is no crash
+    stopping = stopping or worker.stopped
+    finished = stopping or worker.finished or worker.completed >= config.rounds
+    try:
+        conn.send({'index': index, 'state': STATE_STOPPED if stopping else STATE_FINISHED if finished else STATE_CRASHED,
+                   'rounds': worker.completed, 'cpu': time.process_time(), 'time': time.time(),
+                   'pacing': stats.report(), 'measures': stats.drain()})
+    except (EOFError, OSError):
+        pass
+    # A game loop that ended early (quit_game, exception) is a crash for the supervisor
+    raise SystemExit(0 if finished else 1)
+
+
+class _Slot():
+    def __init__(self, config):
+        self.config = config
+        self.process = None
+        self.conn = None
+        self.state = STATE_STOPPED
+        self.status = {}
+        self.failures = 0
+        self.restarts = 0
+        self.started = 0
+        self.next_start = None
+
+
+class Supervisor():
+    def __init__(self, configs, backoff=5.0, max_backoff=300.0, stable_after=600.0, report_interval=5.0,
+                 start_interval=1.0):
+        '''
+        One process per account, same controls as Orchestrator
+
+            : param configs: list of AccountConfig
+
+            : param backoff = 5.0: delay before the first restart of a crashed account, doubled on every further crash
+
+            : param max_backoff = 300.0: longest delay before a restart
+
+            : param stable_after = 600.0: an account running this many seconds has its crash count reset
+
+            : param report_interval = 5.0: seconds between two status reports of a child
+
+            : param start_interval = 1.0: seconds between two starts in start_all
+        '''
+        self.slots = [_Slot(config) for config in configs]
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.stable_after = stable_after
+        self.report_interval = report_interval
+        self.start_interval = start_interval
+        # spawn on every platform, the children must not inherit window handles or threads
+        self._context = multiprocessing.get_context('spawn')
+        self._lock = threading.RLock()
+
+    def start(self, index):
+        '''
+        Start an account, nothing happens if it is running
+        '''
+        with self._lock:
+            slot = self.slots[index]
+            if slot.process is not None and slot.process.is_alive():
+                return slot.process
+            parent, child = self._context.Pipe()
+            slot.process = self._context.Process(target=_worker_main, name='account%d' % (index),
+                                                 args=(index, slot.config.to_dict(), child, self.report_interval))
+            slot.process.daemon = True
+            slot.process.start()
+            child.close()
+            slot.conn = parent
+            slot.state = STATE_STARTING
+            slot.started = time.time()
+            slot.next_start = None
+            logging.info('Supervisor: account %d started, pid %d' % (index, slot.process.pid))
+            return slot.process
+
+    def stop(self, index, timeout=10):
+        '''
+        Ask an account to stop, it is terminated if it does not within timeout
+
+            : return: True if it stopped by itself
+        '''
+        with self._lock:
+            slot = self.slots[index]
+            slot.next_start = None
+            process = slot.process
+            if process is None or not process.is_alive():
+                if slot.state != STATE_FINISHED:
+                    slot.state = STATE_STOPPED
+                return True
+            try:
+                slot.conn.send('stop')
+            except (EOFError, OSError):
+                pass
+        process.join(timeout)
+        with self._lock:
+            stopped = not process.is_alive()
+            if not stopped:
+                logging.warning('Supervisor: account %d did not stop, terminated' % (index))
+                process.terminate()
+                process.join()
+            self._receive(slot)
+            slot.state = STATE_STOPPED
+            return stopped
+
+    def restart(self, index, timeout=10):
+        self.stop(index, timeout)
+        with self._lock:
+            self.slots[index].failures = 0
+            return self.start(index)
+
+    def start_all(self):
+        for index in range(len(self.slots)):
+            self.start(index)
+            if index + 1 < len(self.slots):
+                time.sleep(self.start_interval)
+
+    def stop_all(self, timeout=10):
+        with self._lock:
+            for slot in self.slots:
+                slot.next_start = None
+                if slot.process is not None and slot.process.is_alive():
+                    try:
+                        slot.conn.send('stop')
+                    except (EOFError, OSError):
+                        pass
+        for index in range(len(self.slots)):
+            self.stop(index, timeout)
+
+    def _receive(self, slot):
+        try:
+            while slot.conn is not None and slot.conn.poll():
+                status = slot.conn.recv()
+                get_pacing_stats().merge(status.pop('measures', None))
+                slot.status = status
+                slot.state = status.get('state', slot.state)
+        except (EOFError, OSError):
+            pass
+
+    def poll(self):
+        '''
+        Read the reports of the children, restart the crashed ones once their delay is over
+        '''
+        now = time.time()
+        with self._lock:
+            for index, slot in enumerate(self.slots):
+                self._receive(slot)
+                if slot.next_start is not None:
+                    if now >= slot.next_start:
+                        slot.restarts += 1
+                        self.start(index)
+                    continue
+                if slot.process is None or slot.process.is_alive() or slot.state in (STATE_STOPPED, STATE_FINISHED):
+                    continue
+                if slot.process.exitcode == 0:
+                    slot.state = STATE_FINISHED
+                    continue
+                if now - slot.started >= self.stable_after:
+                    slot.failures = 0
+                delay = min(self.max_backoff, self.backoff * 2 ** slot.failures)
+                slot.failures += 1
+                slot.state = STATE_WAITING
+                slot.next_start = now + delay
+                logging.warning('Supervisor: account %d crashed (exit code %s), restart in %.0fs'
+                                % (index, str(slot.process.exitcode), delay))
+
+    def status(self):
+        '''
+        : return: list of dict with the config, state, restart count and last report of every account
+        '''
+        self.poll()
+        with self._lock:
+            return [dict(slot.config.to_dict(), index=index, state=slot.state, restarts=slot.restarts,
+                         pid=slot.process.pid if slot.process is not None else None,
+                         rounds=slot.status.get('rounds', 0), cpu=slot.status.get('cpu'),
+                         pacing=slot.status.get('pacing'))
+                    for index, slot in enumerate(self.slots)]
+
+    def join(self, interval=1.0):
+        '''
+        Supervise until every account is finished or stopped, Ctrl+C stops them
+        '''
+        try:
+            while True:
+                self.poll()
+                with self._lock:
+                    if all(slot.state in (STATE_FINISHED, STATE_STOPPED) for slot in self.slots):
+                        break
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            self.stop_all()
+        get_pacing_stats().save(True)
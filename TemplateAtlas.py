@@ -0,0 +1,210 @@
+'''
+Compile every template into one memory mappable file
+
+    py TemplateAtlas.py [--out templates.atlas] [--levels 2] [--features sift] [folders...]
+'''
+import argparse
+import json
+import logging
+import os
+import struct
+import cv2
+import numpy as np
+from TemplateRegistry import Template, TemplateRegistry, get_registry
+
+MAGIC = b'OMYATLS1'
+ALIGN = 64
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.bmp')
+
+
+def _align(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _keypoints_to_array(kp):
+    return np.array([[k.pt[0], k.pt[1], k.size, k.angle, k.response, k.octave, k.class_id] for k in kp],
+                    dtype=np.float32).reshape(-1, 7)
+
+
+def _array_to_keypoints(arr):
+    return [cv2.KeyPoint(float(r[0]), float(r[1]), float(r[2]), float(r[3]), float(r[4]), int(r[5]), int(r[6]))
+            for r in arr]
+
+
+def find_templates(folders):
+    '''
+    : param folders: folders to walk
+
+    : return: sorted list of image paths
+    '''
+    paths = []
+    for folder in folders:
+        for root, dirs, files in os.walk(folder):
+            for name in files:
+                if name.lower().endswith(IMAGE_EXTENSIONS):
+                    paths.append(os.path.join(root, name))
+    return sorted(paths)
+
+
+def build(paths, out='./templates.atlas', levels=2, features=('sift',), roi_index=None):
+    '''
+    Compile templates, their grayscale and pyramid versions and their keypoints into one file
+
+        : param paths: template paths
+
+        : param out = './templates.atlas': file to write
+
+        : param levels = 2: pyramid levels stored for every template
+
+        : param features = ('sift',): descriptor backends whose keypoints are stored
+
+        : param roi_index = None: RoiIndex whose learned regions are stored, load_atlas seeds the index with them
+
+        : return: number of templates written
+    '''
+    from FeatureMatcher import FeatureMatcher
+    registry = TemplateRegistry(max_runtime=len(paths) + 1)
+    matchers = dict((backend, FeatureMatcher(backend, registry=registry)) for backend in features)
+    base = os.path.dirname(os.path.abspath(out))
+    entries = []
+    blobs = []
+    offset = 0
+    for path in paths:
+        item = registry.template(path)
+        if item.color is None:
+            logging.warning('TemplateAtlas: can not read %s, skipped' % (path))
+            continue
+        arrays = {'color': item.color, 'gray': item.gray}
+        for level in range(1, levels + 1):
+            arrays['pyr_color_%d' % level] = item.pyramid(0, level)
+            arrays['pyr_gray_%d' % level] = item.pyramid(1, level)
+        for backend, matcher in matchers.items():
+            for gray in (0, 1):
+                kp, des, size = matcher.template_features(path, gray)
+                if des is None:
+                    continue
+                mode = 'gray' if gray else 'color'
+                arrays['kp_%s_%s' % (backend, mode)] = _keypoints_to_array(kp)
+                arrays['des_%s_%s' % (backend, mode)] = des
+        layout = {}
+        for name, arr in arrays.items():
+            arr = np.ascontiguousarray(arr)
+            layout[name] = [offset, list(arr.shape), arr.dtype.str]
+            blobs.append((offset, arr))
+            offset = _align(offset + arr.nbytes)
+        info = {}
+        if roi_index is not None:
+            box = roi_index.box(path)
+            if box is not None:
+                info['roi'] = list(box)
+        entries.append({'file': os.path.relpath(os.path.abspath(item.file), base).replace(os.sep, '/'),
+                        'mtime': item.mtime, 'meta': info, 'arrays': layout})
+    header = json.dumps({'version': 1, 'levels': levels, 'templates': entries}).encode('utf-8')
+    data_start = _align(len(MAGIC) + 8 + len(header))
+    tmp = out + '.tmp'
+    with open(tmp, 'wb') as f:
+        f.write(MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for start, arr in blobs:
+            f.seek(data_start + start)
+            f.write(arr.tobytes())
+        f.truncate(data_start + offset)
+    os.replace(tmp, out)
+    return len(entries)
+
+
+class TemplateAtlas():
+    def __init__(self, path='./templates.atlas'):
+        '''
+        Read only view of a compiled atlas, every array is a zero copy view into the mapped file,
+        so processes loading the same atlas share its memory through the page cache
+
+            : param path = './templates.atlas': atlas file
+        '''
+        self.path = path
+        self.base = os.path.dirname(os.path.abspath(path))
+        with open(path, 'rb') as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError('%s is not a template atlas' % (path))
+            size = struct.unpack('<Q', f.read(8))[0]
+            self.header = json.loads(f.read(size).decode('utf-8'))
+        self.data_start = _align(len(MAGIC) + 8 + size)
+        self.buffer = np.memmap(path, dtype=np.uint8, mode='r')
+        self.levels = self.header['levels']
+        self.entries = self.header['templates']
+
+    def array(self, layout):
+        offset, shape, dtype = layout
+        return np.ndarray(shape, dtype=np.dtype(dtype), buffer=self.buffer, offset=self.data_start + offset)
+
+    def templates(self):
+        '''
+        : return: generator of (Template, metadata) built on views of the atlas
+        '''
+        for entry in self.entries:
+            arrays = entry['arrays']
+            pyramid = {}
+            features = {}
+            for name, layout in arrays.items():
+                if name.startswith('pyr_'):
+                    mode, level = name[4:].rsplit('_', 1)
+                    pyramid[(mode == 'gray', int(level))] = self.array(layout)
+                elif name.startswith('kp_'):
+                    backend, mode = name[3:].rsplit('_', 1)
+                    des = self.array(arrays['des_%s_%s' % (backend, mode)])
+                    color = self.array(arrays['color'])
+                    features[(backend, mode == 'gray')] = (_array_to_keypoints(self.array(layout)), des,
+                                                          (color.shape[1], color.shape[0]))
+            path = os.path.join(self.base, entry['file'])
+            item = Template.from_arrays(path, entry['mtime'], self.array(arrays['color']),
+                                        self.array(arrays['gray']), pyramid, features)
+            yield item, entry['meta']
+
+
+def load_atlas(path='./templates.atlas', registry=None, roi_index=None):
+    '''
+    Load an atlas into the registry, templates of the atlas are then never decoded from disk
+    unless their file changed
+
+        : param path = './templates.atlas': atlas file
+
+        : param registry = None: registry to fill, the shared one if empty
+
+        : param roi_index = None: RoiIndex to seed with the stored regions of the templates it does not know yet
+
+        : return: dict template path -> metadata, None if there is no atlas
+    '''
+    if not os.path.exists(path):
+        return None
+    if registry is None:
+        registry = get_registry()
+    try:
+        atlas = TemplateAtlas(path)
+    except (ValueError, OSError):
+        logging.warning('TemplateAtlas: can not read %s, templates will be decoded' % (path))
+        return None
+    meta = {}
+    for item, info in atlas.templates():
+        registry.add(item)
+        meta[item.path] = info
+        if roi_index is not None and info.get('roi') is not None:
+            roi_index.seed(item.path, info['roi'])
+    return meta
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compile the screenshots into a template atlas')
+    parser.add_argument('folders', nargs='*', default=['./screenshots'])
+    parser.add_argument('--out', default='./templates.atlas')
+    parser.add_argument('--levels', type=int, default=2)
+    parser.add_argument('--features', default='sift', help="comma separated backends, '' for none")
+    args = parser.parse_args()
+    from RoiIndex import get_roi_index
+    features = tuple(item for item in args.features.split(',') if item)
+    count = build(find_templates(args.folders), args.out, args.levels, features, roi_index=get_roi_index())
+    print('%d templates written to %s' % (count, args.out))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,223 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+import cv2
+
+
+def resolve_path(path):
+    '''
+    Resolve a template path, tolerating .png/.PNG style case mismatches
+
+        : param path: path of the template file
+
+        : return: the existing path on disk, or the original path if nothing matches
+    '''
+    if os.path.exists(path):
+        return path
+    folder, name = os.path.split(path)
+    try:
+        for item in os.listdir(folder or '.'):
+            if item.lower() == name.lower():
+                return os.path.join(folder, item)
+    except OSError:
+        pass
+    return path
+
+
+def template_key(path):
+    # Case insensitive, the screenshots mix .png and .PNG
+    return os.path.normcase(os.path.abspath(path)).lower()
+
+
+class Template():
+    def __init__(self, path, load=True):
+        '''
+        A decoded template kept in memory
+
+            : param path: path of the template file
+
+            : param load = True: decode the file now
+        '''
+        self.path = path
+        self.file = resolve_path(path)
+        self.mtime = None
+        self.color = None
+        self.gray = None
+        self.checked = 0
+        self._pyramid = {}
+        # Keypoints and descriptors, filled by FeatureMatcher
+        self.features = {}
+        if load:
+            self.load()
+
+    @classmethod
+    def from_arrays(cls, path, mtime, color, gray, pyramid=None, features=None):
+        '''
+        Template built from already decoded arrays, e.g. views into a TemplateAtlas
+
+            : param mtime: mtime of the file the arrays were built from, a different mtime reloads from disk
+        '''
+        item = cls(path, load=False)
+        item.mtime = mtime
+        item.color = color
+        item.gray = gray
+        item._pyramid = pyramid or {}
+        item.features = features or {}
+        return item
+
+    def load(self):
+        '''
+        Decode the file from disk, color and grayscale versions are both kept
+        '''
+        self._pyramid = {}
+        self.features = {}
+        try:
+            self.mtime = os.path.getmtime(self.file)
+        except OSError:
+            self.mtime = None
+            self.color = None
+            self.gray = None
+            return
+        self.color = cv2.imread(self.file, cv2.IMREAD_COLOR)
+        if self.color is not None:
+            self.gray = cv2.cvtColor(self.color, cv2.COLOR_BGR2GRAY)
+        else:
+            self.gray = None
+
+    def changed(self):
+        try:
+            return os.path.getmtime(self.file) != self.mtime
+        except OSError:
+            return self.mtime is not None
+
+    def image(self, gray=0):
+        '''
+        : param gray = 0: 0: return color template, others: return grayscale template
+        '''
+        if gray == 0:
+            return self.color
+        return self.gray
+
+    def pyramid(self, gray=0, level=1):
+        '''
+        Downscaled template for coarse matching, computed once per load
+
+            : param gray = 0: 0: color template, others: grayscale template
+
+            : param level = 1: number of pyrDown steps, every step halves the size
+
+            : return: numpy image, None if the file can not be read
+        '''
+        if level == 0:
+            return self.image(gray)
+        key = (gray != 0, level)
+        img = self._pyramid.get(key)
+        if img is None:
+            previous = self.pyramid(gray, level - 1)
+            if previous is None:
+                return None
+            img = cv2.pyrDown(previous)
+            self._pyramid[key] = img
+        return img
+
+
+class TemplateRegistry():
+    def __init__(self, max_runtime=64, check_interval=1.0):
+        '''
+        Registry of decoded templates, so find_img does not read the disk on every call
+
+            : param max_runtime = 64: size of the LRU holding templates that were not preloaded
+
+            : param check_interval = 1.0: seconds between two mtime checks of the same template
+        '''
+        self._lock = threading.RLock()
+        self._preloaded = {}
+        self._runtime = OrderedDict()
+        self.max_runtime = max_runtime
+        self.check_interval = check_interval
+
+    def preload(self, paths, levels=0):
+        '''
+        Load templates once at startup, they are never evicted
+
+            : param paths: iterable of template paths
+
+            : param levels = 0: pyramid levels to precompute for every template
+        '''
+        with self._lock:
+            for path in paths:
+                key = template_key(path)
+                if key not in self._preloaded:
+                    self._runtime.pop(key, None)
+                    self._preloaded[key] = Template(path)
+                for gray in (0, 1):
+                    self._preloaded[key].pyramid(gray, levels)
+
+    def add(self, item):
+        '''
+        Add an already built Template to the preloaded ones
+        '''
+        key = template_key(item.path)
+        with self._lock:
+            self._runtime.pop(key, None)
+            self._preloaded[key] = item
+
+    def template(self, path):
+        '''
+        Get the Template object of a path, loading it into the runtime LRU if needed
+
+            : param path: path of the template file
+
+            : return: Template object
+        '''
+        key = template_key(path)
+        with self._lock:
+            item = self._preloaded.get(key)
+            if item is None:
+                item = self._runtime.get(key)
+                if item is None:
+                    item = Template(path)
+                    self._runtime[key] = item
+                    while len(self._runtime) > self.max_runtime:
+                        self._runtime.popitem(last=False)
+                    item.checked = time.time()
+                    return item
+                self._runtime.move_to_end(key)
+            now = time.time()
+            if now - item.checked >= self.check_interval:
+                item.checked = now
+                if item.changed():
+                    item.load()
+            return item
+
+    def get(self, path, gray=0):
+        '''
+        Get a decoded template
+
+            : param path: path of the template file
+
+            : param gray = 0: 0: return color template, others: return grayscale template
+
+            : return: numpy image, None if the file can not be read
+        '''
+        return self.template(path).image(gray)
+
+    def __contains__(self, path):
+        key = template_key(path)
+        with self._lock:
+            return key in self._preloaded or key in self._runtime
+
+    def __len__(self):
+        with self._lock:
+            return len(self._preloaded) + len(self._runtime)
+
+
+_registry = TemplateRegistry()
+
+
+def get_registry():
+    '''
+    Registry shared by every GameControl of the process
+    '''
+    return _registry
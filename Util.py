@@ -1,27 +1,28 @@
 import sys
+import threading
 import time
-import winsound
-import inspect
-import ctypes
+try:
+    import winsound
+except ImportError:
+    # Windows only, the beeps are skipped elsewhere
+    winsound = None
+try:
+    import pyautogui
+except ImportError:
+    # No desktop, e.g. replay runs on Linux: the alerts are printed
+    pyautogui = None
 
 
 
-def _asyncRaise(threadId, exctype):
-    threadId = ctypes.c_long(threadId)
-    if not inspect.isclass(exctype):
-        exctype = type(exctype)
-    res = ctypes.pythonapi.PyThreadState_SetAsyncExc(threadId, ctypes.py_object(exctype))
-    if res == 0:
-        raise ValueError("invalid thread id")
-    elif res != 1:
-        # """if it returns a number greater than one, you're in trouble,
-        # and you should call it again with exc=NULL to revert the effect"""
-        ctypes.pythonapi.PyThreadState_SetAsyncExc(threadId, None)
-        raise SystemError("PyThreadState_SetAsyncExc failed")
-
-def stopThread(thread):
-    if thread.isAlive():
-        _asyncRaise(thread.ident, SystemExit)
+def beep(frequency, duration, wait=True):
+    if winsound is None:
+        return
+    if wait:
+        winsound.Beep(frequency, duration)
+    else:
+        thread = threading.Thread(None, winsound.Beep, 'beep', (frequency, duration))
+        thread.daemon = True
+        thread.start()
 
 def getTimeFormatted():
     return time.strftime("[%Y-%m-%d %H:%M:%S]",time.localtime())
@@ -31,4 +32,10 @@ def printWithTime(*objects, sep=' ', end='\n', file=sys.stdout, flush=False):
     print(*objects, sep=' ', end='\n', file=sys.stdout, flush=False)
 
 def inputWithTimePrompt(prompt):
-    return input(getTimeFormatted()+":"+prompt)
\ No newline at end of file
+    return input(getTimeFormatted()+":"+prompt)
+
+def alert(text, title):
+    if pyautogui is not None:
+        pyautogui.alert(text=text, title=title, button='OK')
+    else:
+        printWithTime(title+": "+text)
@@ -0,0 +1,181 @@
+import asyncio
+import time
+from AsyncEngine import run_step
+from CaptureBackend import CaptureThread
+from Matcher import MatchRequest
+
+
+class ColorTarget():
+    def __init__(self, region, color, tolerance=0, name=None):
+        '''
+        A color to wait for
+
+            : param region: ((x1, y1), (x2, y2)) the area to search
+
+            : param color: (r, g, b) the color to search
+
+            : param tolerance = 0: tolerance value
+
+            : param name = None: key of the result, 'color' + color if empty
+        '''
+        self.region = region
+        self.color = color
+        self.tolerance = tolerance
+        self.name = name if name is not None else 'color%s' % (str(tuple(color)))
+
+
+class PredicateTarget():
+    def __init__(self, predicate, name):
+        '''
+        Any other condition
+
+            : param predicate: callable(frame), returns a position or True when satisfied, False or None otherwise
+
+            : param name: key of the result
+        '''
+        self.predicate = predicate
+        self.name = name
+
+
+class WaitResult():
+    def __init__(self, name=None, position=None, frame=None, elapsed=0, timed_out=False, cancelled=False):
+        '''
+        Outcome of a wait, true when a target was satisfied
+
+            : param name: name of the satisfied target, None on timeout
+
+            : param position: position of the target, True for targets without one
+        '''
+        self.name = name
+        self.position = position
+        self.frame = frame
+        self.elapsed = elapsed
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+
+    @property
+    def found(self):
+        return self.name is not None
+
+    def __bool__(self):
+        return self.found
+
+    def __repr__(self):
+        if self.found:
+            return 'WaitResult(%s, position=%s, elapsed=%.2f)' % (self.name, str(self.position), self.elapsed)
+        return 'WaitResult(timed_out=%s, cancelled=%s, elapsed=%.2f)' % (self.timed_out, self.cancelled, self.elapsed)
+
+
+class Waiter():
+    def __init__(self, gui, interval=0.05):
+        '''
+        Wait for the first of several targets, checked on every new frame
+
+            : param gui: GameControl of the window
+
+            : param interval = 0.05: seconds between two captures without a capture thread
+        '''
+        self.gui = gui
+        self.interval = interval
+
+    def _next_frame(self, last_id, remaining, interval):
+        capture = self.gui.capture
+        if isinstance(capture, CaptureThread) and capture.frames:
+            # Sleep until the capture thread has something newer instead of polling, a slower cadence still
+            # checks once per interval
+            if interval > self.interval:
+                time.sleep(min(interval, remaining))
+            capture.wait_newer(last_id, min(remaining, 1.0))
+            return self.gui.new_frame()
+        return self.gui.new_frame(min(interval, remaining))
+
+    def check(self, targets, frame):
+        '''
+        : return: (name, position) of the first satisfied target in order, None if there is none
+        '''
+        requests = [target for target in targets if isinstance(target, MatchRequest)]
+        matches = self.gui.find_batch(requests, frame) if requests else None
+        for target in targets:
+            if isinstance(target, MatchRequest):
+                result = matches[target.name]
+                if result.found:
+                    return target.name, result.position()
+            elif isinstance(target, ColorTarget):
+                pos = self.gui.find_color(target.region, target.color, target.tolerance, frame=frame)
+                if pos != -1:
+                    return target.name, pos
+            else:
+                pos = target.predicate(frame)
+                if pos is not None and pos is not False:
+                    return target.name, pos
+        return None
+
+    def wait_any(self, targets, timeout=100, cancel=None, interval=None):
+        '''
+        Wait until one of the targets is on screen
+
+            : param targets: list of MatchRequest, ColorTarget and PredicateTarget, earlier ones win ties
+
+            : param timeout = 100: seconds before giving up
+
+            : param cancel = None: threading.Event ending the wait early
+
+            : param interval = None: seconds between two checks, the interval of the waiter if empty
+
+            : return: WaitResult, false on timeout or cancel
+        '''
+        if interval is None:
+            interval = self.interval
+        start = time.time()
+        last_id = 0
+        first = True
+        while True:
+            elapsed = time.time() - start
+            if (cancel is not None and cancel.is_set()) or not self.gui.run:
+                return WaitResult(elapsed=elapsed, cancelled=True)
+            if elapsed > timeout:
+                return WaitResult(elapsed=elapsed, timed_out=True)
+            if first:
+                # The first check runs on the snapshot taken now, the target may already be on screen
+                first = False
+                frame = self.gui.new_frame()
+            else:
+                frame = self._next_frame(last_id, timeout - elapsed, interval)
+            if frame is None:
+                continue
+            if frame.id is not None:
+                last_id = frame.id
+            hit = self.check(targets, frame)
+            if hit is not None:
+                return WaitResult(hit[0], hit[1], frame, time.time() - start)
+
+    def _poll(self, targets, last_id):
+        '''
+        One capture and check for wait_any_async, a frame already checked is not checked again
+
+            : return: (frame, hit), hit like check
+        '''
+        frame = self.gui.new_frame()
+        if frame is None or (frame.id is not None and frame.id == last_id):
+            return frame, None
+        return frame, self.check(targets, frame)
+
+    async def wait_any_async(self, targets, timeout=100, executor=None):
+        '''
+        wait_any for coroutines, only the captures and checks run in executor, the task waits between them
+        on the event loop so a long wait does not hold an executor thread, stops when the task is cancelled
+        '''
+        start = time.time()
+        last_id = None
+        while True:
+            elapsed = time.time() - start
+            if not self.gui.run:
+                return WaitResult(elapsed=elapsed, cancelled=True)
+            if elapsed > timeout:
+                return WaitResult(elapsed=elapsed, timed_out=True)
+            frame, hit = await run_step(executor, self._poll, targets, last_id, stop=self.gui.stop)
+            if hit is not None:
+                return WaitResult(hit[0], hit[1], frame, time.time() - start)
+            if frame is not None and frame.id is not None:
+                last_id = frame.id
+            await asyncio.sleep(min(self.interval, max(0, timeout - elapsed)))
@@ -5,17 +5,22 @@ Version:1.0.0
 Powered By KoyominZ
 '''
 
-from Processing import *
+from Orchestrator import *
+from Supervisor import Supervisor
 import pyautogui
+import sys
 
-accounts=[]
-
-def main():
+def promptAccounts():
     alert="Warning: Please be sure to run with Administrator!\n\n"
-    accountCount=int(pyautogui.prompt(text=alert+'Enter number of account: ', title='Onmyoji bot' , default='1'))
-    while accountCount:
-        accountCount-=1
-        name_acc='Account '+str(accountCount)+'\n\n'
+    windows=find_windows()
+    if windows:
+        windowList=''.join('\n%d. %s (%s)'%(i+1,title,str(hwnd)) for i,(hwnd,title) in enumerate(windows))
+    else:
+        windowList='\n1. Onmyoji \n2. [#] Onmyoji [#] '
+    configs=[]
+    accountCount=int(pyautogui.prompt(text=alert+'Enter number of account: ', title='Onmyoji bot' , default=str(max(1,len(windows)))))
+    for accountId in range(accountCount):
+        name_acc='Account '+str(accountId)+'\n\n'
         gameMode="Game Type:\n1. Multi-player Soul/Evolution\
              \n2. Exploration \
                 \n3. Single Exploration \
@@ -25,33 +30,48 @@ def main():
         gameMode=int(pyautogui.prompt(text=alert+name_acc+gameMode, title='Onmyoji bot' , default='2'))
         isCaptain=True
         isMainDMG=True
-        windowName=int(pyautogui.prompt(text=alert+name_acc+'Enter name of window game: \n1. Onmyoji \n2. [#] Onmyoji [#] ', title='Onmyoji bot' , default='1'))
-        if windowName==1:
-            windowName='Onmyoji'
+        windowIndex=int(pyautogui.prompt(text=alert+name_acc+'Enter window game: '+windowList, title='Onmyoji bot' , default=str(min(accountId,max(0,len(windows)-1))+1)))
+        if windows:
+            hwnd,windowName=windows[windowIndex-1]
         else:
-            windowName='[#] Onmyoji [#]'
+            hwnd=None
+            windowName='Onmyoji' if windowIndex==1 else '[#] Onmyoji [#]'
         count=int(pyautogui.prompt(text=alert+name_acc+'Enter number of round: ', title='Onmyoji bot' , default='9999'))
         if gameMode == 2 or gameMode == 1:
             isCaptainChar=pyautogui.prompt(text=alert+name_acc+'Whether it is a leader(Y/N): ', title='Onmyoji bot' , default='Y')
             isMainDMGChar=pyautogui.prompt(text=alert+name_acc+'Whether it is a main dmg dealer(Y/N): ', title='Onmyoji bot' , default='Y')
-            if isCaptainChar=='y' or isCaptainChar=="Y":
-                isCaptain=True
-            else:
-                isCaptain=False
-            if isMainDMGChar=='y' or isMainDMGChar=="Y":
-                isMainDMG=True
-            else:
-                isMainDMG=False
-        
-        accounts.append(Processing(windowName,gameMode,count,isCaptain,isMainDMG))
-    
-    if len(accounts) == 2:
-        accounts.append(Processing('[#] Onmyoji [#]',2,9999,False,True))
-        account1=threading.Thread(accounts[0].run())
-        account2=threading.Thread(accounts[1].run())
+            isCaptain=isCaptainChar=='y' or isCaptainChar=="Y"
+            isMainDMG=isMainDMGChar=='y' or isMainDMGChar=="Y"
+
+        configs.append(AccountConfig(windowName,gameMode,count,isCaptain,isMainDMG,hwnd=hwnd))
+    return configs
+
+def main():
+    #accounts.json skips the prompts, see README
+    configs=load_config(CONFIG_PATH) or promptAccounts()
+    #--processes: one process per account instead of one thread, for many accounts
+    if '--processes' in sys.argv:
+        orchestrator=Supervisor(assign_windows(configs))
+    elif '--async' in sys.argv:
+        runAsync(assign_windows(configs))
+        return
     else:
-        account1=threading.Thread(accounts[0].run())
-    
+        orchestrator=Orchestrator(assign_windows(configs))
+    orchestrator.start_all()
+    orchestrator.join()
+
+def runAsync(configs):
+    #--async: the accounts are coroutines of one event loop
+    from AsyncEngine import AsyncEngine
+    from AsyncProcessing import AsyncProcessing, watchPause
+    engine=AsyncEngine()
+    for config in configs:
+        account=AsyncProcessing(config.window,config.mode,config.rounds,engine,config.captain,config.main_dmg,capture=config.capture(),stage=config.stage,hwnd=config.hwnd,adbSerial=config.adb_serial,adbPath=config.adb_path)
+        engine.add(account.name,account.run,stop=account.stop)
+    watchPause(engine)
+    engine.join()
 
 
-main()
\ No newline at end of file
+#the account processes import this file again
+if __name__=='__main__':
+    main()
@@ -0,0 +1,84 @@
+'''
+Stand-in for adb [-s serial] with the commands the bot runs:
+
+shell: runs no command, logs the inputs to $FAKE_ADB_LOG and echoes like sh,
+$FAKE_ADB_DELAY seconds are spent on every input, like a slow device
+
+exec-out screencap, and 'screencap' lines sent to exec-out sh: write the recorded raw screencaps
+$FAKE_ADB_FRAMES/<n>.raw (header and pixels) in turn, the last one forever. The number of screencaps
+served so far is kept in $FAKE_ADB_FRAMES/count, a screencap listed in $FAKE_ADB_STALL (e.g. '1,3')
+never comes, one listed in $FAKE_ADB_EOF is cut in the middle of its pixels and the session ends
+'''
+import os
+import sys
+import time
+
+
+def shell(delay):
+    log = open(os.environ['FAKE_ADB_LOG'], 'a')
+    for line in sys.stdin:
+        command = line.strip()
+        if command == 'exit':
+            break
+        if command.startswith('echo '):
+            sys.stdout.write(command[len('echo '):] + '\n')
+            sys.stdout.flush()
+        elif command.startswith('input '):
+            time.sleep(delay)
+            log.write(command + '\n')
+            log.flush()
+    log.close()
+    return 0
+
+
+def indexes(name):
+    return [int(item) for item in os.environ.get(name, '').split(',') if item]
+
+
+def screencap(out):
+    '''
+    Write the next recorded screencap
+
+        : return: False if the session has to end
+    '''
+    folder = os.environ['FAKE_ADB_FRAMES']
+    counter = os.path.join(folder, 'count')
+    index = int(open(counter).read()) if os.path.exists(counter) else 0
+    with open(counter, 'w') as f:
+        f.write(str(index + 1))
+    count = len([name for name in os.listdir(folder) if name.endswith('.raw')])
+    data = open(os.path.join(folder, '%d.raw' % (min(index, count - 1))), 'rb').read()
+    if index in indexes('FAKE_ADB_STALL'):
+        time.sleep(60)
+    if index in indexes('FAKE_ADB_EOF'):
+        out.write(data[:len(data) // 2])
+        out.flush()
+        return False
+    out.write(data)
+    out.flush()
+    return True
+
+
+def main(args):
+    if args[:1] == ['-s']:
+        args = args[2:]
+    if args == ['shell']:
+        return shell(float(os.environ.get('FAKE_ADB_DELAY', '0')))
+    out = sys.stdout.buffer
+    if args == ['exec-out', 'screencap']:
+        screencap(out)
+        return 0
+    if args == ['exec-out', 'sh']:
+        for line in sys.stdin:
+            command = line.strip()
+            if command == 'exit':
+                break
+            if command == 'screencap' and not screencap(out):
+                break
+        return 0
+    sys.stderr.write('fake_adb: %s is not supported\n' % (' '.join(args)))
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
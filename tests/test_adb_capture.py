@@ -0,0 +1,110 @@
+import os
+import struct
+import sys
+import time
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import AdbCapture
+
+FAKE_ADB = os.path.join(ROOT, 'tests', 'fake_adb.py')
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason='the fake adb is started through a shell script')
+
+
+def rgba(height, width, seed):
+    return np.random.RandomState(seed).randint(0, 255, (height, width, 4)).astype(np.uint8)
+
+
+@pytest.fixture
+def adb(tmp_path, monkeypatch):
+    '''
+    Path of an adb executable running fake_adb.py, and a function recording the screencaps it serves
+    '''
+    folder = tmp_path / 'frames'
+    folder.mkdir()
+    monkeypatch.setenv('FAKE_ADB_FRAMES', str(folder))
+    script = tmp_path / 'adb'
+    script.write_text('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, FAKE_ADB))
+    script.chmod(0o755)
+
+    def record(*pixels, header=16):
+        for index, item in enumerate(pixels):
+            height, width = item.shape[:2]
+            # Android 9 and later add a color space field to the header
+            fields = (width, height, 1, 1) if header == 16 else (width, height, 1)
+            data = struct.pack('<%dI' % (len(fields)), *fields) + item.tobytes()
+            (folder / ('%d.raw' % (index))).write_bytes(data)
+    return str(script), record
+
+
+def bgra(pixels):
+    return pixels[:, :, [2, 1, 0, 3]]
+
+
+@pytest.mark.parametrize('header', [12, 16])
+def test_header_and_pixels(adb, header):
+    path, record = adb
+    frames = [rgba(6, 8, 0), rgba(6, 8, 1)]
+    record(*frames, header=header)
+    capture = AdbCapture(adb=path)
+    try:
+        # The first capture probes the header size, the next ones stream
+        assert (capture.capture().bgra == bgra(frames[0])).all()
+        assert capture._header_size == header
+        assert (capture.capture().bgra == bgra(frames[1])).all()
+        assert capture._process is not None
+    finally:
+        capture.close()
+
+
+def test_shape_change(adb):
+    path, record = adb
+    frames = [rgba(6, 8, 0), rgba(6, 8, 1), rgba(8, 6, 2), rgba(8, 6, 3)]
+    record(*frames)
+    capture = AdbCapture(adb=path)
+    try:
+        shapes = []
+        for item in frames:
+            frame = capture.capture()
+            assert (frame.bgra == bgra(item)).all()
+            shapes.append(frame.bgra.shape)
+        assert shapes == [(6, 8, 4), (6, 8, 4), (8, 6, 4), (8, 6, 4)]
+    finally:
+        capture.close()
+
+
+def test_stalled_screencap_is_given_up(adb, monkeypatch):
+    path, record = adb
+    frames = [rgba(6, 8, 0), rgba(6, 8, 1), rgba(6, 8, 2)]
+    record(*frames)
+    monkeypatch.setenv('FAKE_ADB_STALL', '1')
+    capture = AdbCapture(adb=path, timeout=0.5)
+    try:
+        assert capture.capture() is not None
+        start = time.time()
+        assert capture.capture() is None
+        assert time.time() - start < 3
+        # A new session is opened on the next capture
+        assert (capture.capture().bgra == bgra(frames[2])).all()
+    finally:
+        capture.close()
+
+
+def test_session_ended_in_a_screencap(adb, monkeypatch):
+    path, record = adb
+    frames = [rgba(6, 8, 0), rgba(6, 8, 1), rgba(6, 8, 2)]
+    record(*frames)
+    monkeypatch.setenv('FAKE_ADB_EOF', '1')
+    capture = AdbCapture(adb=path)
+    try:
+        assert capture.capture() is not None
+        assert capture.capture() is None
+        assert (capture.capture().bgra == bgra(frames[2])).all()
+    finally:
+        capture.close()
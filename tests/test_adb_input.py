@@ -0,0 +1,69 @@
+import os
+import sys
+import time
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from AdbInput import AdbShell
+
+FAKE_ADB = os.path.join(ROOT, 'tests', 'fake_adb.py')
+
+pytestmark = pytest.mark.skipif(os.name == 'nt', reason='the fake adb is started through a shell script')
+
+
+@pytest.fixture
+def adb(tmp_path, monkeypatch):
+    '''
+    Path of an adb executable running fake_adb.py, and the file the inputs are logged to
+    '''
+    log = tmp_path / 'inputs.log'
+    log.write_text('')
+    monkeypatch.setenv('FAKE_ADB_LOG', str(log))
+    script = tmp_path / 'adb'
+    script.write_text('#!/bin/sh\nexec "%s" "%s" "$@"\n' % (sys.executable, FAKE_ADB))
+    script.chmod(0o755)
+    return str(script), log
+
+
+def test_tap_returns_once_played(adb, monkeypatch):
+    path, log = adb
+    monkeypatch.setenv('FAKE_ADB_DELAY', '0.3')
+    shell = AdbShell('emulator-5554', path)
+    try:
+        start = time.time()
+        assert shell.tap(10, 20) is True
+        assert time.time() - start >= 0.3
+        assert log.read_text().splitlines() == ['input tap 10 20']
+    finally:
+        shell.close()
+
+
+def test_batch_is_played_in_order(adb):
+    path, log = adb
+    shell = AdbShell(None, path)
+    try:
+        with shell.batch():
+            assert shell.tap(1, 2) is True
+            shell.swipe(3, 4, 5, 6, 200)
+            assert log.read_text() == ''
+        assert log.read_text().splitlines() == ['input tap 1 2', 'input swipe 3 4 5 6 200']
+    finally:
+        shell.close()
+
+
+def test_timeout_and_restart(adb, monkeypatch):
+    path, log = adb
+    monkeypatch.setenv('FAKE_ADB_DELAY', '1')
+    shell = AdbShell(None, path, timeout=0.2)
+    try:
+        assert shell.tap(1, 1) is False
+        # A dead session is opened again on the next input
+        shell._process.kill()
+        shell._process.wait()
+        shell.timeout = 5
+        assert shell.tap(2, 2) is True
+        assert 'input tap 2 2' in log.read_text().splitlines()
+    finally:
+        shell.close()
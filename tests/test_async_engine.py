@@ -0,0 +1,57 @@
+import os
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from AsyncEngine import AsyncEngine, AsyncGame
+
+
+class SlowGui():
+    def __init__(self):
+        '''
+        new_frame blocks until stop() or 5s, close() records whether a capture was still running
+        '''
+        self.run = True
+        self.stopped = threading.Event()
+        self.capturing = False
+        self.closed_while_capturing = None
+
+    def new_frame(self, delay=0):
+        self.capturing = True
+        self.stopped.wait(5)
+        self.capturing = False
+
+    def stop(self):
+        self.run = False
+        self.stopped.set()
+
+    def close(self):
+        self.closed_while_capturing = self.capturing
+
+
+def test_stop_account_ends_the_running_step_before_closing():
+    engine = AsyncEngine(2)
+    gui = SlowGui()
+    game = AsyncGame(gui, engine, 'account')
+
+    async def run():
+        try:
+            while True:
+                await game.frame()
+        finally:
+            gui.close()
+
+    engine.add('account', run, stop=gui.stop)
+    try:
+        time.sleep(0.2)
+        assert gui.capturing
+        start = time.time()
+        assert engine.stop_account('account', timeout=3)
+        assert time.time() - start < 1
+        assert gui.closed_while_capturing is False
+        assert engine.status()['account'] == 'cancelled'
+    finally:
+        engine.stop()
@@ -0,0 +1,77 @@
+import os
+import sys
+import threading
+import time
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import CaptureBackend, CaptureThread
+from Frame import Frame, FramePool
+
+
+class CountingCapture(CaptureBackend):
+    def __init__(self):
+        '''
+        Pooled frames filled with the number of the capture
+        '''
+        self.pool = FramePool(1)
+        self.captures = 0
+
+    def capture(self):
+        self.captures += 1
+        buffers = self.pool.acquire(4, 6)
+        buffers.bgra[:] = self.captures
+        return Frame(buffers.bgra, buffers=buffers)
+
+
+def test_capture_part_is_not_overwritten_by_the_next_capture():
+    backend = CountingCapture()
+    part = backend.capture_part((1, 1), (3, 3))
+    backend.capture()
+    assert (part == 1).all()
+
+
+class DyingCapture(CountingCapture):
+    def capture(self):
+        '''
+        The capture thread dies on its second capture, direct captures work
+        '''
+        if threading.current_thread().name == 'CaptureThread' and self.captures == 1:
+            raise SystemExit
+        return CountingCapture.capture(self)
+
+
+def test_capture_after_a_stopped_thread():
+    thread = CaptureThread(CountingCapture(), fps=20)
+    thread.start()
+    try:
+        assert thread.capture_after(0) is not None
+        # Stopped while waiting for a frame that will never come
+        threading.Timer(0.2, thread.stop).start()
+        start = time.time()
+        assert thread.capture_after(time.time() + 10, timeout=2) is not None
+        assert time.time() - start < 1
+    finally:
+        thread.close()
+
+
+def test_capture_after_a_dead_thread():
+    thread = CaptureThread(DyingCapture(), fps=20)
+    thread.start()
+    try:
+        assert thread.capture_after(0) is not None
+        start = time.time()
+        frame = thread.capture_after(time.time(), timeout=2)
+        assert frame is not None and not thread.alive()
+        assert time.time() - start < 1
+        # A dead thread can be started again
+        thread.start()
+        assert thread.alive()
+        assert thread.wait_newer(0, timeout=1) is not None
+    finally:
+        thread.close()
@@ -0,0 +1,122 @@
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import CaptureBackend
+from ChangeDetector import ChangeDetector
+from Frame import Frame
+from GameControl import GameControl
+
+HEIGHT, WIDTH = 64, 96
+
+
+def picture(level=100, block=None):
+    '''
+    Flat BGRA picture, block = (x, y, level) paints the 8 x 8 block at (x, y), one thumbnail pixel
+    '''
+    bgra = np.full((HEIGHT, WIDTH, 4), level, np.uint8)
+    if block is not None:
+        x, y, value = block
+        bgra[y:y + 8, x:x + 8, :3] = value
+    return bgra
+
+
+class ListCapture(CaptureBackend):
+    def __init__(self, pictures):
+        '''
+        Serve pictures in order, then keep serving the last one
+        '''
+        self.pictures = list(pictures)
+        self.index = -1
+
+    def capture(self):
+        self.index = min(self.index + 1, len(self.pictures) - 1)
+        return Frame(self.pictures[self.index].copy())
+
+
+def control(pictures):
+    gui = GameControl(0, 0, ListCapture(pictures))
+    gui.dry_run = True
+    gui.popups = None
+    return gui
+
+
+def test_changed_outside_ignored_regions():
+    detector = ChangeDetector()
+    still = Frame(picture())
+    assert not detector.changed(still, Frame(picture()))
+    # One thumbnail pixel over the threshold is enough
+    assert detector.changed(still, Frame(picture(block=(40, 16, 150))))
+    assert not detector.changed(still, Frame(picture(block=(40, 16, 110))))
+    detector.ignore_region('animation', (32, 8), (56, 32))
+    assert not detector.changed(still, Frame(picture(block=(40, 16, 150))))
+    assert detector.changed(still, Frame(picture(block=(0, 48, 150))))
+    # Frames of another size or a missing frame can not be compared
+    assert detector.changed(still, Frame(np.full((32, 48, 4), 100, np.uint8)))
+    assert detector.changed(None, still)
+
+
+def test_changed_regions():
+    detector = ChangeDetector()
+    detector.add_region('left', (0, 0), (48, 64))
+    detector.add_region('right', (48, 0), (96, 64))
+    changed = detector.changed_regions(Frame(picture()), Frame(picture(block=(64, 32, 150))))
+    assert changed == {'left': False, 'right': True}
+    assert detector.changed_regions(None, Frame(picture())) == {'left': True, 'right': True}
+
+
+def test_unchanged_frames_reuse_the_anchor_results():
+    gui = control([picture()] * 3 + [picture(block=(40, 16, 150))])
+    anchor = gui.new_frame()
+    anchor.results['button'] = (1, (10, 10))
+    for _ in range(2):
+        frame = gui.new_frame()
+        assert frame.changed is False and frame.results is anchor.results
+    assert gui.reused == 2 and gui.anchor_frame is anchor
+    changed = gui.new_frame()
+    assert changed.changed and changed.results == {}
+    assert gui.anchor_frame is changed and gui.reused == 0
+
+
+def test_slow_drift_is_compared_with_the_anchor():
+    # Every step stays under the pixel threshold, the sum of three steps does not
+    gui = control([picture(block=(40, 16, 100 + 5*step)) for step in range(4)])
+    anchor = gui.new_frame()
+    assert gui.new_frame().changed is False
+    assert gui.new_frame().changed is False
+    drifted = gui.new_frame()
+    assert drifted.changed and drifted.results is not anchor.results
+    assert gui.anchor_frame is drifted
+
+
+def test_max_reuse_takes_a_new_anchor():
+    gui = control([picture()])
+    gui.max_reuse = 2
+    anchor = gui.new_frame()
+    assert gui.new_frame().results is anchor.results
+    assert gui.new_frame().results is anchor.results
+    # Still the same picture, but its results are computed again
+    fresh = gui.new_frame()
+    assert fresh.changed is False and fresh.results is not anchor.results
+    assert gui.anchor_frame is fresh and gui.reused == 0
+    assert gui.new_frame().results is fresh.results
+
+
+def test_input_invalidates_the_frame():
+    gui = control([picture()])
+    anchor = gui.new_frame()
+    anchor.results['button'] = (1, (10, 10))
+    gui.mouse_click_bg((10, 10))
+    assert gui.inputs and gui.inputs[-1][1] == 'click'
+    assert gui.frame is None and gui.anchor_frame is None
+    assert gui.input_frame is anchor
+    # The screen did not move, the detections run again all the same
+    frame = gui.new_frame()
+    assert frame.results == {} and gui.anchor_frame is frame
+    assert gui.get_frame() is frame
@@ -0,0 +1,75 @@
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import ReplayCapture
+from GameControl import GameControl
+from Matcher import match_all
+
+# Top left corners of the repeated tiles, a 3 x 2 grid
+CORNERS = [(100, 100), (400, 100), (700, 100), (100, 400), (400, 400), (700, 400)]
+
+
+@pytest.fixture
+def tile():
+    return np.random.RandomState(3).randint(0, 255, (40, 60, 3)).astype(np.uint8)
+
+
+def screen(tile, corners):
+    '''
+    Noise screen showing tile at every corner
+    '''
+    img = np.random.RandomState(4).randint(0, 255, (640, 1136, 3)).astype(np.uint8)
+    height, width = tile.shape[:2]
+    for x, y in corners:
+        img[y:y + height, x:x + width] = tile
+    return img
+
+
+@pytest.fixture
+def gui(tile, tmp_path):
+    '''
+    GameControl replaying the screen with the tiles, the tile is saved as tile.png
+    '''
+    folder = tmp_path / 'frames'
+    folder.mkdir()
+    cv2.imwrite(str(folder / '0.png'), screen(tile, CORNERS))
+    cv2.imwrite(str(tmp_path / 'tile.png'), tile)
+    gui = GameControl(0, 0, ReplayCapture(str(folder), speed=0, loop=True))
+    gui.dry_run = True
+    return gui
+
+
+def test_every_instance_is_found(gui, tmp_path):
+    template = str(tmp_path / 'tile.png')
+    found = gui.find_all(template, gray=0, center=False, sort='position')
+    assert found == [list(corner) for corner in CORNERS]
+    centers = gui.find_all(template, gray=0, sort='position')
+    assert centers[0] == [130, 120]
+    assert len(gui.find_all(template, gray=0, max_results=2)) == 2
+
+
+def test_region_positions_are_window_coordinates(gui, tmp_path):
+    template = str(tmp_path / 'tile.png')
+    found = gui.find_all(template, part=1, pos1=(350, 50), pos2=(800, 200), gray=0, center=False, sort='position')
+    assert found == [[400, 100], [700, 100]]
+    # The same region as lists, the form the regions in Processing take
+    assert gui.find_all(template, part=1, pos1=[350, 50], pos2=[800, 200], gray=0, center=False, sort='position') == found
+    assert gui.find_all(template, part=1, pos1=(0, 300), pos2=(300, 600), gray=0) == [[130, 420]]
+
+
+def test_overlapping_instances_are_suppressed(tile):
+    # The second copy covers the right half of the first one, both are peaks of the response
+    img = screen(tile, [(100, 100), (130, 100)])
+    kept = match_all(img, tile, thread=0.4, overlap=0.3)
+    assert [loc for score, loc in kept] == [(130, 100)]
+    # One third of their union is shared, kept apart with a looser overlap
+    kept = match_all(img, tile, thread=0.4, overlap=0.5)
+    assert sorted(loc for score, loc in kept) == [(100, 100), (130, 100)]
+    assert kept[0][0] >= kept[1][0]
@@ -0,0 +1,131 @@
+import os
+import shutil
+import sys
+import time
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from AsyncEngine import AsyncEngine
+from Orchestrator import AccountConfig, Orchestrator
+import Pacing
+import RoiIndex
+import Supervisor as supervision
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    '''
+    Folder of two screens without anything to click, the accounts of the fleet play it in a loop
+    '''
+    # The template paths are relative to the working directory, the account processes start there too:
+    # a copy of the templates, so what the processes save (pacing.json, roi_index.json) stays in tmp_path
+    work = tmp_path / 'work'
+    shutil.copytree(os.path.join(ROOT, 'screenshots'), str(work / 'screenshots'))
+    monkeypatch.chdir(str(work))
+    # And so do the stats and regions of the accounts running in this process
+    monkeypatch.setattr(Pacing, '_stats', Pacing.PacingStats(path=None))
+    monkeypatch.setattr(RoiIndex, '_index', RoiIndex.RoiIndex(path=None))
+    folder = tmp_path / 'frames'
+    folder.mkdir()
+    rng = np.random.RandomState(6)
+    for name in ('a.png', 'b.png'):
+        cv2.imwrite(str(folder / name), rng.randint(0, 80, (640, 1136, 3)).astype(np.uint8))
+    return str(folder)
+
+
+def until(condition, timeout=30, interval=0.1):
+    end = time.time() + timeout
+    while time.time() < end:
+        if condition():
+            return True
+        time.sleep(interval)
+    return condition()
+
+
+def test_replay_accounts_need_no_window(replay):
+    config = AccountConfig(mode=1, replay=replay)
+    assert AccountConfig.from_dict(config.to_dict()).replay == replay
+    assert config.capture().loop
+    assert AccountConfig(mode=1).capture() is None
+
+
+def test_orchestrator_restart(replay):
+    orchestrator = Orchestrator([AccountConfig(mode=1, replay=replay), AccountConfig(mode=3, replay=replay)],
+                                start_interval=0)
+    orchestrator.start_all()
+    try:
+        assert [status['running'] for status in orchestrator.status()] == [True, True]
+        old = orchestrator.workers[0]
+        assert orchestrator.start(0) is old
+        new = orchestrator.restart(0)
+        assert new is not old and not old.is_alive() and old.stopped
+        assert old.gui.capture is not new.gui.capture
+        assert [status['running'] for status in orchestrator.status()] == [True, True]
+    finally:
+        orchestrator.stop_all()
+    assert [status['running'] for status in orchestrator.status()] == [False, False]
+    assert all(worker.stopped and worker.completed == 0 for worker in orchestrator.workers)
+
+
+def test_supervisor_exit_codes_and_restart(replay, tmp_path):
+    configs = [AccountConfig(mode=1, rounds=0, replay=replay),
+               AccountConfig(mode=1, replay=replay),
+               # Not a replay source, the account crashes as it starts
+               AccountConfig(mode=1, replay=str(tmp_path / 'missing'))]
+    supervisor = supervision.Supervisor(configs, backoff=0.5, report_interval=0.2, start_interval=0)
+    supervisor.start_all()
+    try:
+        finished, running, crashed = supervisor.slots
+        assert until(lambda: supervisor.status()[1]['state'] == supervision.STATE_RUNNING)
+        # Out of rounds: exit code 0 and finished, never restarted
+        assert until(lambda: finished.state == supervision.STATE_FINISHED)
+        assert finished.process.exitcode == 0
+        # Crashed: exit code 1, restarted after its delay
+        assert until(lambda: supervisor.status()[2]['restarts'] >= 1)
+        assert crashed.failures >= 1
+        first = running.process.pid
+        supervisor.restart(1)
+        assert running.process.pid != first
+        assert until(lambda: supervisor.status()[1]['state'] == supervision.STATE_RUNNING)
+        # Stopped on request: exit code 0 and stopped, never restarted
+        assert supervisor.stop(1)
+        assert running.process.exitcode == 0 and running.state == supervision.STATE_STOPPED
+        supervisor.poll()
+        assert running.next_start is None and finished.restarts == 0
+    finally:
+        supervisor.stop_all()
+    assert crashed.process.exitcode == 1
+    assert [status['state'] for status in supervisor.status()] == [supervision.STATE_FINISHED,
+                                                                    supervision.STATE_STOPPED,
+                                                                    supervision.STATE_STOPPED]
+
+
+def test_async_engine_stop_and_restart(replay):
+    from AsyncProcessing import AsyncProcessing
+    engine = AsyncEngine(2)
+    accounts = [AsyncProcessing('replay', mode, rounds, engine, capture=AccountConfig(replay=replay).capture())
+                for mode, rounds in ((1, 5), (4, 5), (3, 0))]
+    for account in accounts:
+        engine.add(account.name, account.run, stop=account.stop)
+    names = [account.name for account in accounts]
+    try:
+        assert until(lambda: engine.status()[names[2]] == 'done')
+        assert [engine.status()[name] for name in names[:2]] == ['running', 'running']
+        first = accounts[0].worker
+        start = time.time()
+        assert engine.stop_account(names[0], timeout=5)
+        assert time.time() - start < 2
+        assert engine.status()[names[0]] == 'cancelled' and first.stopped
+        engine.restart_account(names[0])
+        assert until(lambda: engine.status()[names[0]] == 'running')
+        # The restarted account plays on a new GameControl, the old one is closed
+        assert accounts[0].worker is not first and not accounts[0].stopped
+        assert engine.status()[names[1]] == 'running'
+    finally:
+        engine.stop()
+    assert all(state in ('cancelled', 'done') for state in engine.status().values())
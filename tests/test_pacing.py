@@ -0,0 +1,111 @@
+import asyncio
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Pacing import FrameChangePolicy, Pacer, PacingStats
+
+
+class FakeFrame():
+    def __init__(self, picture, changed):
+        self.picture = picture
+        self.changed = changed
+
+
+class FakeDetector():
+    def changed(self, previous, frame):
+        return previous.picture != frame.picture
+
+
+class FakeGui():
+    def __init__(self, pictures, reference):
+        '''
+        Serves the pictures in order, the last one forever, frame.changed compares with the frame before
+        '''
+        self.run = True
+        self.change_detector = FakeDetector()
+        self.input_frame = FakeFrame(reference, None)
+        self.pictures = list(pictures)
+        self.captures = 0
+        self.previous = None
+
+    def new_frame(self, delay=0):
+        time.sleep(delay)
+        picture = self.pictures[min(self.captures, len(self.pictures) - 1)]
+        self.captures += 1
+        # The first frame after the click can not be compared
+        changed = None if self.previous is None else self.previous != picture
+        self.previous = picture
+        return FakeFrame(picture, changed)
+
+    def stop(self):
+        self.run = False
+
+
+def wait(gui, policy):
+    return Pacer(gui, {'point': policy}, PacingStats(path=None)).wait('point')
+
+
+def test_waits_for_the_screen_to_leave_the_clicked_picture():
+    # The dialog shows up on the 4th capture, the frames before are the clicked screen
+    gui = FakeGui(['menu', 'menu', 'menu', 'dialog'], 'menu')
+    waited = wait(gui, FrameChangePolicy(2, settle=0.1, interval=0.05, minimum=0.05))
+    assert gui.captures >= 6
+    assert waited < 1
+
+
+def test_gives_up_at_maximum():
+    gui = FakeGui(['menu'], 'menu')
+    waited = wait(gui, FrameChangePolicy(0.4, settle=0.1, interval=0.05, minimum=0.05))
+    assert 0.4 <= waited < 0.6
+
+
+def test_minimum_without_reference():
+    gui = FakeGui(['menu'], 'menu')
+    gui.input_frame = None
+    waited = wait(gui, FrameChangePolicy(2, settle=0.1, interval=0.05, minimum=0.5))
+    assert 0.5 <= waited < 1
+
+
+def test_measures_of_a_child_are_merged_once(tmp_path):
+    path = str(tmp_path / 'pacing.json')
+    child = PacingStats(path)
+    child.journal()
+    child.record_wait('point', 1.0)
+    child.record_duration('point', 2.0)
+    parent = PacingStats(path)
+    parent.merge(child.drain())
+    assert child.drain() == {}
+    parent.save(True)
+    assert not os.path.exists(path + '.tmp')
+    loaded = PacingStats(path)
+    assert loaded.durations('point') == [2.0]
+    assert loaded.report()['point']['count'] == 1
+
+
+def test_async_wait_does_not_hold_the_executor():
+    gui = FakeGui(['menu'], 'menu')
+    pacer = Pacer(gui, {'point': FrameChangePolicy(0.5, interval=0.05)}, PacingStats(path=None))
+    executor = ThreadPoolExecutor(1)
+
+    async def main():
+        start = time.time()
+        wait = asyncio.ensure_future(pacer.wait_async('point', executor=executor))
+        await asyncio.sleep(0.1)
+        # The only executor thread is free between two captures of the wait
+        await asyncio.get_event_loop().run_in_executor(executor, time.sleep, 0)
+        served = time.time() - start
+        waited = await wait
+        return served, waited
+
+    try:
+        served, waited = asyncio.run(main())
+    finally:
+        executor.shutdown()
+    assert served < 0.3
+    assert waited >= 0.5
+    assert gui.captures >= 3
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import ReplayCapture
+from GameControl import GameControl
+from PopupDetectors import PopupDetector, PopupRegistry, PopupWatcher
+from RoiIndex import RoiIndex
+
+TEMPLATE = './screenshots/coopwanted.PNG'
+
+
+@pytest.fixture
+def frames(tmp_path, monkeypatch):
+    '''
+    A screen without the popup, then the popup staying on screen: folder of the frames
+    '''
+    monkeypatch.chdir(ROOT)
+    template = cv2.imread(TEMPLATE)
+    height, width = template.shape[:2]
+    folder = tmp_path / 'frames'
+    folder.mkdir()
+    rng = np.random.RandomState(0)
+    background = rng.randint(0, 255, (640, 1136, 3)).astype(np.uint8)
+    cv2.imwrite(str(folder / '0.png'), background)
+    shown = background.copy()
+    shown[400:400 + height, 700:700 + width] = template
+    for index in range(1, 6):
+        cv2.imwrite(str(folder / ('%d.png' % index)), shown)
+    return str(folder)
+
+
+def watched(folder, interval):
+    gui = GameControl(0, 0, ReplayCapture(folder, speed=0))
+    gui.dry_run = True
+    # Regions learned on these frames stay out of the roi_index.json of the bot
+    gui.roi_index = RoiIndex(path=None)
+    found = []
+    registry = PopupRegistry()
+    registry.register(PopupDetector('coop_wanted', TEMPLATE, lambda gui, position: found.append(position), interval=interval))
+    gui.popups = PopupWatcher(gui, registry)
+    return gui, found
+
+
+def test_static_popup_shown_between_two_checks(frames):
+    gui, found = watched(frames, 0.3)
+    try:
+        gui.new_frame()
+        # The popup shows up before the detector is due again, then stays on screen
+        assert gui.new_frame().changed
+        assert found == []
+        time.sleep(0.4)
+        frame = gui.new_frame()
+        assert frame.changed is False
+        assert len(found) == 1
+        assert abs(found[0][0] - 721) <= 1 and abs(found[0][1] - 421) <= 1
+    finally:
+        gui.close()
+
+
+def test_unchanged_anchor_is_checked_once(frames):
+    gui, found = watched(frames, 0)
+    gui.popups.registry.detectors()[0].cooldown = 0
+    calls = []
+    find_batch = gui.find_batch
+    gui.find_batch = lambda requests, frame=None: calls.append(frame) or find_batch(requests, frame)
+    try:
+        gui.new_frame()
+        gui.new_frame()
+        gui.new_frame()
+        gui.new_frame()
+        # The popup frame and the first unchanged frame share their anchor, only the anchor is matched
+        assert len(calls) == 2
+        assert len(found) == 1
+    finally:
+        gui.close()
+
+
+def test_popups_without_template_are_left_out(frames):
+    registry = PopupRegistry()
+    assert registry.register_if_present(PopupDetector('missing', './screenshots/missing.png', None)) is None
+    assert registry.register_if_present(PopupDetector('coop_wanted', './screenshots/coopwanted.png', None)) is not None
+    assert [detector.name for detector in registry.detectors()] == ['coop_wanted']
@@ -0,0 +1,83 @@
+import json
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Frame import Frame
+from Recorder import DELTA, EVENT, INDEX_FILE, KEYFRAME, Recorder, RecordingReader
+
+START = 1000.0
+
+
+def pictures(count):
+    '''
+    Noise pictures, each one moves a small block of the previous one
+    '''
+    rng = np.random.RandomState(5)
+    bgra = rng.randint(0, 255, (32, 48, 4)).astype(np.uint8)
+    result = []
+    for index in range(count):
+        bgra = bgra.copy()
+        bgra[index:index + 4, 2*index:2*index + 4] = rng.randint(0, 255, (4, 4, 4))
+        result.append(bgra)
+    return result
+
+
+@pytest.fixture
+def recording(tmp_path):
+    '''
+    Seven frames one second apart in chunks of three, and a click: (folder, pictures)
+    '''
+    folder = str(tmp_path / 'recording')
+    recorder = Recorder(folder, fps=0, keyframe_interval=3, cpu_budget=100).start()
+    shown = pictures(7)
+    for index, bgra in enumerate(shown):
+        assert recorder.record_frame(Frame(bgra, timestamp=START + index))
+        if index == 3:
+            recorder.record_event('click', (10, 20), timestamp=START + index + 0.5)
+    recorder.stop()
+    assert recorder.dropped == 0
+    return folder, shown
+
+
+def test_frames_round_trip(recording):
+    folder, shown = recording
+    reader = RecordingReader(folder)
+    assert [len(chunk['frames']) for chunk in reader.chunks] == [3, 3, 1]
+    kinds = [[kind for offset, kind, timestamp, data, shape in reader._records(chunk['file']) if kind != EVENT]
+             for chunk in reader.chunks]
+    assert kinds == [[KEYFRAME, DELTA, DELTA], [KEYFRAME, DELTA, DELTA], [KEYFRAME]]
+    replayed = [(timestamp, img.copy()) for timestamp, img in reader.frames()]
+    assert [timestamp for timestamp, img in replayed] == [START + index for index in range(7)]
+    for (timestamp, img), bgra in zip(replayed, shown):
+        assert np.array_equal(img, bgra[:, :, :3])
+    assert list(reader.events()) == [(START + 3.5, 'click', [10, 20])]
+
+
+def test_seek(recording):
+    folder, shown = recording
+    reader = RecordingReader(folder)
+    # Inside the second chunk, decoded from its keyframe
+    timestamp, img = reader.seek(START + 4.5)
+    assert timestamp == START + 4 and np.array_equal(img, shown[4][:, :, :3])
+    timestamp, img = reader.seek(START + 100)
+    assert timestamp == START + 6 and np.array_equal(img, shown[6][:, :, :3])
+    assert reader.seek(START - 1) is None
+    assert [timestamp for timestamp, img in reader.frames(START + 2)] == [START + index for index in range(2, 7)]
+
+
+def test_chunks_missing_from_the_index_are_scanned(recording):
+    folder, shown = recording
+    with open(os.path.join(folder, INDEX_FILE)) as f:
+        indexed = json.load(f)['chunks']
+    os.remove(os.path.join(folder, INDEX_FILE))
+    reader = RecordingReader(folder)
+    assert [chunk['frames'] for chunk in reader.chunks] == [chunk['frames'] for chunk in indexed]
+    timestamp, img = reader.seek(START + 5)
+    assert np.array_equal(img, shown[5][:, :, :3])
@@ -0,0 +1,76 @@
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import ReplayCapture
+from GameControl import GameControl
+import Pacing
+import RoiIndex
+
+TEMPLATE = './screenshots/Soul/start.png'
+
+
+@pytest.fixture
+def replay(tmp_path, monkeypatch):
+    '''
+    Two screenshots, the second one shows the start button: folder and center of the button
+    '''
+    # The template paths of the repo are relative to its root
+    monkeypatch.chdir(ROOT)
+    # Timings and regions learned on these frames stay out of the pacing.json and roi_index.json of the bot
+    monkeypatch.setattr(Pacing, '_stats', Pacing.PacingStats(path=None))
+    monkeypatch.setattr(RoiIndex, '_index', RoiIndex.RoiIndex(path=None))
+    template = cv2.imread(TEMPLATE)
+    height, width = template.shape[:2]
+    folder = tmp_path / 'frames'
+    folder.mkdir()
+    background = np.full((640, 1136, 3), 40, np.uint8)
+    cv2.imwrite(str(folder / 'a.png'), background)
+    shown = background.copy()
+    shown[300:300 + height, 500:500 + width] = template
+    cv2.imwrite(str(folder / 'b.png'), shown)
+    return str(folder), (500 + width // 2, 300 + height // 2)
+
+
+def test_find_on_replay(replay):
+    folder, center = replay
+    gui = GameControl(0, 0, ReplayCapture(folder, speed=0))
+    gui.dry_run = True
+    gui.popups = None
+    assert gui.new_frame() is not None
+    assert gui.find_game_img(TEMPLATE, gray=0) is False
+    assert gui.new_frame().changed
+    position = gui.find_game_img(TEMPLATE, gray=0)
+    assert position is not False
+    assert abs(position[0] - center[0]) <= 1 and abs(position[1] - center[1]) <= 1
+    assert gui.new_frame() is None
+
+
+def test_processing_replay(replay):
+    folder, center = replay
+    # Imported here, Processing preloads its templates from the working directory
+    import Processing as game
+    worker = game.Processing('replay', 6, 1, capture=ReplayCapture(folder, speed=0))
+    assert worker.hwnd == 0
+    worker.stop()
+    worker.run()
+    assert worker.completed == 0
+
+
+def test_party_modes_are_scripts(replay):
+    folder, center = replay
+    import Processing as game
+    for mode in (1, 2):
+        worker = game.Processing('replay', mode, 1, isCaptain=True, capture=ReplayCapture(folder, speed=0))
+        script = worker.script()
+        assert script.send(None) == ('frame', 0.1)
+        # The round ends at the end of its iteration, without any thread left behind
+        worker.stop()
+        worker.play(script)
+        worker.gui.close()
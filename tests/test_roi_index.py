@@ -0,0 +1,84 @@
+import json
+import os
+import sys
+import pytest
+
+np = pytest.importorskip('numpy')
+cv2 = pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from Frame import Frame
+from Matcher import match_in_frame
+from RoiIndex import RoiIndex
+
+TEMPLATE = 'button.png'
+
+
+def frame_with(template, x, y):
+    '''
+    Noise frame showing template with its top left corner at (x, y)
+    '''
+    bgra = np.random.RandomState(1).randint(0, 255, (640, 1136, 4)).astype(np.uint8)
+    height, width = template.shape[:2]
+    bgra[y:y + height, x:x + width, :3] = template
+    return Frame(bgra)
+
+
+@pytest.fixture
+def template():
+    return np.random.RandomState(2).randint(0, 255, (40, 60, 3)).astype(np.uint8)
+
+
+def find(index, template, x, y):
+    return match_in_frame(frame_with(template, x, y), TEMPLATE, template, 0, 0.9, index)
+
+
+def test_region_miss_falls_back_to_the_full_frame(template):
+    index = RoiIndex(path=None)
+    for _ in range(5):
+        assert find(index, template, 100, 100)[1] == (100, 100)
+    assert index.region(TEMPLATE, 1136, 640) == (84, 84, 176, 156)
+    # Shown somewhere else after many hits: found at once and learned
+    score, position = find(index, template, 900, 500)
+    assert score > 0.9 and position == (900, 500)
+    assert index.box(TEMPLATE) == (100, 100, 960, 540)
+
+
+def test_trusted_misses_are_opt_in(template):
+    index = RoiIndex(path=None)
+    index.set_trust(TEMPLATE)
+    for _ in range(3):
+        find(index, template, 100, 100)
+    assert find(index, template, 900, 500)[0] < 0.9
+
+
+def test_matching_does_not_write_the_file(template, tmp_path):
+    path = str(tmp_path / 'roi.json')
+    index = RoiIndex(path=path)
+    index.start_autosave()
+    find(index, template, 100, 100)
+    assert not os.path.exists(path)
+    index.close()
+    assert RoiIndex(path=path).box(TEMPLATE) == (100, 100, 160, 140)
+
+
+def test_keys_are_relative_to_the_repo(tmp_path, monkeypatch):
+    path = str(tmp_path / 'roi.json')
+    index = RoiIndex(path=path)
+    index.record(os.path.join(ROOT, 'screenshots', 'Soul', 'start.png'), (10, 20), (30, 40))
+    index.close()
+    with open(path) as f:
+        assert list(json.load(f)) == ['screenshots/soul/start.png']
+    # Another working directory, the same template
+    monkeypatch.chdir(ROOT)
+    assert RoiIndex(path=path).box('./screenshots/Soul/start.PNG') == (10, 20, 40, 60)
+
+
+def test_absolute_keys_of_older_files_are_loaded(tmp_path):
+    path = str(tmp_path / 'roi.json')
+    key = os.path.normcase(os.path.join(ROOT, 'screenshots', 'soul', 'start.png')).lower()
+    with open(path, 'w') as f:
+        json.dump({key: {'box': [10, 20, 40, 60], 'hits': 3}}, f)
+    assert RoiIndex(path=path).box(os.path.join(ROOT, 'screenshots', 'Soul', 'start.png')) == (10, 20, 40, 60)
@@ -0,0 +1,70 @@
+import os
+import sys
+import time
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('cv2')
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from CaptureBackend import CaptureBackend
+from Frame import Frame
+from GameControl import GameControl
+from Waiter import ColorTarget
+
+RED = (255, 0, 0)
+
+
+class StillCapture(CaptureBackend):
+    def __init__(self):
+        '''
+        The same screen on every capture, a red square at (40, 40)
+        '''
+        self.bgra = np.full((120, 160, 4), 60, np.uint8)
+        self.bgra[40:50, 40:50, :3] = (0, 0, 255)
+        self.captures = 0
+
+    def capture(self):
+        self.captures += 1
+        return Frame(self.bgra.copy())
+
+
+def control():
+    gui = GameControl(0, 0, StillCapture())
+    gui.dry_run = True
+    gui.popups = None
+    return gui
+
+
+def test_target_on_screen_is_found_at_once():
+    gui = control()
+    gui.waiter.interval = 1.0
+    start = time.time()
+    result = gui.wait_any([ColorTarget(((0, 0), (100, 100)), RED)], timeout=5)
+    assert result and result.position == (40, 40)
+    assert time.time() - start < 0.2
+
+
+def test_target_on_screen_is_found_at_once_with_a_capture_thread():
+    gui = control()
+    gui.start_capture_thread(fps=1)
+    try:
+        time.sleep(0.1)
+        start = time.time()
+        assert gui.wait_any([ColorTarget(((0, 0), (100, 100)), RED)], timeout=5, interval=1.0)
+        assert gui.wait_game_color(((0, 0), (100, 100)), RED, quit=False)
+        assert time.time() - start < 0.2
+    finally:
+        gui.stop_capture_thread()
+
+
+def test_knn_wait_skips_unchanged_frames(monkeypatch):
+    gui = control()
+    calls = []
+    monkeypatch.setattr(gui, 'find_img_knn', lambda path, thread=0: calls.append(path) or (0, 0))
+    assert gui.wait_game_img_knn('missing.png', max_time=0.6, quit=False) is False
+    # Every frame is the same picture, the keypoints were matched on the first one only
+    assert gui.capture.captures > 5
+    assert calls == ['missing.png']